@@ -0,0 +1,101 @@
+"""
+Incremental BM25 inverted index over short documents.
+
+Documents get consecutive integer ids as they are added, and postings
+lists stay sorted by id. A query touches only the postings of its own
+terms, and the top k come from a heap rather than a full sort.
+"""
+
+from typing import Dict, List, Tuple
+import bisect
+import heapq
+import math
+import re
+import threading
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens."""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """Append-only BM25 index; document ids are 0, 1, 2, ... in insertion order."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty index.
+
+        Args:
+            k1: Term frequency saturation
+            b: Document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._lengths: List[int] = []
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, text: str) -> int:
+        """
+        Index a document.
+
+        Args:
+            text: Document text
+
+        Returns:
+            The document id
+        """
+        counts: Dict[str, int] = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        with self._lock:
+            doc_id = len(self._lengths)
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+            for term, frequency in counts.items():
+                doc_ids, frequencies = self._postings.setdefault(term, ([], []))
+                doc_ids.append(doc_id)
+                frequencies.append(frequency)
+        return doc_id
+
+    def search(self, query: str, k: int = 3, start: int = 0) -> List[Tuple[int, float]]:
+        """
+        Find the best-matching documents.
+
+        Args:
+            query: Query text
+            k: Number of results
+            start: Only consider documents with id >= start
+
+        Returns:
+            (document id, score) pairs, best first; only documents sharing a
+            term with the query are returned
+        """
+        terms = set(tokenize(query))
+        scores: Dict[int, float] = {}
+        with self._lock:
+            count = len(self._lengths)
+            if not count or k <= 0:
+                return []
+            average_length = self._total_length / count or 1.0
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                doc_ids, frequencies = postings
+                idf = math.log(1.0 + (count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+                for i in range(bisect.bisect_left(doc_ids, start), len(doc_ids)):
+                    doc_id = doc_ids[i]
+                    frequency = frequencies[i]
+                    norm = self.k1 * (1.0 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lengths)
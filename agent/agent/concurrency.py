@@ -0,0 +1,101 @@
+"""
+Shared executor for blocking work on the async request path.
+
+Transformer inference, embedding calls and JSON store rewrites block the
+calling thread. Async code hands them to a bounded, process-wide thread pool
+through run_blocking() so the event loop keeps serving other requests.
+
+Blocking calls that mostly wait on the network (embedding a query for
+retrieval) go through run_io() instead, on a larger pool sized for the
+number of requests in flight, so they neither starve CPU-bound work of
+workers nor queue behind it.
+
+Work that no request waits for (summaries, write-behind indexing, index
+maintenance) runs on a separate background pool, so slow provider calls
+there cannot take workers away from requests.
+"""
+
+from typing import Any, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import os
+
+T = TypeVar("T")
+
+# Bounded so CPU-bound work cannot oversubscribe the host under load
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("AGENT_EXECUTOR_WORKERS", "4")),
+    thread_name_prefix="agent-worker"
+)
+
+
+# I/O waits use no CPU, so this pool is sized for concurrent requests, not cores
+_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("AGENT_IO_WORKERS", "32")),
+    thread_name_prefix="agent-io"
+)
+
+
+# Background jobs are coalesced per owner, so a small pool keeps up
+_background_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("AGENT_BACKGROUND_WORKERS", "2")),
+    thread_name_prefix="agent-background"
+)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the shared executor for blocking agent work."""
+    return _executor
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Get the executor for blocking calls that wait on the network."""
+    return _io_executor
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    """Get the executor for background work that no request waits on."""
+    return _background_executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking callable on the shared executor and await its result.
+
+    Context variables of the caller are propagated to the worker thread.
+
+    Args:
+        func: Blocking callable to run
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        The callable's return value
+    """
+    return await _run_in(_executor, func, *args, **kwargs)
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking, network-bound callable on the I/O executor and await its result.
+
+    Context variables of the caller are propagated to the worker thread.
+
+    Args:
+        func: Blocking callable to run
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        The callable's return value
+    """
+    return await _run_in(_io_executor, func, *args, **kwargs)
+
+
+async def _run_in(executor: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
@@ -0,0 +1,236 @@
+"""
+Append-only, disk-backed log of a user's conversation turns.
+
+Each turn is appended as one JSON line to <user>_conversations.jsonl, and
+the byte offset of that line is appended to <user>_conversations.idx as a
+little-endian uint64, so turn i can be located without scanning the log.
+Only the most recent turns are kept in memory. Older turns are read on
+demand, a page of consecutive lines at a time, through memory maps of both
+files, so memory per user stays constant however long the conversation
+gets.
+
+Without a storage location the log lives purely in memory (anonymous
+sessions), with no window.
+"""
+
+from typing import Dict, List, Any, Iterator, Optional, Union
+from collections import deque
+import json
+import mmap
+import os
+import struct
+import threading
+
+from agent.metrics import record_store_io
+
+_OFFSET = struct.Struct("<Q")
+
+# Turns decoded per read when iterating over the whole log
+PAGE_TURNS = 256
+
+
+class ConversationLog:
+    """Sequence of conversation turns backed by a JSONL file and an offset index."""
+
+    def __init__(self, storage_dir: Optional[str] = None, user_id: Optional[str] = None, window: int = 50):
+        """
+        Open or create a user's log.
+
+        Args:
+            storage_dir: Directory holding the log files
+            user_id: User the log belongs to; without it the log is in-memory only
+            window: Number of most recent turns kept in memory
+        """
+        self._lock = threading.RLock()
+        self._count = 0
+        self._log_size = 0
+        self._log_map: Optional[mmap.mmap] = None
+        self._index_map: Optional[mmap.mmap] = None
+
+        if storage_dir and user_id:
+            self.window = max(1, window)
+            self.log_path = os.path.join(storage_dir, f"{user_id}_conversations.jsonl")
+            self.index_path = os.path.join(storage_dir, f"{user_id}_conversations.idx")
+            self._tail: deque = deque(maxlen=self.window)
+            self._open(os.path.join(storage_dir, f"{user_id}_conversations.json"))
+        else:
+            self.window = None
+            self.log_path = self.index_path = None
+            self._tail = deque()
+
+    def append(self, turn: Dict[str, Any]):
+        """
+        Append a turn, writing it to disk immediately.
+
+        Args:
+            turn: JSON-serializable turn record
+        """
+        with self._lock:
+            if self.log_path:
+                line = (json.dumps(turn, default=str) + "\n").encode("utf-8")
+                # The line goes first: an offset never points past the log,
+                # and a line without an offset is recovered on the next open
+                with open(self.log_path, "ab") as f:
+                    f.write(line)
+                with open(self.index_path, "ab") as f:
+                    f.write(_OFFSET.pack(self._log_size))
+                record_store_io("conversations", "write")
+                self._log_size += len(line)
+            self._tail.append(turn)
+            self._count += 1
+
+    def tail(self) -> List[Dict[str, Any]]:
+        """Get the turns held in memory, oldest first."""
+        with self._lock:
+            return list(self._tail)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, key: Union[int, slice]):
+        with self._lock:
+            if isinstance(key, slice):
+                start, stop, step = key.indices(self._count)
+                if step != 1:
+                    return self[start:stop][::step]
+                return self._read_range(start, stop)
+            if key < 0:
+                key += self._count
+            if not 0 <= key < self._count:
+                raise IndexError("conversation turn out of range")
+            return self._read_range(key, key + 1)[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for start in range(0, len(self), PAGE_TURNS):
+            yield from self[start:start + PAGE_TURNS]
+
+    def close(self):
+        """Release the memory maps; they are re-created on the next disk read."""
+        with self._lock:
+            for mapped in (self._log_map, self._index_map):
+                if mapped is not None:
+                    mapped.close()
+            self._log_map = self._index_map = None
+
+    def _read_range(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Turns start..stop, from memory where possible and one mapped page for the rest. Caller holds the lock."""
+        if start >= stop:
+            return []
+        tail_start = self._count - len(self._tail)
+        turns = []
+        if start < tail_start:
+            turns = self._read_disk(start, min(stop, tail_start))
+        turns.extend(self._tail[i - tail_start] for i in range(max(start, tail_start), stop))
+        return turns
+
+    def _read_disk(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Decode turns start..stop from one contiguous slice of the mapped log. Caller holds the lock."""
+        self._index_map = self._mapped(self.index_path, self._index_map, self._count * _OFFSET.size)
+        self._log_map = self._mapped(self.log_path, self._log_map, self._log_size)
+        begin = _OFFSET.unpack_from(self._index_map, start * _OFFSET.size)[0]
+        end = _OFFSET.unpack_from(self._index_map, stop * _OFFSET.size)[0] if stop < self._count else self._log_size
+        record_store_io("conversations", "read")
+        return [json.loads(line) for line in self._log_map[begin:end].splitlines()]
+
+    @staticmethod
+    def _mapped(path: str, mapped: Optional[mmap.mmap], size: int) -> mmap.mmap:
+        """Map a file read-only, re-mapping when it has grown past the current map."""
+        if mapped is not None and len(mapped) >= size:
+            return mapped
+        if mapped is not None:
+            mapped.close()
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _open(self, legacy_path: str):
+        """Load the offset index, repair a crashed append and fill the in-memory window."""
+        if not os.path.exists(self.log_path):
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self._import_legacy(legacy_path)
+            return
+
+        self._log_size = os.path.getsize(self.log_path)
+        data = b""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            record_store_io("conversations", "read")
+        usable = len(data) - len(data) % _OFFSET.size
+        offsets = [offset for (offset,) in _OFFSET.iter_unpack(data[:usable])]
+        stored = len(offsets)
+        # Offsets beyond the log belong to lines that never made it
+        while offsets and offsets[-1] >= self._log_size:
+            offsets.pop()
+
+        recovered = self._recover(offsets)
+        self._count = len(offsets)
+        # Rewrite unless the file on disk already holds exactly these offsets
+        if recovered or len(offsets) != stored or usable != len(data):
+            with open(self.index_path, "wb") as f:
+                f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+
+        if self._count:
+            tail_start = max(0, self._count - self.window)
+            with open(self.log_path, "rb") as f:
+                f.seek(offsets[tail_start])
+                lines = f.read().splitlines()
+            self._tail.extend(json.loads(line) for line in lines)
+
+    def _recover(self, offsets: List[int]) -> bool:
+        """
+        Re-index the lines after the last indexed one and drop a torn final line.
+
+        Only the end of the log is scanned.
+
+        Returns:
+            True if the offsets changed
+        """
+        original = list(offsets)
+        scan_from = offsets.pop() if offsets else 0
+        with open(self.log_path, "rb") as f:
+            f.seek(scan_from)
+            data = f.read()
+        position = scan_from
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                # A torn write: the turn was never acknowledged
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(position)
+                self._log_size = position
+                break
+            offsets.append(position)
+            position += len(line)
+        return offsets != original
+
+    def _import_legacy(self, legacy_path: str):
+        """Move turns from the old whole-file JSON store into the log."""
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r") as f:
+                record_store_io("conversations", "read")
+                turns = json.load(f)
+        except Exception as e:
+            print(f"Error loading conversations: {e}")
+            return
+
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        lines = [(json.dumps(turn, default=str) + "\n").encode("utf-8") for turn in turns]
+        offsets = []
+        for line in lines:
+            offsets.append(self._log_size)
+            self._log_size += len(line)
+        with open(self.log_path, "wb") as f:
+            f.write(b"".join(lines))
+        with open(self.index_path, "wb") as f:
+            f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+        record_store_io("conversations", "write")
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+        self._count = len(turns)
+        self._tail.extend(turns[-self.window:])
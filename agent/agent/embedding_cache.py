@@ -0,0 +1,341 @@
+"""
+Persistent, content-addressed cache for embedding vectors.
+
+Vectors are keyed on (provider, model, sha256(task, text)), where the task
+tells query vectors from document vectors: some providers embed the same
+text differently for each. Each provider/model
+pair gets its own directory holding a memory-mapped float32 matrix of
+vectors and a memory-mapped array of the 32-byte text digests stored in
+each row, so a lookup is a dictionary probe plus a row read: no JSON parse
+and no network call. Rows are reused in ring-buffer order once the cache is
+full, which bounds its size on disk.
+
+The files are not locked; a cache directory should be used by one process.
+"""
+
+from typing import Dict, List, Any, Optional
+import hashlib
+import json
+import os
+import threading
+import weakref
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from agent.metrics import metrics
+
+DIGEST_SIZE = 32
+
+_EMPTY_DIGEST = bytes(DIGEST_SIZE)
+
+
+# Open stores, flushed together on shutdown
+_stores: "weakref.WeakSet[EmbeddingStore]" = weakref.WeakSet()
+
+
+def text_digest(text: str, task: str = "document") -> bytes:
+    """
+    SHA-256 digest of a text, the content address of its vector.
+
+    Args:
+        text: Embedded text
+        task: "document" or "query"; the same text gets a separate vector per task
+
+    Returns:
+        32-byte digest
+    """
+    return hashlib.sha256(f"{task}\n{text}".encode("utf-8")).digest()
+
+
+def flush_embedding_caches():
+    """Flush every open embedding cache to disk."""
+    for store in list(_stores):
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"Error flushing embedding cache: {e}")
+
+
+class EmbeddingStore:
+    """
+    Fixed-capacity vector store backed by memory-mapped files.
+
+    Files in the store directory:
+    - vectors.f32: capacity x dimension float32 matrix
+    - keys.bin: capacity x 32 byte text digests (all zeros for empty rows)
+    - meta.json: dimension, capacity and the next row to write
+    """
+
+    def __init__(self, directory: str, capacity: int = 50000):
+        """
+        Open or lazily create a store.
+
+        Args:
+            directory: Directory holding the store files
+            capacity: Maximum number of vectors kept
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.directory = directory
+        self.capacity = capacity
+        self.dimension: Optional[int] = None
+        self._next = 0
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._index: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+        self._open()
+        _stores.add(self)
+
+    def get(self, digest: bytes) -> Optional[List[float]]:
+        """
+        Get the vector stored for a text digest.
+
+        Args:
+            digest: Digest from text_digest()
+
+        Returns:
+            The vector, or None if it is not cached
+        """
+        with self._lock:
+            row = self._index.get(digest)
+            if row is None:
+                return None
+            return self._vectors[row].tolist()
+
+    def put_many(self, digests: List[bytes], vectors: List[List[float]]):
+        """
+        Store vectors, overwriting the oldest rows once the store is full.
+
+        Args:
+            digests: Text digests
+            vectors: Vectors for each digest
+        """
+        if not digests:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._create(len(vectors[0]))
+            for digest, vector in zip(digests, vectors):
+                if len(vector) != self.dimension or digest in self._index:
+                    continue
+                row = self._next
+                evicted = bytes(self._keys[row])
+                if evicted != _EMPTY_DIGEST:
+                    self._index.pop(evicted, None)
+                self._vectors[row] = vector
+                self._keys[row] = np.frombuffer(digest, dtype=np.uint8)
+                self._index[digest] = row
+                self._next = (row + 1) % self.capacity
+
+    def flush(self):
+        """Flush the memory-mapped files and the ring position to disk."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._keys.flush()
+                self._write_meta()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self):
+        """Map an existing store and rebuild the in-memory key index."""
+        try:
+            with open(self._path("meta.json"), "r") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error loading embedding cache metadata, starting empty: {e}")
+            return
+
+        if meta.get("capacity") != self.capacity:
+            print("Embedding cache capacity changed, starting empty")
+            return
+
+        try:
+            self.dimension = meta["dimension"]
+            self._next = meta["next"] % self.capacity
+            self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+",
+                                      shape=(self.capacity, self.dimension))
+            self._keys = np.memmap(self._path("keys.bin"), dtype=np.uint8, mode="r+",
+                                   shape=(self.capacity, DIGEST_SIZE))
+        except Exception as e:
+            print(f"Error opening embedding cache, starting empty: {e}")
+            self.dimension = None
+            self._next = 0
+            self._vectors = self._keys = None
+            return
+
+        occupied = np.flatnonzero(self._keys.any(axis=1))
+        self._index = {bytes(self._keys[row]): int(row) for row in occupied}
+
+    def _create(self, dimension: int):
+        """Create empty store files for vectors of the given dimension. Caller holds the lock."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.dimension = dimension
+        self._next = 0
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="w+",
+                                  shape=(self.capacity, dimension))
+        self._keys = np.memmap(self._path("keys.bin"), dtype=np.uint8, mode="w+",
+                               shape=(self.capacity, DIGEST_SIZE))
+        self._index = {}
+        self._write_meta()
+
+    def _write_meta(self):
+        """
+        Persist the dimension and ring position. Caller holds the lock.
+
+        Written only on creation and flush(), through a temporary file, so a
+        crash leaves the previous meta.json intact. A stale ring position
+        only means some rows are overwritten out of order.
+        """
+        path = self._path("meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"dimension": self.dimension, "capacity": self.capacity, "next": self._next}, f)
+        os.replace(path + ".tmp", path)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingStore.
+
+    Only texts missing from the cache are sent to the wrapped embeddings,
+    in a single call per request.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 provider: str,
+                 model: str,
+                 cache_dir: str = "./embedding_cache",
+                 capacity: int = 50000):
+        """
+        Wrap an embeddings client with a persistent cache.
+
+        Args:
+            embeddings: The embeddings client to cache
+            provider: Provider name, part of the cache key
+            model: Embedding model name, part of the cache key
+            cache_dir: Root directory of the on-disk caches
+            capacity: Maximum number of vectors kept for this provider and model
+        """
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        safe_model = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)
+        self.store = EmbeddingStore(os.path.join(cache_dir, f"{provider}_{safe_model}"), capacity)
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup(texts, "document")
+        if missing:
+            self._fill(vectors, missing, self.embeddings.embed_documents(list(missing)), "document")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vectors, missing = self._lookup([text], "query")
+        if missing:
+            self._fill(vectors, missing, [self.embeddings.embed_query(text)], "query")
+        return vectors[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup(texts, "document")
+        if missing:
+            self._fill(vectors, missing, await self.embeddings.aembed_documents(list(missing)), "document")
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, missing = self._lookup([text], "query")
+        if missing:
+            self._fill(vectors, missing, [await self.embeddings.aembed_query(text)], "query")
+        return vectors[0]
+
+    def flush(self):
+        """Flush the cache files to disk."""
+        self.store.flush()
+
+    def close(self):
+        """Flush the cache files; called when the shared component is unloaded."""
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with provider, model, size and hit/miss counters
+        """
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                "provider": self.provider,
+                "model": self.model,
+                "size": len(self.store),
+                "capacity": self.store.capacity,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0
+            }
+
+    def _lookup(self, texts: List[str], task: str):
+        """
+        Resolve cached vectors for a task ("document" or "query").
+
+        Returns:
+            The vector list (None where missing) and a dict mapping each
+            missing text to the positions it fills, in first-seen order
+        """
+        vectors: List[Optional[List[float]]] = []
+        missing: Dict[str, List[int]] = {}
+        for position, text in enumerate(texts):
+            vector = self.store.get(text_digest(text, task))
+            vectors.append(vector)
+            if vector is None:
+                missing.setdefault(text, []).append(position)
+
+        hits = len(texts) - sum(len(positions) for positions in missing.values())
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += len(texts) - hits
+        metrics.increment("mindguard_embedding_cache_lookups_total", hits, provider=self.provider, result="hit")
+        metrics.increment("mindguard_embedding_cache_lookups_total", len(texts) - hits, provider=self.provider, result="miss")
+        return vectors, missing
+
+    def _fill(self, vectors: List[Optional[List[float]]], missing: Dict[str, List[int]], embedded: List[List[float]], task: str):
+        """Place freshly embedded vectors and store them in the cache."""
+        for positions, vector in zip(missing.values(), embedded):
+            for position in positions:
+                vectors[position] = vector
+        try:
+            self.store.put_many([text_digest(text, task) for text in missing], embedded)
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+
+
+def embedding_cache_enabled() -> bool:
+    """The embedding cache is opt-in through EMBEDDING_CACHE_ENABLED."""
+    return os.environ.get("EMBEDDING_CACHE_ENABLED") == "true"
+
+
+def create_cached_embeddings(embeddings: Embeddings, provider: str, model: str) -> CachedEmbeddings:
+    """Wrap embeddings in a cache configured from EMBEDDING_CACHE_* environment variables."""
+    return CachedEmbeddings(
+        embeddings,
+        provider=provider,
+        model=model,
+        cache_dir=os.environ.get("EMBEDDING_CACHE_DIR", "./embedding_cache"),
+        capacity=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+    )
+
+
+metrics.describe("mindguard_embedding_cache_lookups_total", "Embedding cache lookups per provider by result")
@@ -54,6 +54,9 @@ class EmotionAnalyzer:
         # Initialize the primary analyzer with fallbacks
         self.analyzer = self._initialize_analyzer()
         
+        # Whether the primary analyzer is a transformer pipeline (batchable)
+        self.model_backed = self.analyzer != self._hybrid_emotion_analyzer
+        
     def _initialize_emotion_lexicon(self) -> Dict[str, List[str]]:
         """Initialize the emotion lexicon for fallback detection."""
         # Comprehensive emotion lexicon (extended from the original)
@@ -238,6 +241,57 @@ class EmotionAnalyzer:
         Returns:
             Dictionary with detected emotion, confidence, and metadata
         """
+        return self.analyze_batch([text])[0]
+    
+    def analyze_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Analyze several texts at once, running a single padded batch through
+        the transformer pipeline when one is loaded.
+        
+        Args:
+            texts: The texts to analyze
+            
+        Returns:
+            One result dictionary per text, in the same order as texts
+        """
+        results = [self._precheck(text) for text in texts]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        
+        # Analyze with primary analyzer (ML or hybrid)
+        try:
+            predictions = self._classify([texts[i] for i in pending])
+            for i, prediction in zip(pending, predictions):
+                results[i] = self._build_result(prediction["label"], prediction["score"])
+        except Exception as e:
+            print(f"Error in emotion analysis: {e}")
+            for i in pending:
+                if len(pending) > 1:
+                    # Isolate the failing text instead of failing the whole batch
+                    results[i] = self.analyze(texts[i])
+                else:
+                    # Fall back to a safe neutral response
+                    results[i] = {
+                        "emotion": "neutral",
+                        "confidence": 0.5,
+                        "valence": 0.0,
+                        "is_crisis": False,
+                        "intensity": 0.1
+                    }
+        
+        return results
+    
+    def _precheck(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Resolve texts that need no model inference.
+        
+        Args:
+            text: The text to analyze
+            
+        Returns:
+            A result for very short or crisis texts, otherwise None
+        """
         # Skip analysis for very short texts
         if len(text.strip()) < 3:
             return {
@@ -263,53 +317,47 @@ class EmotionAnalyzer:
                 "intensity": 0.9
             }
         
-        # Analyze with primary analyzer (ML or hybrid)
-        try:
-            result = self.analyzer(text)[0]
-            emotion = result["label"] 
-            confidence = result["score"]
-            
-            # Map emotion to valence (positive/negative scale)
-            valence_map = {
-                # Positive emotions
-                "joy": 0.8, "contentment": 0.7, "excitement": 0.8, "pride": 0.7,
-                "gratitude": 0.8, "love": 0.9, "hope": 0.7,
-                
-                # Neutral emotions
-                "surprise": 0.0, "confusion": -0.1, "neutral": 0.0,
-                
-                # Negative emotions
-                "sadness": -0.7, "fear": -0.7, "anger": -0.7, "disgust": -0.6,
-                "anxiety": -0.7, "frustration": -0.6, "guilt": -0.6,
-                "hopelessness": -0.9, "loneliness": -0.7, "grief": -0.8,
-                "dread": -0.7, "embarrassment": -0.5
-            }
-            
-            valence = valence_map.get(emotion, 0.0)
-            
-            # Determine if this is a potential crisis  
-            is_crisis = (
-                emotion in ["hopelessness", "sadness", "fear"] and confidence > 0.8
-            )
+        return None
+    
+    def _classify(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Run the primary analyzer, returning the top label and score per text."""
+        if self.model_backed:
+            predictions = self.analyzer(texts, batch_size=len(texts), truncation=True)
+            return [p[0] if isinstance(p, list) else p for p in predictions]
+        return [self.analyzer(text)[0] for text in texts]
+    
+    def _build_result(self, emotion: str, confidence: float) -> Dict[str, Any]:
+        """Map a classifier label and score to the analysis result."""
+        # Map emotion to valence (positive/negative scale)
+        valence_map = {
+            # Positive emotions
+            "joy": 0.8, "contentment": 0.7, "excitement": 0.8, "pride": 0.7,
+            "gratitude": 0.8, "love": 0.9, "hope": 0.7,
             
-            return {
-                "emotion": emotion,
-                "confidence": confidence,
-                "valence": valence,
-                "is_crisis": is_crisis,
-                "intensity": abs(valence) * confidence
-            }
+            # Neutral emotions
+            "surprise": 0.0, "confusion": -0.1, "neutral": 0.0,
             
-        except Exception as e:
-            print(f"Error in emotion analysis: {e}")
-            # Fall back to a safe neutral response
-            return {
-                "emotion": "neutral",
-                "confidence": 0.5,
-                "valence": 0.0,
-                "is_crisis": False,
-                "intensity": 0.1
-            }
+            # Negative emotions
+            "sadness": -0.7, "fear": -0.7, "anger": -0.7, "disgust": -0.6,
+            "anxiety": -0.7, "frustration": -0.6, "guilt": -0.6,
+            "hopelessness": -0.9, "loneliness": -0.7, "grief": -0.8,
+            "dread": -0.7, "embarrassment": -0.5
+        }
+        
+        valence = valence_map.get(emotion, 0.0)
+        
+        # Determine if this is a potential crisis  
+        is_crisis = (
+            emotion in ["hopelessness", "sadness", "fear"] and confidence > 0.8
+        )
+        
+        return {
+            "emotion": emotion,
+            "confidence": confidence,
+            "valence": valence,
+            "is_crisis": is_crisis,
+            "intensity": abs(valence) * confidence
+        }
     
     def download_models_for_offline(self) -> bool:
         """
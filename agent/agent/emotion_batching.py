@@ -0,0 +1,228 @@
+"""
+Cross-request micro-batching for emotion classification.
+
+A single text wastes most of a transformer forward pass on CPU. The
+scheduler collects texts submitted by concurrent requests for up to a few
+milliseconds (or until a batch fills up), runs them through the analyzer as
+one padded batch, and resolves each caller's future with its own result.
+"""
+
+from typing import Dict, List, Any, Optional, Tuple
+from concurrent.futures import Future
+import asyncio
+import os
+import queue
+import threading
+import time
+import weakref
+
+from agent.emotion_analysis import EmotionAnalyzer
+from agent.metrics import metrics
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, float("inf"))
+
+# Live schedulers, so their stats can be exported without owning them
+_schedulers: "weakref.WeakSet[EmotionBatchScheduler]" = weakref.WeakSet()
+
+
+class EmotionBatchScheduler:
+    """
+    Batching front end for an EmotionAnalyzer.
+
+    Exposes the same analyze() interface as the analyzer, plus an async
+    aanalyze(), so it can stand in for the analyzer wherever one is used.
+    """
+
+    def __init__(self,
+                 analyzer: EmotionAnalyzer,
+                 max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0):
+        """
+        Initialize the batch scheduler.
+
+        Args:
+            analyzer: The emotion analyzer that classifies each batch
+            max_batch_size: Maximum number of texts per batch
+            max_wait_ms: Maximum time to wait for a batch to fill up
+        """
+        self.analyzer = analyzer
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._batch_count = 0
+        self._text_count = 0
+
+        _schedulers.add(self)
+
+    @property
+    def batching_enabled(self) -> bool:
+        """Batching only pays off for transformer-backed analyzers."""
+        return self.analyzer.model_backed and self.max_batch_size > 1
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a text for classification.
+
+        Args:
+            text: The text to analyze
+
+        Returns:
+            Future resolving to the analysis result for text
+        """
+        future: Future = Future()
+        if not self.batching_enabled:
+            try:
+                future.set_result(self.analyzer.analyze(text))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+
+    def analyze(self, text: str) -> Dict[str, Any]:
+        """
+        Analyze text for emotional content, batched with concurrent callers.
+
+        Args:
+            text: The text to analyze
+
+        Returns:
+            Dictionary with detected emotion, confidence, and metadata
+        """
+        return self.submit(text).result()
+
+    async def aanalyze(self, text: str) -> Dict[str, Any]:
+        """Async variant of analyze() that does not block the event loop."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self):
+        """Stop the worker thread after it drains the queue."""
+        with self._worker_lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._worker.join()
+                self._worker = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get batching statistics.
+
+        Returns:
+            Dictionary with settings, totals and a cumulative batch-size
+            histogram keyed by bucket upper bound
+        """
+        with self._stats_lock:
+            cumulative = {}
+            running = 0
+            for bucket in BATCH_SIZE_BUCKETS:
+                running += self._histogram[bucket]
+                cumulative["+Inf" if bucket == float("inf") else str(bucket)] = running
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batching_enabled": self.batching_enabled,
+                "batches": self._batch_count,
+                "texts": self._text_count,
+                "batch_size_histogram": cumulative
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run,
+                    name="emotion-batcher",
+                    daemon=True
+                )
+                self._worker.start()
+
+    def _run(self):
+        """Worker loop: collect a batch, classify it, resolve the futures."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch: List[Tuple[str, Future]]):
+        # Drop texts whose callers have already given up
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        texts = [text for text, _ in batch]
+        try:
+            results = self.analyzer.analyze_batch(texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        self._record(len(batch))
+
+    def _record(self, batch_size: int):
+        with self._stats_lock:
+            self._batch_count += 1
+            self._text_count += batch_size
+            for bucket in BATCH_SIZE_BUCKETS:
+                if batch_size <= bucket:
+                    self._histogram[bucket] += 1
+                    break
+
+
+def create_scheduler(analyzer: EmotionAnalyzer) -> EmotionBatchScheduler:
+    """Create a scheduler configured from EMOTION_BATCH_* environment variables."""
+    return EmotionBatchScheduler(
+        analyzer,
+        max_batch_size=int(os.environ.get("EMOTION_BATCH_MAX_SIZE", "16")),
+        max_wait_ms=float(os.environ.get("EMOTION_BATCH_MAX_WAIT_MS", "5"))
+    )
+
+
+def scheduler_stats() -> List[Dict[str, Any]]:
+    """Get the stats of every live scheduler in the process."""
+    return [scheduler.stats() for scheduler in list(_schedulers)]
+
+
+def _collect_metrics():
+    """Export batch-size histograms as Prometheus histogram samples."""
+    for index, stats in enumerate(scheduler_stats()):
+        labels = {"scheduler": str(index)}
+        for bucket, count in stats["batch_size_histogram"].items():
+            yield "mindguard_emotion_batch_size_bucket", "histogram", {**labels, "le": bucket}, count
+        yield "mindguard_emotion_batch_size_sum", "histogram", labels, stats["texts"]
+        yield "mindguard_emotion_batch_size_count", "histogram", labels, stats["batches"]
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("mindguard_emotion_batch_size", "Texts per emotion classification batch")
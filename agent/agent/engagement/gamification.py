@@ -12,6 +12,8 @@ import json
 import os
 import random
 
+from agent.metrics import record_store_io
+
 
 class GamificationSystem:
     """
@@ -169,6 +171,7 @@ class GamificationSystem:
         if os.path.exists(file_path):
             try:
                 with open(file_path, 'r') as f:
+                    record_store_io("gamification", "read")
                     return json.load(f)
             except Exception as e:
                 print(f"Error loading gamification data: {e}")
@@ -183,10 +186,15 @@ class GamificationSystem:
         
         try:
             with open(file_path, 'w') as f:
+                record_store_io("gamification", "write")
                 json.dump(self.user_data, f, indent=2)
         except Exception as e:
             print(f"Error saving gamification data: {e}")
     
+    def flush(self):
+        """Persist the current gamification data to storage."""
+        self._save_user_data()
+    
     def _create_new_profile(self) -> Dict[str, Any]:
         """
         Create a new user profile with default values.
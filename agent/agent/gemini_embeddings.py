@@ -1,33 +1,155 @@
 import os
-from typing import List
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from langchain_core.embeddings import Embeddings
+import requests
+
+# Maximum number of texts Gemini accepts in one batchEmbedContents request
+GEMINI_EMBED_BATCH_LIMIT = 100
+
+# Failures worth retrying: rate limits, server-side errors and transport
+# errors (gRPC maps lost connections to ServiceUnavailable, the REST
+# transport raises requests' errors). Anything else, such as an invalid key
+# or request, fails the same way on every attempt.
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError
+)
+
 
 class GeminiEmbeddings(Embeddings):
     """LangChain compatible wrapper for Google's Gemini embeddings."""
-    
-    model_name: str = "embedding-001"
-    
-    def __init__(self, **kwargs):
-        """Initialize the Gemini embeddings model."""
+
+    model_name: str = "models/embedding-001"
+
+    def __init__(self,
+                 batch_size: Optional[int] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5,
+                 **kwargs):
+        """
+        Initialize the Gemini embeddings model.
+
+        Args:
+            batch_size: Texts per embedding request, capped at the provider limit
+                (default: GEMINI_EMBED_BATCH_SIZE or the provider limit)
+            max_concurrency: Batch requests in flight at once
+                (default: GEMINI_EMBED_CONCURRENCY or 4)
+            max_retries: Retries per batch after a transient failure
+            retry_backoff: Base delay in seconds for exponential backoff
+        """
         super().__init__(**kwargs)
         api_key = os.environ.get("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY environment variable not set")
-        genai.configure(api_key=api_key)
-        
-        # Initialize the model
-        self.model = genai.GenerativeModel(self.model_name)
-    
+
+        # GEMINI_API_ENDPOINT points the client at another host, e.g. a local stub server
+        endpoint = os.environ.get("GEMINI_API_ENDPOINT")
+        if endpoint:
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=api_key)
+        # The REST transport has no async client; async calls then run the sync client in threads
+        self._native_async = not endpoint
+
+        if batch_size is None:
+            batch_size = int(os.environ.get("GEMINI_EMBED_BATCH_SIZE", GEMINI_EMBED_BATCH_LIMIT))
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("GEMINI_EMBED_CONCURRENCY", "4"))
+        self.batch_size = max(1, min(batch_size, GEMINI_EMBED_BATCH_LIMIT))
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents using Gemini."""
-        embeddings = []
-        for text in texts:
-            result = self.model.embed_content(text)
-            embeddings.append(result.embedding)
-        return embeddings
-    
+        """
+        Embed a list of documents using Gemini.
+
+        Texts are sent in batches of up to batch_size, with up to
+        max_concurrency batches in flight at once.
+        """
+        batches = self._batches(texts)
+        if len(batches) <= 1 or self.max_concurrency == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        return [vector for batch in results for vector in batch]
+
     def embed_query(self, text: str) -> List[float]:
         """Embed a query using Gemini."""
-        result = self.model.embed_content(text)
-        return result.embedding 
\ No newline at end of file
+        return self._with_retries(
+            lambda: genai.embed_content(model=self.model_name, content=text, task_type="retrieval_query")
+        )["embedding"]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of embed_documents on the async Gemini client."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._aembed_batch(batch)
+
+        results = await asyncio.gather(*(embed(batch) for batch in self._batches(texts)))
+        return [vector for batch in results for vector in batch]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async variant of embed_query on the async Gemini client."""
+        if not self._native_async:
+            return await asyncio.to_thread(self.embed_query, text)
+        result = await self._awith_retries(
+            lambda: genai.embed_content_async(model=self.model_name, content=text, task_type="retrieval_query")
+        )
+        return result["embedding"]
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        return self._with_retries(
+            lambda: genai.embed_content(model=self.model_name, content=batch, task_type="retrieval_document")
+        )["embedding"]
+
+    async def _aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        if not self._native_async:
+            return await asyncio.to_thread(self._embed_batch, batch)
+        result = await self._awith_retries(
+            lambda: genai.embed_content_async(model=self.model_name, content=batch, task_type="retrieval_document")
+        )
+        return result["embedding"]
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+    def _with_retries(self, call: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call()
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Gemini embedding request failed (attempt {attempt + 1}): {e}")
+                time.sleep(self._backoff(attempt))
+
+    async def _awith_retries(self, call: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await call()
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Gemini embedding request failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(self._backoff(attempt))
@@ -1,14 +1,16 @@
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 import google.generativeai as genai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
 )
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from pydantic import Field
 
 class ChatGemini(BaseChatModel):
@@ -33,20 +35,28 @@ class ChatGemini(BaseChatModel):
             self._gemini_model = genai.GenerativeModel(self.model_name)
         except Exception as e:
             raise ValueError(f"Failed to initialize Gemini model: {e}")
+        
+        # Built once; the model settings do not change after construction
+        self._config = {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "max_output_tokens": self.max_output_tokens,
+        }
     
-    def _generate(self, messages: List[BaseMessage], **kwargs) -> ChatResult:
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
         """Generate a response using the Gemini model."""
         prompt = self._convert_messages_to_prompt(messages)
         
-        # Set up generation config directly in the generate_content call
         response = self._gemini_model.generate_content(
             prompt,
-            generation_config={
-                "temperature": self.temperature,
-                "top_p": self.top_p,
-                "top_k": self.top_k,
-                "max_output_tokens": self.max_output_tokens,
-            }
+            generation_config=self._generation_config(stop)
         )
         
         # Convert to LangChain format
@@ -54,6 +64,89 @@ class ChatGemini(BaseChatModel):
         generation = ChatGeneration(message=message)
         return ChatResult(generations=[generation])
     
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        """Generate a response on the async Gemini client without blocking a thread."""
+        prompt = self._convert_messages_to_prompt(messages)
+        
+        response = await self._gemini_model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(stop)
+        )
+        
+        message = AIMessage(content=response.text)
+        generation = ChatGeneration(message=message)
+        return ChatResult(generations=[generation])
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        """Stream a response from the Gemini model chunk by chunk."""
+        prompt = self._convert_messages_to_prompt(messages)
+        
+        response = self._gemini_model.generate_content(
+            prompt,
+            generation_config=self._generation_config(stop),
+            stream=True
+        )
+        
+        for response_chunk in response:
+            text = self._chunk_text(response_chunk)
+            if not text:
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Stream a response chunk by chunk on the async Gemini client."""
+        prompt = self._convert_messages_to_prompt(messages)
+        
+        response = await self._gemini_model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(stop),
+            stream=True
+        )
+        
+        async for response_chunk in response:
+            text = self._chunk_text(response_chunk)
+            if not text:
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+    
+    @staticmethod
+    def _chunk_text(response_chunk) -> str:
+        """Text of a streamed chunk; chunks without candidates or text parts (e.g. safety metadata, usage) are empty."""
+        if not response_chunk.candidates:
+            return ""
+        content = response_chunk.candidates[0].content
+        return "".join(getattr(part, "text", "") for part in (content.parts if content else []))
+    
+    def _generation_config(self, stop: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Get the generation config built at construction, plus any stop sequences."""
+        if stop:
+            return {**self._config, "stop_sequences": stop}
+        return self._config
+    
     def _convert_messages_to_prompt(self, messages: List[BaseMessage]) -> str:
         """Convert LangChain messages to a format Gemini can understand."""
         prompt_parts = []
@@ -0,0 +1,76 @@
+"""
+Shared keep-alive HTTP connection pools for LLM provider clients.
+
+OpenAI-compatible providers (OpenAI, Groq) each get one httpx.Client and
+one httpx.AsyncClient per process, so every chat model for a provider
+reuses the same TLS connections instead of opening its own pool. Pool
+size, timeouts and HTTP/2 are configured through LLM_HTTP_* environment
+variables; HTTP/2 is only enabled when the optional h2 package is
+installed.
+"""
+
+from typing import Dict, Any, Tuple
+import importlib.util
+import os
+import threading
+
+import httpx
+
+from agent.metrics import metrics
+
+_lock = threading.Lock()
+_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+
+
+def http2_available() -> bool:
+    """HTTP/2 in httpx needs the optional h2 package."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _client_settings() -> Dict[str, Any]:
+    """Build the shared client options from LLM_HTTP_* environment variables."""
+    return {
+        "limits": httpx.Limits(
+            max_connections=int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+        ),
+        "timeout": httpx.Timeout(
+            float(os.environ.get("LLM_HTTP_TIMEOUT_SECONDS", "60")),
+            connect=float(os.environ.get("LLM_HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+        ),
+        "http2": os.environ.get("LLM_HTTP2", "true") == "true" and http2_available()
+    }
+
+
+def get_http_clients(provider: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Get the shared sync and async HTTP clients for a provider.
+
+    Args:
+        provider: Provider name (e.g. "openai", "groq")
+
+    Returns:
+        Tuple of (httpx.Client, httpx.AsyncClient)
+    """
+    with _lock:
+        clients = _clients.get(provider)
+        if clients is None:
+            settings = _client_settings()
+            clients = (httpx.Client(**settings), httpx.AsyncClient(**settings))
+            _clients[provider] = clients
+            metrics.increment("mindguard_http_pools_created_total", provider=provider, http2=settings["http2"])
+        return clients
+
+
+async def aclose_http_clients():
+    """Close the shared clients; awaited on the event loop that used the async ones, at shutdown."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client, async_client in clients:
+        client.close()
+        await async_client.aclose()
+
+
+metrics.describe("mindguard_http_pools_created_total", "Shared provider HTTP connection pools created")
@@ -1,43 +1,67 @@
+import functools
+import math
 import os
-from typing import Optional, Dict, Any, List
+import re
+import threading
+import zlib
+from typing import Optional, Dict, Any, List, Tuple
 
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.embeddings import Embeddings
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.messages import BaseMessage, AIMessage, ChatMessage
+from langchain_core.messages import BaseMessage, AIMessage, ChatMessage, SystemMessage
 from langchain_core.outputs import ChatGeneration, ChatResult
 
 from agent.gemini_integration import ChatGemini
+from agent.metrics import metrics
 from agent.gemini_embeddings import GeminiEmbeddings
+from agent.embedding_cache import create_cached_embeddings, embedding_cache_enabled
+from agent.http_clients import get_http_clients
+from agent.offline_responder import emotion_from_prompt, get_response_bank
+from agent.rate_limiter import RateLimitedChatModel, get_rate_limiter
+from agent.single_flight import SingleFlightChatModel, SingleFlightEmbeddings, single_flight_enabled
+
+# Memoized chat clients keyed by (provider, model, temperature, base_url, extra kwargs)
+_client_lock = threading.Lock()
+_llm_clients: Dict[tuple, BaseChatModel] = {}
 
 
 class SimpleFallbackLLM(BaseChatModel):
-    """A simple fallback LLM that works offline with basic templated responses."""
+    """
+    A simple fallback LLM that works offline with supportive responses.
+    
+    Responses come from the indexed response bank in offline_responder,
+    matched on the user's message and conditioned on the detected emotion
+    (an "emotion" call argument, or the emotional state in the system prompt).
+    """
     
     temperature: float = 0.7
     
-    def _generate(self, messages: List[BaseMessage], **kwargs) -> ChatResult:
-        """Generate a simple response based on keywords in the user's message."""
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        """Pick the best-matching response for the user's message."""
         # Get the last message which should be from the user
         if not messages:
             response_text = "I'm here to listen. How can I help you today?"
         else:
-            last_message = messages[-1]
-            user_input = last_message.content.lower()
-            
-            # Simple keyword-based responses
-            if any(word in user_input for word in ["sad", "upset", "depressed"]):
-                response_text = "I understand you're feeling down. It's important to acknowledge these feelings. Would you like to talk more about what's causing you to feel this way?"
-            elif any(word in user_input for word in ["anxious", "worried", "nervous", "stress"]):
-                response_text = "Feeling anxious is very common. Sometimes taking deep breaths can help in the moment. Would you like to explore some calming techniques together?"
-            elif any(word in user_input for word in ["happy", "good", "great", "wonderful"]):
-                response_text = "I'm glad to hear you're feeling positive! What's been contributing to these good feelings?"
-            elif any(word in user_input for word in ["tired", "exhausted", "sleep"]):
-                response_text = "Rest is so important for our mental wellbeing. Have you been having trouble sleeping lately?"
-            elif any(word in user_input for word in ["hello", "hi", "hey"]):
-                response_text = "Hello! I'm here to support you. How are you feeling today?"
-            else:
+            emotion = kwargs.get("emotion")
+            if emotion is None:
+                for message in messages:
+                    if isinstance(message, SystemMessage):
+                        emotion = emotion_from_prompt(str(message.content)) or emotion
+            try:
+                response_text = get_response_bank().best_response(str(messages[-1].content), emotion)
+            except Exception as e:
+                print(f"Error loading offline response bank: {e}")
                 response_text = "Thank you for sharing. I'm listening and here to support you. Could you tell me more about how you're feeling?"
         
         message = AIMessage(content=response_text)
@@ -49,27 +73,158 @@ class SimpleFallbackLLM(BaseChatModel):
         return "simple_fallback"
 
 
+@functools.lru_cache(maxsize=200000)
+def _feature_slot(feature: str, dimension: int) -> Tuple[int, float]:
+    """Stable hashed column and sign of a feature (Python's hash() is salted per process)."""
+    digest = zlib.crc32(feature.encode("utf-8"))
+    return digest % dimension, 1.0 if digest & 0x80000000 else -1.0
+
+
 class SimpleOfflineEmbeddings(Embeddings):
-    """Simple fallback embeddings that produce random vectors."""
+    """
+    Deterministic offline embeddings based on feature hashing.
+    
+    Word unigrams, word bigrams and character n-grams are hashed into a
+    fixed number of signed columns, weighted by sublinear term frequency and
+    L2-normalized, so texts sharing words or word fragments get similar
+    vectors. No model, network or global random state is involved.
+    """
+    
+    dimension: int = 256
+    
+    _TOKEN = re.compile(r"\w+")
+    
+    def __init__(self, dimension: Optional[int] = None, char_ngrams: Tuple[int, ...] = (3, 4)):
+        """
+        Initialize the offline embeddings.
+        
+        Args:
+            dimension: Vector length (default: OFFLINE_EMBEDDING_DIM or 256)
+            char_ngrams: Character n-gram lengths to hash
+        """
+        if dimension is None:
+            dimension = int(os.environ.get("OFFLINE_EMBEDDING_DIM", self.dimension))
+        self.dimension = dimension
+        self.char_ngrams = char_ngrams
+    
+    def _features(self, text: str) -> Dict[str, float]:
+        """Weighted features of a text: words count fully, bigrams and n-grams less."""
+        words = self._TOKEN.findall(text.lower())
+        counts: Dict[str, float] = {}
+        for word in words:
+            counts["w:" + word] = counts.get("w:" + word, 0.0) + 1.0
+            padded = f"<{word}>"
+            for n in self.char_ngrams:
+                for i in range(len(padded) - n + 1):
+                    gram = "c:" + padded[i:i + n]
+                    counts[gram] = counts.get(gram, 0.0) + 0.5
+        for first, second in zip(words, words[1:]):
+            bigram = f"b:{first} {second}"
+            counts[bigram] = counts.get(bigram, 0.0) + 0.75
+        return counts
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        rows: List[int] = []
+        columns: List[int] = []
+        values: List[float] = []
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text).items():
+                column, sign = _feature_slot(feature, self.dimension)
+                rows.append(row)
+                columns.append(column)
+                # Sublinear term frequency
+                values.append(sign * (1.0 + math.log(weight)) if weight >= 1.0 else sign * weight)
+        
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), values)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
     
-    dimension: int = 128
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with hashed word and character n-gram features."""
+        return self._embed(texts).tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query with hashed word and character n-gram features."""
+        return self._embed([text])[0].tolist()
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Embeddings wrapper that times every provider call."""
+    
+    def __init__(self, embeddings: Embeddings, provider: str):
+        """
+        Wrap an embeddings client.
+        
+        Args:
+            embeddings: The provider embeddings client
+            provider: Provider name used as the metric label
+        """
+        self.embeddings = embeddings
+        self.provider = provider
+    
+    def _timer(self, operation: str):
+        return metrics.timer(
+            "mindguard_provider_latency_seconds",
+            provider=self.provider,
+            operation=operation
+        )
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Generate random embeddings of the same dimension for offline mode."""
-        import random
-        random.seed(42)  # For reproducibility
-        return [[random.uniform(-1, 1) for _ in range(self.dimension)] for _ in texts]
+        with self._timer("embed_documents"):
+            return self.embeddings.embed_documents(texts)
     
     def embed_query(self, text: str) -> List[float]:
-        """Generate a random embedding for a query."""
-        import random
-        random.seed(hash(text) % 10000)  # Seed based on text for consistency
-        return [random.uniform(-1, 1) for _ in range(self.dimension)]
+        with self._timer("embed_query"):
+            return self.embeddings.embed_query(text)
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._timer("embed_documents"):
+            return await self.embeddings.aembed_documents(texts)
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        with self._timer("embed_query"):
+            return await self.embeddings.aembed_query(text)
+
+
+def _groq_base_url() -> str:
+    """Groq's OpenAI-compatible endpoint, overridable with GROQ_BASE_URL (e.g. a local stub)."""
+    return os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+
+
+def _openai_embeddings(base_url: Optional[str] = None, **kwargs) -> OpenAIEmbeddings:
+    """
+    Create OpenAIEmbeddings, optionally for another OpenAI-compatible endpoint.
+    
+    Other endpoints get plain text inputs: the context-length check sends
+    tiktoken token ids, which only OpenAI accepts.
+    """
+    if base_url:
+        return OpenAIEmbeddings(base_url=base_url, check_embedding_ctx_length=False, **kwargs)
+    return OpenAIEmbeddings(**kwargs)
 
 
 class LLMFactory:
     """Factory class to create LLM instances based on available API keys."""
-    
+
+    @staticmethod
+    def available_providers() -> List[str]:
+        """
+        List the providers that have an API key configured.
+
+        Returns:
+            Provider names in priority order: OpenAI, Groq, Gemini
+        """
+        providers = []
+        if os.environ.get("OPENAI_API_KEY"):
+            providers.append("openai")
+        if os.environ.get("GROQ_API_KEY"):
+            providers.append("groq")
+        if os.environ.get("GOOGLE_API_KEY"):
+            providers.append("gemini")
+        return providers
+
     @staticmethod
     def create_llm(
         provider: Optional[str] = None, 
@@ -80,6 +235,13 @@ class LLMFactory:
         """
         Create an LLM instance based on available API keys or specified provider.
         
+        Clients are memoized per process by (provider, model, temperature,
+        base_url), so agents share one client and its HTTP connection pool.
+        Provider clients are wrapped so identical concurrent requests share
+        one upstream call (disable with SINGLE_FLIGHT_ENABLED=false) and,
+        when RATE_LIMIT_<PROVIDER>_RPM/TPM is set, wait for the provider's
+        shared rate limiter.
+        
         Args:
             provider: Optional provider to use ('openai', 'gemini', or 'groq')
             temperature: Temperature for the model
@@ -88,71 +250,156 @@ class LLMFactory:
         Returns:
             A LangChain chat model instance
         """
+        resolved = LLMFactory._resolve_provider(provider)
+        settings = LLMFactory._client_settings(resolved, kwargs)
+        key = (
+            resolved,
+            settings.get("model_name"),
+            temperature,
+            settings.get("base_url"),
+            tuple(sorted((k, repr(v)) for k, v in kwargs.items()))
+        )
+        
+        with _client_lock:
+            llm = _llm_clients.get(key)
+        if llm is not None:
+            metrics.increment("mindguard_llm_client_cache_lookups_total", provider=resolved, result="hit")
+            return llm
+        
+        metrics.increment("mindguard_llm_client_cache_lookups_total", provider=resolved, result="miss")
+        with metrics.timer("mindguard_llm_client_creation_seconds", provider=resolved):
+            llm = LLMFactory._build_llm(resolved, temperature, {**kwargs, **settings})
+        limiter = get_rate_limiter(resolved) if resolved != "offline" else None
+        if limiter is not None:
+            llm = RateLimitedChatModel(
+                llm=llm,
+                limiter=limiter,
+                completion_tokens=int(os.environ.get("RATE_LIMIT_COMPLETION_TOKENS", "256"))
+            )
+        if resolved != "offline" and single_flight_enabled():
+            llm = SingleFlightChatModel(
+                llm=llm,
+                provider=resolved,
+                model=str(settings.get("model_name") or getattr(llm, "model_name", None) or "default"),
+                temperature=temperature
+            )
+        with _client_lock:
+            # Keep the first client if another thread built one concurrently
+            return _llm_clients.setdefault(key, llm)
+    
+    @staticmethod
+    def _resolve_provider(provider: Optional[str]) -> str:
+        """Resolve the provider to use: 'openai', 'groq', 'gemini' or 'offline'."""
         # Check if we're in offline mode (environment variable)
         if os.environ.get("OFFLINE_MODE") == "true":
             print("Using offline fallback LLM")
-            return SimpleFallbackLLM(temperature=temperature)
-            
-        # If provider is specified, try to use it
+            return "offline"
+        
+        # If provider is specified, check that it can be used
         if provider:
-            if provider.lower() == "openai":
+            provider = provider.lower()
+            if provider == "openai":
                 if not os.environ.get("OPENAI_API_KEY"):
                     raise ValueError("OpenAI API key not found but provider explicitly set to OpenAI")
-                return ChatOpenAI(temperature=temperature, **kwargs)
-            elif provider.lower() == "gemini":
+            elif provider == "gemini":
                 if not os.environ.get("GOOGLE_API_KEY"):
                     raise ValueError("Google API key not found but provider explicitly set to Gemini")
-                # Use the correct model name for Gemini
-                model_name = os.environ.get("GEMINI_MODEL_NAME", "gemini-1.5-pro")
-                api_version = os.environ.get("GEMINI_API_VERSION", "v1")
-                return ChatGemini(
-                    temperature=temperature, 
-                    model_name=model_name,
-                    api_version=api_version,
-                    **kwargs
-                )
-            elif provider.lower() == "groq":
+            elif provider == "groq":
                 if not os.environ.get("GROQ_API_KEY"):
                     raise ValueError("Groq API key not found but provider explicitly set to Groq")
-                # Use ChatOpenAI with Groq's base URL and API key
-                return ChatOpenAI(
-                    temperature=temperature,
-                    base_url="https://api.groq.com/openai/v1",
-                    api_key=os.environ.get("GROQ_API_KEY"),
-                    model_name="llama-3.3-70b-versatile", # Default model, can be overridden with kwargs
-                    **kwargs
-                )
             else:
                 raise ValueError(f"Unsupported provider: {provider}")
+            return provider
         
         # Auto-detect based on available API keys
-        if os.environ.get("OPENAI_API_KEY"):
-            return ChatOpenAI(temperature=temperature, **kwargs)
-        elif os.environ.get("GROQ_API_KEY"):
-            return ChatOpenAI(
-                temperature=temperature,
-                base_url="https://api.groq.com/openai/v1",
-                api_key=os.environ.get("GROQ_API_KEY"),
-                model_name="llama-3.3-70b-versatile", # Default model
-                **kwargs
-            )
-        elif os.environ.get("GOOGLE_API_KEY"):
-            return ChatGemini(temperature=temperature, **kwargs)
-        else:
-            print("No API keys found. Using offline fallback LLM.")
+        available = LLMFactory.available_providers()
+        if available:
+            return available[0]
+        print("No API keys found. Using offline fallback LLM.")
+        return "offline"
+    
+    @staticmethod
+    def _client_settings(provider: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Provider defaults for model name and endpoint, unless overridden in kwargs."""
+        if provider == "groq":
+            return {
+                # Use ChatOpenAI with Groq's base URL and API key
+                "base_url": kwargs.get("base_url", _groq_base_url()),
+                "model_name": kwargs.get("model_name", "llama-3.3-70b-versatile")
+            }
+        if provider == "gemini":
+            # Use the correct model name for Gemini
+            return {
+                "model_name": kwargs.get("model_name", os.environ.get("GEMINI_MODEL_NAME", "gemini-1.5-pro")),
+                "api_version": kwargs.get("api_version", os.environ.get("GEMINI_API_VERSION", "v1"))
+            }
+        if provider == "openai":
+            settings = {}
+            if "model_name" in kwargs:
+                settings["model_name"] = kwargs["model_name"]
+            base_url = kwargs.get("base_url", os.environ.get("OPENAI_BASE_URL"))
+            if base_url:
+                settings["base_url"] = base_url
+            return settings
+        return {}
+    
+    @staticmethod
+    def _build_llm(provider: str, temperature: float, kwargs: Dict[str, Any]) -> BaseChatModel:
+        """Construct a new chat model for a resolved provider."""
+        if provider == "offline":
             return SimpleFallbackLLM(temperature=temperature)
+        if provider == "gemini":
+            # Gemini uses the library's process-wide gRPC client
+            return ChatGemini(temperature=temperature, **kwargs)
+        
+        # OpenAI-compatible providers share one keep-alive HTTP pool each
+        http_client, http_async_client = get_http_clients(provider)
+        if provider == "groq":
+            kwargs = {"api_key": os.environ.get("GROQ_API_KEY"), **kwargs}
+        return ChatOpenAI(
+            temperature=temperature,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            **kwargs
+        )
     
     @staticmethod
-    def create_embeddings(provider: Optional[str] = None) -> Embeddings:
+    def create_embeddings(provider: Optional[str] = None, cache: Optional[bool] = None) -> Embeddings:
         """
         Create an embeddings instance based on available API keys or specified provider.
         
+        Every call on the returned instance is timed into the provider latency metric.
+        Identical concurrent provider calls share one upstream call, and
+        provider embeddings can be wrapped in a persistent cache keyed on
+        (provider, model, sha256(task, text)); offline embeddings are never cached.
+        
         Args:
             provider: Optional provider to use ('openai', 'gemini', or 'groq')
+            cache: Whether to cache vectors on disk (default: EMBEDDING_CACHE_ENABLED)
             
         Returns:
             A LangChain embeddings instance
         """
+        embeddings = LLMFactory._create_provider_embeddings(provider)
+        if isinstance(embeddings, SimpleOfflineEmbeddings):
+            return InstrumentedEmbeddings(embeddings, provider="offline")
+        
+        label = provider.lower() if provider else "auto"
+        model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or "default"
+        wrapped: Embeddings = InstrumentedEmbeddings(embeddings, provider=label)
+        if single_flight_enabled():
+            wrapped = SingleFlightEmbeddings(wrapped, provider=label, model=model)
+        
+        if cache is None:
+            cache = embedding_cache_enabled()
+        if cache:
+            # Cache misses go through single-flight, so a miss is embedded once
+            return create_cached_embeddings(wrapped, provider=label, model=model)
+        return wrapped
+    
+    @staticmethod
+    def _create_provider_embeddings(provider: Optional[str] = None) -> Embeddings:
+        """Create the raw provider embeddings client for create_embeddings()."""
         # Check if we're in offline mode
         if os.environ.get("OFFLINE_MODE") == "true":
             print("Using offline simple embeddings")
@@ -163,7 +410,7 @@ class LLMFactory:
             if provider.lower() == "openai":
                 if not os.environ.get("OPENAI_API_KEY"):
                     raise ValueError("OpenAI API key not found but provider explicitly set to OpenAI")
-                return OpenAIEmbeddings()
+                return _openai_embeddings(os.environ.get("OPENAI_BASE_URL"))
             elif provider.lower() == "gemini":
                 if not os.environ.get("GOOGLE_API_KEY"):
                     raise ValueError("Google API key not found but provider explicitly set to Gemini")
@@ -173,22 +420,16 @@ class LLMFactory:
                     raise ValueError("Groq API key not found but provider explicitly set to Groq")
                 # Use OpenAIEmbeddings with Groq's base URL and API key
                 # Note: Groq might not support embeddings yet, so this might fall back to OpenAI
-                return OpenAIEmbeddings(
-                    base_url="https://api.groq.com/openai/v1",
-                    api_key=os.environ.get("GROQ_API_KEY")
-                )
+                return _openai_embeddings(_groq_base_url(), api_key=os.environ.get("GROQ_API_KEY"))
             else:
                 raise ValueError(f"Unsupported provider: {provider}")
         
         # Auto-detect based on available API keys
         if os.environ.get("OPENAI_API_KEY"):
-            return OpenAIEmbeddings()
+            return _openai_embeddings(os.environ.get("OPENAI_BASE_URL"))
         elif os.environ.get("GROQ_API_KEY"):
             try:
-                return OpenAIEmbeddings(
-                    base_url="https://api.groq.com/openai/v1",
-                    api_key=os.environ.get("GROQ_API_KEY")
-                )
+                return _openai_embeddings(_groq_base_url(), api_key=os.environ.get("GROQ_API_KEY"))
             except Exception as e:
                 # If Groq doesn't support embeddings, log error
                 print(f"Warning: Groq embeddings failed: {e}")
@@ -201,4 +442,8 @@ class LLMFactory:
             return GeminiEmbeddings()
         else:
             print("No embedding providers available. Using simple offline embeddings.")
-            return SimpleOfflineEmbeddings() 
\ No newline at end of file
+            return SimpleOfflineEmbeddings()
+
+
+metrics.describe("mindguard_llm_client_cache_lookups_total", "Memoized chat client lookups per provider by result")
+metrics.describe("mindguard_llm_client_creation_seconds", "Time to construct a new chat client")
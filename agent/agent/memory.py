@@ -1,34 +1,182 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
+from concurrent.futures import Future
+import json
+import os
+import threading
 
 from langchain_community.vectorstores import FAISS
-from langchain.memory import ConversationBufferMemory
 from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 
+from agent.bm25_index import BM25Index
+from agent.conversation_log import ConversationLog
 from agent.llm_factory import LLMFactory
+from agent.metrics import metrics, record_fallback, record_store_io
+from agent.concurrency import get_background_executor
+from agent.rate_limiter import LOW, priority_lane
+from agent.shared_index import get_shared_index
+
+SUMMARY_PROMPT = """Update the running summary of a mental health support conversation.
+Keep what matters for future support: the user's concerns, feelings, coping strategies
+tried and any progress. Write at most {max_words} words.
+
+Current summary:
+{summary}
+
+New conversation turns:
+{turns}
+
+Updated summary:"""
+
+
+def estimate_tokens(content: Union[str, List[BaseMessage]]) -> int:
+    """
+    Estimate the token count of a text or message list.
+
+    Uses roughly four characters per token, which is close for English with
+    the providers' tokenizers and needs no tokenizer download.
+
+    Args:
+        content: Text or chat messages
+
+    Returns:
+        Estimated number of tokens
+    """
+    if isinstance(content, str):
+        return (len(content) + 3) // 4
+    # A few tokens of framing per message
+    return sum(estimate_tokens(str(message.content)) + 4 for message in content)
 
 
 class MemoryManager:
-    def __init__(self, provider: Optional[str] = None):
+    def __init__(self,
+                 provider: Optional[str] = None,
+                 embeddings: Optional[Embeddings] = None,
+                 user_id: Optional[str] = None,
+                 storage_dir: str = "./user_data",
+                 memory_mode: Optional[str] = None,
+                 summarizer: Optional[BaseChatModel] = None):
         """
         Initialize the memory manager.
         
         Args:
             provider: Optional provider to use ('openai' or 'gemini')
+            embeddings: Optional shared embeddings client; created from the
+                provider when not given
+            user_id: Optional user identifier; when given, conversations are
+                appended to an on-disk log and reloaded on initialization
+            storage_dir: Directory to store conversation data
+            memory_mode: "buffer" passes the turns held in memory to prompts;
+                "budgeted" keeps the last turns verbatim within a token budget
+                and folds older turns into a running summary
+                (default: MEMORY_MODE or "buffer")
+            summarizer: Optional chat model that writes the running summary;
+                without one, older turns are condensed extractively
         """
-        self.memory = ConversationBufferMemory(return_messages=True)
+        self.memory_mode = memory_mode or os.environ.get("MEMORY_MODE", "buffer")
+        self.recent_turns = int(os.environ.get("MEMORY_RECENT_TURNS", "4"))
+        self.window_turns = int(os.environ.get("CONVERSATION_WINDOW_TURNS", "50"))
+        self.keyword_turns = max(1, int(os.environ.get("KEYWORD_INDEX_TURNS", "1000")))
+        self.token_budget = int(os.environ.get("MEMORY_TOKEN_BUDGET", "1500"))
+        self.summary_max_words = int(os.environ.get("MEMORY_SUMMARY_MAX_WORDS", "150"))
+        self.summarizer = summarizer
+        
+        # Running summary of turns older than the recent window
+        self.summary = ""
+        self.summarized_turns = 0
+        self._summary_lock = threading.Lock()
+        self._summary_future: Optional[Future] = None
         self.provider = provider
+        self.user_id = user_id
+        self.storage_dir = storage_dir
+        
+        # Per-user FAISS index of conversation turns, loaded on first use.
+        # Vector i always holds conversation turn i.
+        self.vector_store: Optional[FAISS] = None
+        self.vector_flush_every = int(os.environ.get("VECTOR_STORE_FLUSH_EVERY", "10"))
+        self._vector_lock = threading.RLock()
+        self._vector_loaded = False
+        self._vector_unsaved = 0
+        
+        # Write-behind indexing: turns are embedded in batches off the request path
+        self.index_batch_size = int(os.environ.get("VECTOR_INDEX_BATCH_SIZE", "32"))
+        self.index_max_pending = int(os.environ.get("VECTOR_INDEX_MAX_PENDING", "256"))
+        self._index_future: Optional[Future] = None
+        self._rebuild_future: Optional[Future] = None
+        
+        # With SHARED_VECTOR_INDEX, a user's turns go to the process-wide
+        # index instead of a FAISS index of their own
+        self.shared_index = get_shared_index() if user_id else None
         
         # Try to initialize embeddings, but have a fallback if it fails
         try:
-            self.embeddings = LLMFactory.create_embeddings(provider)
-            self.vector_store = None
+            self.embeddings = embeddings or LLMFactory.create_embeddings(provider)
             self.vector_storage_available = True
         except Exception as e:
             print(f"Warning: Could not initialize embeddings: {e}")
             self.vector_storage_available = False
         
-        # Simple conversation storage for metadata and context
-        self.conversations = []
+        # Append-only conversation log holding only the latest turns in memory,
+        # with a BM25 index over the user's latest messages. Document i of the
+        # index is turn keyword_base + i.
+        self.conversations = ConversationLog()
+        self.keyword_index = BM25Index()
+        self.keyword_base = 0
+        self._load_conversations()
+    
+    def _load_conversations(self):
+        """Open this user's conversation log and index the saved turns."""
+        if not self.user_id:
+            return
+            
+        try:
+            os.makedirs(self.storage_dir, exist_ok=True)
+            self.conversations = ConversationLog(self.storage_dir, self.user_id, window=self.window_turns)
+        except Exception as e:
+            print(f"Error loading conversations: {e}")
+            return
+            
+        self._rebuild_keyword_index()
+        
+        summary_path = self._summary_path()
+        if summary_path and os.path.exists(summary_path):
+            try:
+                with open(summary_path, 'r') as f:
+                    record_store_io("conversation_summary", "read")
+                    data = json.load(f)
+                self.summary = data.get("summary", "")
+                self.summarized_turns = min(data.get("summarized_turns", 0), len(self.conversations))
+            except Exception as e:
+                print(f"Error loading conversation summary: {e}")
+    
+    def _summary_path(self) -> Optional[str]:
+        if not self.user_id:
+            return None
+        return os.path.join(self.storage_dir, f"{self.user_id}_conversation_summary.json")
+    
+    def flush(self):
+        """
+        Persist the vector index and summary so they survive session eviction.
+        
+        Conversation turns are already on disk; they are written as they are saved.
+        """
+        if not self.user_id:
+            return
+            
+        self._drain_indexing()
+        self._save_vector_store()
+        
+        if self.memory_mode != "budgeted":
+            return
+        with self._summary_lock:
+            data = {"summary": self.summary, "summarized_turns": self.summarized_turns}
+        try:
+            with open(self._summary_path(), 'w') as f:
+                record_store_io("conversation_summary", "write")
+                json.dump(data, f, indent=2)
+        except Exception as e:
+            print(f"Error saving conversation summary: {e}")
         
     def save_conversation(self, user_input: str, ai_response: str, metadata: Optional[Dict[str, Any]] = None):
         """
@@ -39,59 +187,356 @@ class MemoryManager:
             ai_response: The AI's response
             metadata: Optional metadata about the conversation
         """
-        # Save to LangChain memory for retrieval
-        self.memory.save_context(
-            {"input": user_input},
-            {"output": ai_response}
-        )
-        
-        # Save with metadata for our own tracking
         conversation = {
             "input": user_input,
             "output": ai_response,
             "metadata": metadata or {}
         }
-        self.conversations.append(conversation)
-        
-        # If we have a vector store and it's available, add the conversation to it
-        if self.vector_storage_available and self.vector_store:
+        with self._vector_lock:
             try:
-                self.vector_store.add_texts(
-                    [f"User: {user_input}\nAI: {ai_response}"],
-                    metadatas=[metadata or {}]
-                )
-            except Exception as e:
-                print(f"Warning: Could not add to vector store: {e}")
+                self.conversations.append(conversation)
+            except OSError as e:
+                print(f"Error saving conversations: {e}")
+                return
+            self.keyword_index.add(user_input)
+            if len(self.keyword_index) >= 2 * self.keyword_turns:
+                self._rebuild_keyword_index()
+        
+        # Embedded and added to the vector index in the background
+        if self.vector_storage_available:
+            self._schedule_indexing()
+        
+        if self.memory_mode == "budgeted":
+            self._schedule_summary_refresh()
 
-    def get_history(self) -> List[Dict[str, Any]]:
+    def _rebuild_keyword_index(self):
         """
-        Get the conversation history.
+        Index the last keyword_turns messages afresh, reading them as one page of the log.
         
-        Returns:
-            The conversation history
+        Called on load and whenever the index has doubled, so its size and
+        the cost of loading it stay bounded however long the history gets.
         """
-        return self.memory.load_memory_variables({})["history"]
+        with self._vector_lock:
+            base = max(0, len(self.conversations) - self.keyword_turns)
+            index = BM25Index()
+            for conversation in self.conversations[base:]:
+                index.add(conversation["input"])
+            self.keyword_index = index
+            self.keyword_base = base
     
-    def initialize_vector_store(self, texts: Optional[List[str]] = None):
+    def _keyword_matches(self, query: str, k: int, start: int = 0) -> List[Dict[str, Any]]:
         """
-        Initialize the vector store with optional initial texts.
+        Best keyword matches among the indexed turns.
         
         Args:
-            texts: Optional list of texts to initialize the vector store with
+            query: Text to match
+            k: Number of results
+            start: Only consider turns from this index on
+            
+        Returns:
+            Matching turns, best first
+        """
+        with self._vector_lock:
+            index = self.keyword_index
+            base = self.keyword_base
+        matches = index.search(query, k, start=max(0, start - base))
+        return [self.conversations[base + doc] for doc, _ in matches]
+    
+    def _keyword_fallback(self, query: str, k: int) -> List[Dict[str, Any]]:
+        """
+        Keyword matches standing in for vector search, padded to k turns.
+        
+        As before the keyword index existed, turns sharing no term with the
+        query fill the remaining slots in log order, so callers still get
+        context when nothing overlaps.
+        """
+        matches = self._keyword_matches(query, k)
+        if len(matches) >= k:
+            return matches
+        with self._vector_lock:
+            base = self.keyword_base
+        candidates = self.conversations[base:base + k + len(matches)]
+        fillers = [turn for turn in candidates if turn not in matches]
+        return matches + fillers[:k - len(matches)]
+    
+    def get_history(self) -> List[BaseMessage]:
         """
+        Get the conversation history.
+        
+        In buffer mode this is the turns held in memory (the last
+        CONVERSATION_WINDOW_TURNS); in budgeted mode it is the running summary
+        followed by the most recent turns, trimmed to the token budget.
+        
+        Returns:
+            The conversation history
+        """
+        if self.memory_mode != "budgeted":
+            return self._turn_messages(self.conversations.tail())
+        
+        with self._summary_lock:
+            summary = self.summary
+        
+        messages = self._turn_messages(self.conversations[-self.recent_turns:] if self.recent_turns > 0 else [])
+        
+        header = [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] if summary else []
+        budget = self.token_budget - estimate_tokens(header)
+        # Drop the oldest verbatim turns over budget, but always keep the latest one
+        while len(messages) > 2 and estimate_tokens(messages) > budget:
+            messages = messages[2:]
+        
+        history = header + messages
+        metrics.observe("mindguard_history_tokens", estimate_tokens(history), mode=self.memory_mode)
+        return history
+    
+    @staticmethod
+    def _turn_messages(turns: List[Dict[str, Any]]) -> List[BaseMessage]:
+        """Human and AI message pairs for conversation turns."""
+        messages: List[BaseMessage] = []
+        for conversation in turns:
+            messages.append(HumanMessage(content=conversation["input"]))
+            messages.append(AIMessage(content=conversation["output"]))
+        return messages
+    
+    def _schedule_summary_refresh(self):
+        """Fold turns that left the recent window into the summary, off the request path."""
+        with self._summary_lock:
+            pending = len(self.conversations) - self.recent_turns - self.summarized_turns
+            if pending <= 0 or (self._summary_future is not None and not self._summary_future.done()):
+                return
+            self._summary_future = get_background_executor().submit(self._refresh_summary)
+    
+    def _refresh_summary(self):
+        with self._summary_lock:
+            start = self.summarized_turns
+            summary = self.summary
+        end = len(self.conversations) - self.recent_turns
+        turns = self.conversations[start:end]
+        if not turns:
+            return
+        
+        try:
+            with metrics.timer("mindguard_summary_refresh_seconds"):
+                updated = self._summarize(summary, turns)
+        except Exception as e:
+            print(f"Error refreshing conversation summary: {e}")
+            record_fallback("conversation_summary", e)
+            updated = self._extractive_summary(summary, turns)
+        
+        with self._summary_lock:
+            self.summary = updated
+            self.summarized_turns = end
+            self._summary_future = None
+        # Turns may have arrived while summarizing
+        self._schedule_summary_refresh()
+    
+    def _summarize(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        if self.summarizer is None:
+            return self._extractive_summary(summary, turns)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_max_words,
+            summary=summary or "(none yet)",
+            turns="\n".join(f"User: {turn['input']}\nAI: {turn['output']}" for turn in turns)
+        )
+        # Background work yields to chat traffic under provider rate limits
+        with priority_lane(LOW):
+            return self.summarizer.invoke(prompt).content.strip()
+    
+    def _extractive_summary(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        """Condense turns to the user's own words, keeping the most recent ones within the word limit."""
+        words = (summary.split() if summary else []) + [
+            word for turn in turns for word in f"User said: {turn['input']}.".split()
+        ]
+        return " ".join(words[-self.summary_max_words:])
+    
+    def initialize_vector_store(self):
+        """Load the user's vector index now instead of on the first search."""
         if not self.vector_storage_available:
             print("Vector storage not available")
             return
-            
-        if not texts:
-            texts = []
         
         try:
-            self.vector_store = FAISS.from_texts(texts, self.embeddings)
+            self._ensure_vector_store()
         except Exception as e:
             print(f"Warning: Could not initialize vector store: {e}")
             self.vector_storage_available = False
     
+    def _vector_store_path(self) -> Optional[str]:
+        if not self.user_id:
+            return None
+        return os.path.join(self.storage_dir, f"{self.user_id}_vectors")
+    
+    @staticmethod
+    def _turn_text(conversation: Dict[str, Any]) -> str:
+        return f"User: {conversation['input']}\nAI: {conversation['output']}"
+    
+    def _loaded_vector_store(self) -> Optional[FAISS]:
+        """Load the saved vector index on first use, without embedding anything."""
+        with self._vector_lock:
+            if not self._vector_loaded:
+                self.vector_store = self._load_vector_store()
+                self._vector_loaded = True
+            return self.vector_store
+    
+    def _indexed_turns(self) -> int:
+        if self.shared_index is not None:
+            return self.shared_index.indexed_turns(self.user_id)
+        return self.vector_store.index.ntotal if self.vector_store else 0
+    
+    def _ensure_vector_store(self) -> Optional[FAISS]:
+        """
+        Load the vector index and embed every turn it does not hold yet, on the calling thread.
+        
+        Returns:
+            The index, or None while there are no conversations
+        """
+        while self._index_next_batch():
+            pass
+        return self.vector_store
+    
+    def _index_next_batch(self) -> bool:
+        """Embed and index up to index_batch_size pending turns; False when none are pending."""
+        with self._vector_lock:
+            self._loaded_vector_store()
+            indexed = self._indexed_turns()
+            pending = self.conversations[indexed:indexed + self.index_batch_size]
+        if not pending:
+            return False
+        self._index_turns(indexed, pending)
+        return True
+    
+    def _schedule_indexing(self):
+        """
+        Index pending turns on the background executor, one batch per job.
+        
+        Turns saved while a batch is being embedded go into the next batch.
+        Once more than index_max_pending turns are waiting, the caller
+        indexes them itself, which bounds the backlog; a rebuild in progress
+        is left to the background.
+        """
+        with self._vector_lock:
+            pending = len(self.conversations) - self._indexed_turns()
+            rebuilding = self._rebuild_future is not None and not self._rebuild_future.done()
+            overflow = self._vector_loaded and not rebuilding and pending > self.index_max_pending
+            if not overflow and pending > 0 and (self._index_future is None or self._index_future.done()):
+                self._index_future = get_background_executor().submit(self._index_in_background)
+        if overflow:
+            self._ensure_vector_store()
+    
+    def _index_in_background(self):
+        try:
+            with metrics.timer("mindguard_vector_index_seconds"):
+                self._index_next_batch()
+        except Exception as e:
+            # The turns stay pending and are retried with the next saved turn
+            print(f"Error indexing conversations: {e}")
+            record_fallback("vector_indexing", e)
+            return
+        with self._vector_lock:
+            self._index_future = None
+        # More turns may have arrived while embedding
+        self._schedule_indexing()
+    
+    def _drain_indexing(self):
+        """Flush hook: settle the background job and index whatever is still pending."""
+        future = self._index_future
+        # A job that has not started is cancelled rather than awaited: flush()
+        # itself may run on the background executor, behind that very job
+        if future is not None and not future.cancel():
+            future.result()
+        if not self.vector_storage_available:
+            return
+        try:
+            self._ensure_vector_store()
+        except Exception as e:
+            print(f"Error indexing conversations: {e}")
+    
+    def _load_vector_store(self) -> Optional[FAISS]:
+        """Load the persisted index, or None if there is none or it does not match the conversations."""
+        path = self._vector_store_path()
+        if self.shared_index is not None or not path or not os.path.exists(os.path.join(path, "index.faiss")):
+            return None
+        try:
+            # The pickled docstore was written by flush(), not received from outside
+            store = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+            record_store_io("vector_store", "read")
+        except Exception as e:
+            print(f"Error loading vector store, rebuilding: {e}")
+            return None
+        if store.index.ntotal != len(store.index_to_docstore_id) or store.index.ntotal > len(self.conversations):
+            print("Vector store does not match saved conversations, rebuilding")
+            return None
+        return store
+    
+    def _index_turns(self, start: int, turns: List[Dict[str, Any]]):
+        """Embed turns start.. and append them to the index, saving every vector_flush_every turns."""
+        texts = [self._turn_text(turn) for turn in turns]
+        # Embed outside the lock so searches are not held up by the provider
+        vectors = self.embeddings.embed_documents(texts)
+        if self.shared_index is not None:
+            # Ignored if another caller indexed these turns first
+            self.shared_index.add(self.user_id, start, vectors)
+            return
+        metadatas = [turn.get("metadata") or {} for turn in turns]
+        with self._vector_lock:
+            indexed = self.vector_store.index.ntotal if self.vector_store else 0
+            if indexed != start:
+                # Another caller indexed these turns first
+                return
+            stale = self.vector_store is not None and len(vectors[0]) != self.vector_store.index.d
+            if not stale:
+                pairs = list(zip(texts, vectors))
+                if self.vector_store is None:
+                    self.vector_store = FAISS.from_embeddings(pairs, self.embeddings, metadatas=metadatas)
+                else:
+                    self.vector_store.add_embeddings(pairs, metadatas=metadatas)
+                self._vector_unsaved += len(turns)
+            save = self._vector_unsaved >= self.vector_flush_every
+        if stale:
+            # The saved index came from an embedding model of another dimension
+            self._schedule_rebuild()
+        elif save:
+            self._save_vector_store()
+    
+    def _save_vector_store(self):
+        """Write the index if it has unsaved turns, replacing the saved files one by one."""
+        path = self._vector_store_path()
+        with self._vector_lock:
+            if not path or self.vector_store is None or not self._vector_unsaved:
+                return
+            staging = path + ".tmp"
+            try:
+                self.vector_store.save_local(staging)
+                os.makedirs(path, exist_ok=True)
+                for name in ("index.faiss", "index.pkl"):
+                    os.replace(os.path.join(staging, name), os.path.join(path, name))
+                os.rmdir(staging)
+                record_store_io("vector_store", "write")
+                self._vector_unsaved = 0
+            except Exception as e:
+                print(f"Error saving vector store: {e}")
+    
+    def _schedule_rebuild(self):
+        """
+        Drop the index and re-embed every turn on the background executor,
+        e.g. after the embedding provider changed dimension.
+        
+        Searches fall back to keyword matching until the new index has turns.
+        """
+        with self._vector_lock:
+            self.vector_store = None
+            self._vector_loaded = True
+            if self._rebuild_future is None or self._rebuild_future.done():
+                self._rebuild_future = get_background_executor().submit(self._rebuild_in_background)
+    
+    def _rebuild_in_background(self):
+        try:
+            with metrics.timer("mindguard_vector_index_seconds"):
+                self._ensure_vector_store()
+        except Exception as e:
+            # Picked up again by write-behind indexing with the next saved turn
+            print(f"Error rebuilding vector store: {e}")
+            record_fallback("vector_indexing", e)
+    
     def find_similar_conversations(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
         """
         Search for similar conversations.
@@ -103,33 +548,47 @@ class MemoryManager:
         Returns:
             A list of similar conversations with input, output, and metadata
         """
+        store = None
+        indexed = 0
+        if self.vector_storage_available:
+            try:
+                with self._vector_lock:
+                    store = self._loaded_vector_store()
+                    indexed = self._indexed_turns()
+                if indexed < len(self.conversations):
+                    self._schedule_indexing()
+            except Exception as e:
+                print(f"Warning: Could not load vector store: {e}")
+        
         # If vector storage is not available, fall back to keyword matching
-        if not self.vector_storage_available or not self.vector_store:
+        if not self.vector_storage_available or not indexed:
             if not self.vector_storage_available:
                 print("Using keyword matching for conversation search (vector store not available)")
             
             if not self.conversations:
                 return []
                 
-            # Simple keyword matching as fallback
-            query_terms = set(query.lower().split())
-            scored_conversations = []
-            
-            for conv in self.conversations:
-                input_terms = set(conv["input"].lower().split())
-                # Calculate simple overlap score
-                overlap = len(query_terms.intersection(input_terms))
-                scored_conversations.append((overlap, conv))
-            
-            # Sort by score using the first element of the tuple (overlap score)
-            # This avoids direct dict comparison
-            scored_conversations.sort(key=lambda x: x[0], reverse=True)
-            return [conv for _, conv in scored_conversations[:k]]
+            return self._keyword_fallback(query, k)
             
         # Use vector search if available
         try:
-            self.initialize_vector_store()
-            results = self.vector_store.similarity_search(query, k=k)
+            embedding = self.embeddings.embed_query(query)
+            if self.shared_index is not None:
+                turns = self.shared_index.search(self.user_id, embedding, k)
+                # The search resets the index if the embedding model changed
+                indexed = self._indexed_turns()
+                if indexed < len(self.conversations):
+                    self._schedule_indexing()
+                conversations = [self.conversations[turn] for turn in turns]
+                recent = self._keyword_matches(query, k, start=indexed)
+                return (recent + conversations)[:k]
+            if len(embedding) != store.index.d:
+                # Rebuilding re-embeds every turn; serve keyword matches meanwhile
+                self._schedule_rebuild()
+                return self._keyword_fallback(query, k)
+            with self._vector_lock:
+                store = self.vector_store
+                results = store.similarity_search_by_vector(embedding, k=min(k, store.index.ntotal))
             
             # Convert results to the right format
             conversations = []
@@ -145,7 +604,9 @@ class MemoryManager:
                         "metadata": doc.metadata
                     })
             
-            return conversations
+            # Read your writes: turns still queued for indexing are matched by keyword
+            recent = self._keyword_matches(query, k, start=indexed)
+            return (recent + conversations)[:k]
         except Exception as e:
             print(f"Warning: Error searching vector store: {e}")
-            return []
\ No newline at end of file
+            return []
@@ -0,0 +1,315 @@
+"""
+In-process metrics for the MindGuard agent.
+
+Latencies are aggregated per label set into summaries with p50/p95/p99
+quantiles (computed over a sliding window of recent samples) plus running
+count and sum. Counters and gauges cover errors, fallbacks and cache
+statistics. Everything is rendered in the Prometheus text exposition format
+for the API's /metrics endpoint.
+"""
+
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+import functools
+import inspect
+import math
+import threading
+import time
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Number of most recent samples each summary computes quantiles over
+WINDOW_SIZE = 1024
+
+# A sample produced by a collector: (metric name, type, labels, value)
+Sample = Tuple[str, str, Dict[str, str], float]
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class LatencySummary:
+    """Sliding-window latency summary for a single label set."""
+
+    def __init__(self, window_size: int = WINDOW_SIZE):
+        self.samples: deque = deque(maxlen=window_size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self) -> Dict[float, float]:
+        """Nearest-rank quantiles over the current window."""
+        if not self.samples:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self.samples)
+        return {
+            q: ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+            for q in QUANTILES
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of summaries, counters and gauges.
+
+    Features:
+    - observe()/timer()/timed() for latency summaries with p50/p95/p99
+    - increment() for counters, set_gauge() for gauges
+    - Collectors that contribute samples from other components at render time
+    - Prometheus text rendering
+    """
+
+    def __init__(self):
+        """Initialize an empty metrics registry."""
+        self._lock = threading.Lock()
+        self._summaries: Dict[str, Dict[LabelKey, LatencySummary]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def describe(self, name: str, help_text: str):
+        """Attach a HELP line to a metric."""
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels: Any):
+        """
+        Record a latency sample in seconds.
+
+        Args:
+            name: Summary metric name
+            value: Observed value
+            **labels: Metric labels
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = LatencySummary()
+            summary.observe(value)
+
+    def increment(self, name: str, amount: float = 1.0, **labels: Any):
+        """
+        Increment a counter.
+
+        Args:
+            name: Counter metric name
+            amount: Amount to add
+            **labels: Metric labels
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: Any):
+        """
+        Set a gauge to a value.
+
+        Args:
+            name: Gauge metric name
+            value: Current value
+            **labels: Metric labels
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """
+        Time a block of code into a latency summary.
+
+        Exceptions raised in the block are counted in mindguard_errors_total
+        under the same labels and re-raised.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment("mindguard_errors_total", source=name, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels: Any) -> Callable[[Callable], Callable]:
+        """Decorator form of timer(), for sync and async callables."""
+        def decorator(func: Callable) -> Callable:
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        Register a callable that contributes samples at render time.
+
+        Args:
+            collector: Zero-argument callable returning (name, type, labels, value) samples
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get a JSON-friendly snapshot of all summaries, counters and gauges.
+
+        Returns:
+            Dictionary keyed by metric type, then metric name and label string
+        """
+        with self._lock:
+            return {
+                "summaries": {
+                    name: {
+                        _format_labels(key): {
+                            "count": summary.count,
+                            "sum": summary.total,
+                            **{f"p{int(q * 100)}": v for q, v in summary.quantiles().items()}
+                        }
+                        for key, summary in series.items()
+                    }
+                    for name, series in self._summaries.items()
+                },
+                "counters": {
+                    name: {_format_labels(key): value for key, value in series.items()}
+                    for name, series in self._counters.items()
+                },
+                "gauges": {
+                    name: {_format_labels(key): value for key, value in series.items()}
+                    for name, series in self._gauges.items()
+                }
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            The exposition text
+        """
+        lines: List[str] = []
+        seen: set = set()
+
+        with self._lock:
+            summaries = {
+                name: [(key, summary.quantiles(), summary.count, summary.total) for key, summary in series.items()]
+                for name, series in self._summaries.items()
+            }
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            collectors = list(self._collectors)
+
+        for name in sorted(summaries):
+            self._header(lines, seen, name, "summary")
+            for key, quantiles, count, total in summaries[name]:
+                for q, value in quantiles.items():
+                    labels = key + (("quantile", str(q)),)
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        for kind, series_by_name in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(series_by_name):
+                self._header(lines, seen, name, kind)
+                for key, value in series_by_name[name].items():
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        collected: Dict[str, Tuple[str, List[Tuple[Dict[str, str], float]]]] = {}
+        for collector in collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    collected.setdefault(name, (kind, []))[1].append((labels, value))
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        for name in sorted(collected):
+            kind, samples = collected[name]
+            self._header(lines, seen, name, kind)
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.items())} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], seen: set, name: str, kind: str):
+        # Histogram samples share the base name's header
+        base = name
+        if kind == "histogram":
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix):
+                    base = name[:-len(suffix)]
+        if base in seen:
+            return
+        seen.add(base)
+        if base in self._help:
+            lines.append(f"# HELP {base} {self._help[base]}")
+        lines.append(f"# TYPE {base} {kind}")
+
+
+# Shared metrics registry for the process
+metrics = MetricsRegistry()
+
+metrics.describe("mindguard_node_latency_seconds", "Latency of agent workflow nodes")
+metrics.describe("mindguard_provider_latency_seconds", "Latency of LLM and embedding provider calls")
+metrics.describe("mindguard_request_latency_seconds", "Latency of API requests")
+metrics.describe("mindguard_errors_total", "Exceptions raised by timed operations or handled by fallbacks")
+metrics.describe("mindguard_fallbacks_total", "Fallback responses or degraded code paths taken")
+metrics.describe("mindguard_prompt_tokens", "Estimated tokens per clinical response prompt")
+metrics.describe("mindguard_history_tokens", "Estimated tokens of conversation history passed to prompts")
+metrics.describe("mindguard_summary_refresh_seconds", "Time to fold older turns into the running conversation summary")
+metrics.describe("mindguard_vector_index_seconds", "Time to embed and index a batch of conversation turns in the background")
+metrics.describe("mindguard_store_io_total", "Reads and writes of the per-user JSON stores")
+
+
+def record_fallback(kind: str, error: Optional[BaseException] = None):
+    """
+    Count a fallback path being taken, and the error that caused it.
+
+    Args:
+        kind: Short name of the fallback (e.g. "llm_response")
+        error: Optional exception that triggered the fallback
+    """
+    metrics.increment("mindguard_fallbacks_total", kind=kind)
+    if error is not None:
+        metrics.increment("mindguard_errors_total", source=kind, error=type(error).__name__)
+
+
+def record_store_io(store: str, operation: str):
+    """
+    Count a read or write of a per-user store file.
+
+    Args:
+        store: Store name (e.g. "mood", "gamification")
+        operation: "read" or "write"
+    """
+    metrics.increment("mindguard_store_io_total", store=store, operation=operation)
@@ -0,0 +1,258 @@
+"""
+Process-wide registry for heavy, stateless MindGuard components.
+
+The emotion classifier, therapeutic modality catalog, LLM clients and
+embedding clients hold no per-user state, so every MentalHealthAgent in the
+process can share a single instance of each. Components are loaded lazily on
+first use, exactly once even under concurrent access, and reference counted.
+Components nobody has referenced for MODEL_REGISTRY_IDLE_SECONDS are unloaded
+whenever an agent releases its references, so a burst of users does not pin
+every model it loaded for the life of the process.
+"""
+
+from typing import Dict, Any, Callable, Hashable, List, Optional, Tuple
+import os
+import threading
+import time
+
+from agent.metrics import metrics
+
+
+class _RegistryEntry:
+    """A single registered component and its bookkeeping."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instance: Any = None
+        self.loaded = False
+        self.ref_count = 0
+        # When the last reference was dropped
+        self.released_at = 0.0
+        # Components acquired by this component's factory, released on unload
+        self.dependencies: List[Hashable] = []
+
+
+class ModelRegistry:
+    """
+    Thread-safe, lazily populated and reference counted component registry.
+
+    Features:
+    - One instance per key per process
+    - Per-key load locks so a slow model load never blocks unrelated keys
+    - Reference counting with unloading of components idle past a grace period
+    """
+
+    def __init__(self, idle_seconds: float = 600):
+        """
+        Initialize an empty registry.
+
+        Args:
+            idle_seconds: Time a component must go unreferenced before unload_unused() drops it
+        """
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, _RegistryEntry] = {}
+        # Entries whose factories are running on this thread, innermost last
+        self._loading = threading.local()
+
+    def acquire(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Get the component registered under key, loading it if needed.
+
+        Every call must be balanced by a call to release(). Components a
+        factory acquires are released when the component it builds is unloaded.
+
+        Args:
+            key: Hashable identifier for the component
+            factory: Zero-argument callable that builds the component
+
+        Returns:
+            The shared component instance
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _RegistryEntry()
+                self._entries[key] = entry
+            entry.ref_count += 1
+
+        loading = getattr(self._loading, "stack", None)
+        if loading is None:
+            loading = self._loading.stack = []
+        try:
+            if not entry.loaded:
+                with entry.lock:
+                    if not entry.loaded:
+                        loading.append(entry)
+                        try:
+                            entry.instance = factory()
+                        finally:
+                            loading.pop()
+                        entry.loaded = True
+        except Exception:
+            with self._lock:
+                entry.ref_count -= 1
+            raise
+
+        if loading:
+            loading[-1].dependencies.append(key)
+        return entry.instance
+
+    def release(self, key: Hashable):
+        """
+        Drop one reference to the component registered under key.
+
+        Args:
+            key: Identifier previously passed to acquire()
+        """
+        with self._lock:
+            self._release(self._entries.get(key), time.monotonic())
+
+    def unload_unused(self, idle_seconds: Optional[float] = None) -> int:
+        """
+        Unload every component that has had no references for idle_seconds.
+
+        Unloaded components are closed if they have a close() method, and the
+        components their factories acquired are released (and unloaded in the
+        same pass once nothing else references them).
+
+        Args:
+            idle_seconds: Grace period; defaults to the registry's idle_seconds
+
+        Returns:
+            Number of components unloaded
+        """
+        cutoff = time.monotonic() - (self.idle_seconds if idle_seconds is None else idle_seconds)
+        unloaded = []
+        with self._lock:
+            unused = [key for key, entry in self._entries.items()
+                      if entry.ref_count == 0 and entry.released_at <= cutoff]
+            while unused:
+                entry = self._entries.pop(unused.pop())
+                unloaded.append(entry)
+                for dependency in entry.dependencies:
+                    dependency_entry = self._entries.get(dependency)
+                    # Counted as idle since its dependent was
+                    if self._release(dependency_entry, entry.released_at):
+                        unused.append(dependency)
+
+        for entry in unloaded:
+            close = getattr(entry.instance, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    print(f"Error closing unloaded component: {e}")
+        return len(unloaded)
+
+    @staticmethod
+    def _release(entry: Optional[_RegistryEntry], now: float) -> bool:
+        """Drop one reference; True if it was the last. Caller holds the lock."""
+        if entry is None or entry.ref_count == 0:
+            return False
+        entry.ref_count -= 1
+        if entry.ref_count == 0:
+            entry.released_at = now
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get a snapshot of registered components and their reference counts.
+
+        Returns:
+            Dictionary mapping component keys to loaded state and ref counts
+        """
+        with self._lock:
+            return {
+                str(key): {"loaded": entry.loaded, "ref_count": entry.ref_count}
+                for key, entry in self._entries.items()
+            }
+
+
+# Shared registry used by every agent in the process
+registry = ModelRegistry(idle_seconds=float(os.environ.get("MODEL_REGISTRY_IDLE_SECONDS", "600")))
+
+
+def _collect_metrics():
+    """Export shared component reference counts."""
+    for key, entry in registry.stats().items():
+        yield "mindguard_shared_component_refs", "gauge", {"component": key}, entry["ref_count"]
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("mindguard_shared_component_refs", "References held on shared model registry components")
+
+
+def _offline_mode() -> bool:
+    return os.environ.get("OFFLINE_MODE") == "true"
+
+
+# Component specs: each returns the registry key and the factory that builds
+# the component, so callers can acquire() it and later release() the same key.
+
+def emotion_analyzer_spec() -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared emotion analyzer (loads the transformer model)."""
+    from agent.emotion_analysis import EmotionAnalyzer
+
+    return ("emotion_analyzer",), lambda: EmotionAnalyzer(
+        offline_mode=False,  # Try online first, fallback to offline
+        cache_dir="./cached_models"
+    )
+
+
+def emotion_scheduler_spec() -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared micro-batching front end of the emotion analyzer."""
+    from agent.emotion_batching import create_scheduler
+
+    # The scheduler holds its reference to the analyzer until it is unloaded
+    return ("emotion_scheduler",), lambda: create_scheduler(registry.acquire(*emotion_analyzer_spec()))
+
+
+def therapeutic_modalities_spec() -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared therapeutic modalities catalog."""
+    from agent.therapeutic_modalities import TherapeuticModalities
+
+    return ("therapeutic_modalities",), TherapeuticModalities
+
+
+def llm_spec(provider: Optional[str] = None, temperature: float = 0.7) -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared chat model of a provider and temperature."""
+    from agent.llm_factory import LLMFactory
+
+    return ("llm", provider, temperature, _offline_mode()), lambda: LLMFactory.create_llm(
+        provider=provider,
+        temperature=temperature
+    )
+
+
+def embeddings_spec(provider: Optional[str] = None) -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared embeddings client of a provider."""
+    from agent.llm_factory import LLMFactory
+
+    return ("embeddings", provider, _offline_mode()), lambda: LLMFactory.create_embeddings(provider)
+
+
+def provider_pool_spec(temperature: float = 0.7) -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared failover pool over every configured chat provider."""
+    from agent.llm_factory import LLMFactory
+    from agent.provider_pool import create_pool
+
+    providers = tuple(LLMFactory.available_providers())
+    return ("provider_pool", providers, temperature), lambda: create_pool(temperature, list(providers))
+
+
+def response_cache_spec(provider: Optional[str] = None) -> Tuple[Hashable, Callable[[], Any]]:
+    """Spec for the shared semantic response cache (one per embedding space)."""
+    from agent.response_cache import create_response_cache
+
+    def factory():
+        # The cache holds its reference to the embeddings until it is unloaded
+        try:
+            embeddings = registry.acquire(*embeddings_spec(provider))
+        except Exception as e:
+            print(f"Warning: Response cache falling back to exact matches: {e}")
+            embeddings = None
+        return create_response_cache(embeddings)
+
+    return ("response_cache", provider, _offline_mode()), factory
@@ -14,6 +14,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from collections import defaultdict
 
+from agent.metrics import record_store_io
+
 
 class MoodTracker:
     """
@@ -46,6 +48,7 @@ class MoodTracker:
         if os.path.exists(self.user_data_path):
             try:
                 with open(self.user_data_path, 'r') as f:
+                    record_store_io("mood", "read")
                     return json.load(f)
             except Exception as e:
                 print(f"Error loading mood data: {e}")
@@ -66,10 +69,15 @@ class MoodTracker:
         """Save mood data to disk."""
         try:
             with open(self.user_data_path, 'w') as f:
+                record_store_io("mood", "write")
                 json.dump(self.mood_data, f, indent=2)
         except Exception as e:
             print(f"Error saving mood data: {e}")
             
+    def flush(self):
+        """Persist the current mood data to disk."""
+        self._save_data()
+            
     def add_mood_entry(self, 
                       mood: str, 
                       valence: float, 
@@ -0,0 +1,167 @@
+"""
+Indexed, emotion-aware response selection for the offline LLM.
+
+The response bank (offline_responses.json) lists supportive replies, each
+tagged with the emotions it suits and the keywords or short phrases it
+answers. At load time every keyword is indexed as a phrase of up to
+MAX_PHRASE_WORDS normalized words in an inverted index, weighted by
+inverse document frequency and phrase length. Picking a reply is one
+dictionary probe per word n-gram of the message. Entries tagged with the
+detected emotion get a bonus. Without a keyword match the emotion's
+default reply is used.
+"""
+
+from typing import Dict, List, Any, Optional, Tuple
+import functools
+import json
+import math
+import os
+import re
+
+# Longest keyword phrase indexed, in words
+MAX_PHRASE_WORDS = 3
+
+# Score added to matched entries tagged with the detected emotion
+EMOTION_BONUS = 0.5
+
+DEFAULT_EMOTION = "neutral"
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# The workflow states the detected emotion in the system prompt
+_EMOTION_IN_PROMPT = re.compile(r"emotional state:\s*([a-z_]+)", re.IGNORECASE)
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lowercase words, with a plural "s" stripped so "thanks" matches "thank"."""
+    words = []
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "'s")):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def emotion_from_prompt(text: str) -> Optional[str]:
+    """
+    Extract the detected emotion from a prompt built by the workflow.
+
+    Args:
+        text: System prompt text
+
+    Returns:
+        The emotion label, or None if the prompt does not state one
+    """
+    match = _EMOTION_IN_PROMPT.search(text)
+    return match.group(1).lower() if match else None
+
+
+class ResponseBank:
+    """Inverted index from keyword phrases to supportive responses."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        """
+        Build the index.
+
+        Args:
+            entries: Response entries with "response", "emotions" and optional
+                "keywords"; entries without keywords are emotion defaults
+        """
+        self.responses: List[str] = [entry["response"] for entry in entries]
+        self.emotions: List[frozenset] = [frozenset(entry.get("emotions", [])) for entry in entries]
+        self.defaults: Dict[str, int] = {}
+
+        phrases_per_entry: List[set] = []
+        document_frequency: Dict[str, int] = {}
+        for index, entry in enumerate(entries):
+            phrases = set()
+            for keyword in entry.get("keywords", []):
+                words = normalize_words(keyword)
+                if 0 < len(words) <= MAX_PHRASE_WORDS:
+                    phrases.add(" ".join(words))
+            phrases_per_entry.append(phrases)
+            for phrase in phrases:
+                document_frequency[phrase] = document_frequency.get(phrase, 0) + 1
+            if not phrases:
+                for emotion in entry.get("emotions", []):
+                    self.defaults.setdefault(emotion, index)
+
+        self.index: Dict[str, List[Tuple[int, float]]] = {}
+        count = len(entries)
+        for index, phrases in enumerate(phrases_per_entry):
+            for phrase in phrases:
+                # Rarer and longer phrases are stronger evidence
+                weight = math.log(1.0 + count / document_frequency[phrase]) * len(phrase.split())
+                self.index.setdefault(phrase, []).append((index, weight))
+
+    @classmethod
+    def from_file(cls, path: str) -> "ResponseBank":
+        """
+        Load a response bank from a JSON file with a "responses" list.
+
+        Args:
+            path: Path to the JSON file
+
+        Returns:
+            The indexed bank
+        """
+        with open(path, "r") as f:
+            return cls(json.load(f)["responses"])
+
+    def best_response(self, text: str, emotion: Optional[str] = None) -> str:
+        """
+        Pick the best-matching response for a message.
+
+        Args:
+            text: The user's message
+            emotion: Detected emotion, if known
+
+        Returns:
+            Response text
+        """
+        scores: Dict[int, float] = {}
+        words = normalize_words(text)
+        seen = set()
+        for size in range(1, MAX_PHRASE_WORDS + 1):
+            for start in range(len(words) - size + 1):
+                phrase = " ".join(words[start:start + size])
+                if phrase in seen:
+                    continue
+                seen.add(phrase)
+                for index, weight in self.index.get(phrase, ()):
+                    scores[index] = scores.get(index, 0.0) + weight
+
+        if scores:
+            # Highest score wins; earlier entries win ties
+            best = max(scores, key=lambda index: (
+                scores[index] + (EMOTION_BONUS if emotion in self.emotions[index] else 0.0),
+                -index
+            ))
+            return self.responses[best]
+        return self.default_response(emotion)
+
+    def default_response(self, emotion: Optional[str] = None) -> str:
+        """Response for a message without keyword matches, conditioned on the emotion."""
+        index = self.defaults.get(emotion or DEFAULT_EMOTION, self.defaults.get(DEFAULT_EMOTION))
+        if index is None:
+            return "Thank you for sharing. I'm listening and here to support you. Could you tell me more about how you're feeling?"
+        return self.responses[index]
+
+
+@functools.lru_cache(maxsize=None)
+def get_response_bank(path: Optional[str] = None) -> ResponseBank:
+    """
+    Get the shared response bank, loaded and indexed once per process.
+
+    Args:
+        path: JSON file to load (default: OFFLINE_RESPONSES_PATH or the
+            offline_responses.json shipped with the agent)
+
+    Returns:
+        The indexed bank
+    """
+    path = path or os.environ.get(
+        "OFFLINE_RESPONSES_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "offline_responses.json")
+    )
+    return ResponseBank.from_file(path)
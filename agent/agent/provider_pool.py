@@ -0,0 +1,519 @@
+"""
+Provider pool with health scoring, circuit breakers and hedged requests.
+
+The pool holds one shared chat client per configured provider (openai, groq,
+gemini). Each call goes to the requested primary provider first and fails
+over to the healthiest remaining providers, skipping any whose circuit
+breaker is open. On the async path calls are bounded by a timeout and can
+optionally be hedged: once the primary has been running for longer than its
+observed p95 latency, the same request is sent to a secondary provider and
+whichever answers first wins.
+
+Failover is therefore a cheap client swap; agents, memory and trackers are
+never rebuilt because a provider is down.
+"""
+
+from typing import Dict, List, Any, Optional, Iterator, AsyncIterator, Tuple
+from collections import deque
+import asyncio
+import math
+import os
+import threading
+import time
+import weakref
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from agent.llm_factory import LLMFactory
+from agent.metrics import metrics
+
+# Numeric encoding of circuit states for the exported gauge
+_CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+# Live pools, so their health can be exported without owning them
+_pools: "weakref.WeakSet[ProviderPool]" = weakref.WeakSet()
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    closed: requests flow; consecutive failures are counted.
+    open: requests are rejected until reset_timeout has elapsed.
+    half_open: trial requests flow; a success closes, a failure re-opens.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds to wait before allowing trial requests
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+
+    def is_available(self) -> bool:
+        """Whether allow_request() would let a request through, without changing state."""
+        return self.state != self.OPEN or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """Admit a request about to be sent; an open circuit past its timeout turns half-open."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """Health score, circuit breaker and latency window of one provider."""
+
+    def __init__(self, provider: str, breaker: CircuitBreaker, window_size: int = 200):
+        self.provider = provider
+        self.breaker = breaker
+        # Exponentially weighted success rate in [0, 1]
+        self.score = 1.0
+        self.latencies: deque = deque(maxlen=window_size)
+
+    def record_success(self, latency: float):
+        self.score = 0.8 * self.score + 0.2
+        self.latencies.append(latency)
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.score = 0.8 * self.score
+        self.breaker.record_failure()
+
+    def p95(self, min_samples: int) -> Optional[float]:
+        """Observed p95 latency, or None until enough samples exist."""
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+class ProviderPool:
+    """
+    Pool of shared chat clients keyed by provider, with failover.
+
+    Features:
+    - Primary-first ordering, then remaining providers by health score
+    - Per-provider circuit breakers
+    - Per-call timeouts on the async path
+    - Optional hedged requests once the primary exceeds its observed p95
+    """
+
+    def __init__(self,
+                 providers: List[str],
+                 temperature: float = 0.7,
+                 timeout: Optional[float] = 30.0,
+                 hedge: bool = False,
+                 hedge_min_samples: int = 20,
+                 failure_threshold: int = 3,
+                 reset_timeout: float = 30.0):
+        """
+        Initialize the provider pool.
+
+        Args:
+            providers: Provider names in default priority order
+            temperature: Temperature for every client in the pool
+            timeout: Seconds before an async call is abandoned (None disables)
+            hedge: Whether to send hedged requests to a secondary provider
+            hedge_min_samples: Latency samples needed before hedging a provider
+            failure_threshold: Consecutive failures that open a circuit
+            reset_timeout: Seconds an open circuit waits before trial requests
+        """
+        self.providers = list(providers)
+        self.temperature = temperature
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+
+        self._lock = threading.Lock()
+        self._clients: Dict[str, BaseChatModel] = {}
+        self._health = {
+            provider: ProviderHealth(provider, CircuitBreaker(failure_threshold, reset_timeout))
+            for provider in self.providers
+        }
+
+        _pools.add(self)
+
+    def client(self, provider: str) -> BaseChatModel:
+        """Get the shared client for a provider, creating it on first use."""
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None:
+                # The pool fails over itself; SDK-level retries would only delay it
+                kwargs = {"max_retries": 0} if provider in ("openai", "groq") else {}
+                client = LLMFactory.create_llm(provider=provider, temperature=self.temperature, **kwargs)
+                self._clients[provider] = client
+            return client
+
+    def candidates(self, primary: Optional[str] = None) -> List[str]:
+        """
+        Order providers for a call: the primary first, then the rest by
+        health score. Providers with an open circuit are skipped.
+
+        Args:
+            primary: Preferred provider for this call
+
+        Returns:
+            Provider names to try, in order
+        """
+        with self._lock:
+            others = sorted(
+                (p for p in self.providers if p != primary),
+                key=lambda p: self._health[p].score,
+                reverse=True
+            )
+            ordered = ([primary] if primary in self._health else []) + others
+            # Only a provider actually called takes a trial request from its breaker
+            return [p for p in ordered if self._health[p].breaker.is_available()]
+
+    def invoke(self, messages: List[BaseMessage], primary: Optional[str] = None, **kwargs: Any) -> BaseMessage:
+        """
+        Call the first healthy provider that succeeds.
+
+        The sync path relies on each client's own request timeout and does
+        not hedge.
+
+        Args:
+            messages: Chat messages to send
+            primary: Preferred provider for this call
+            **kwargs: Extra arguments for the chat model
+
+        Returns:
+            The model's response message
+        """
+        last_error: Optional[BaseException] = None
+        for provider in self._candidates_or_raise(primary):
+            if not self._admit(provider):
+                continue
+            start = time.perf_counter()
+            try:
+                response = self.client(provider).invoke(messages, **kwargs)
+            except Exception as e:
+                self._record_failure(provider, e)
+                last_error = e
+                continue
+            self._record_success(provider, time.perf_counter() - start)
+            return response
+        raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+    async def ainvoke(self, messages: List[BaseMessage], primary: Optional[str] = None, **kwargs: Any) -> BaseMessage:
+        """
+        Call providers in order with timeouts and optional hedging.
+
+        Args:
+            messages: Chat messages to send
+            primary: Preferred provider for this call
+            **kwargs: Extra arguments for the chat model
+
+        Returns:
+            The model's response message
+        """
+        candidates = self._candidates_or_raise(primary)
+        last_error: Optional[BaseException] = None
+
+        while candidates:
+            provider = candidates.pop(0)
+            hedge_after = self._health[provider].p95(self.hedge_min_samples) if self.hedge else None
+            if hedge_after is not None and candidates:
+                secondary = candidates.pop(0)
+                try:
+                    return await self._hedged_call(provider, secondary, hedge_after, messages, kwargs)
+                except Exception as e:
+                    last_error = e
+                    continue
+
+            try:
+                return await self._timed_call(provider, messages, kwargs)
+            except Exception as e:
+                last_error = e
+
+        raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+    def stream(self, messages: List[BaseMessage], primary: Optional[str] = None, **kwargs: Any) -> Iterator[BaseMessage]:
+        """
+        Stream from the first provider that produces a chunk.
+
+        Failover is only possible before the first chunk has been yielded.
+        """
+        last_error: Optional[BaseException] = None
+        for provider in self._candidates_or_raise(primary):
+            if not self._admit(provider):
+                continue
+            start = time.perf_counter()
+            chunks = self.client(provider).stream(messages, **kwargs)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self._record_success(provider, time.perf_counter() - start)
+                return
+            except Exception as e:
+                self._record_failure(provider, e)
+                last_error = e
+                continue
+
+            yield first
+            try:
+                for chunk in chunks:
+                    yield chunk
+            except Exception as e:
+                self._record_failure(provider, e)
+                raise
+            self._record_success(provider, time.perf_counter() - start)
+            return
+        raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+    async def astream(self, messages: List[BaseMessage], primary: Optional[str] = None, **kwargs: Any) -> AsyncIterator[BaseMessage]:
+        """
+        Async stream from the first provider that produces a chunk in time.
+
+        Failover is only possible before the first chunk has been yielded.
+        """
+        last_error: Optional[BaseException] = None
+        for provider in self._candidates_or_raise(primary):
+            if not self._admit(provider):
+                continue
+            start = time.perf_counter()
+            chunks = self.client(provider).astream(messages, **kwargs)
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                self._record_success(provider, time.perf_counter() - start)
+                return
+            except Exception as e:
+                self._record_failure(provider, e)
+                await chunks.aclose()
+                last_error = e
+                continue
+
+            yield first
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            except Exception as e:
+                self._record_failure(provider, e)
+                raise
+            self._record_success(provider, time.perf_counter() - start)
+            return
+        raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get per-provider health.
+
+        Returns:
+            Dictionary mapping provider names to score, breaker state and p95
+        """
+        with self._lock:
+            return {
+                provider: {
+                    "health_score": health.score,
+                    "circuit_state": health.breaker.state,
+                    "consecutive_failures": health.breaker.consecutive_failures,
+                    "p95_seconds": health.p95(1)
+                }
+                for provider, health in self._health.items()
+            }
+
+    def _candidates_or_raise(self, primary: Optional[str]) -> List[str]:
+        candidates = self.candidates(primary)
+        if not candidates:
+            raise RuntimeError("No provider available: every circuit is open")
+        return candidates
+
+    def _admit(self, provider: str) -> bool:
+        """Ask a provider's breaker to admit a call about to be made."""
+        with self._lock:
+            return self._health[provider].breaker.allow_request()
+
+    async def _timed_call(self, provider: str, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> BaseMessage:
+        if not self._admit(provider):
+            raise RuntimeError(f"Circuit open for provider {provider}")
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.client(provider).ainvoke(messages, **kwargs),
+                self.timeout
+            )
+        except Exception as e:
+            self._record_failure(provider, e)
+            raise
+        self._record_success(provider, time.perf_counter() - start)
+        return response
+
+    async def _hedged_call(self,
+                           primary: str,
+                           secondary: str,
+                           hedge_after: float,
+                           messages: List[BaseMessage],
+                           kwargs: Dict[str, Any]) -> BaseMessage:
+        """Race the primary against a secondary started after hedge_after seconds."""
+        primary_task = asyncio.ensure_future(self._timed_call(primary, messages, kwargs))
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+        if done and not primary_task.exception():
+            return primary_task.result()
+
+        metrics.increment("mindguard_provider_hedged_requests_total", primary=primary, secondary=secondary)
+        tasks = {primary_task, asyncio.ensure_future(self._timed_call(secondary, messages, kwargs))}
+        if done:
+            # The primary already failed; only the secondary is left
+            tasks.discard(primary_task)
+
+        last_error: Optional[BaseException] = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise last_error
+
+    def _record_success(self, provider: str, latency: float):
+        with self._lock:
+            self._health[provider].record_success(latency)
+        metrics.observe("mindguard_provider_latency_seconds", latency, provider=provider, operation="pool_call")
+
+    def _record_failure(self, provider: str, error: BaseException):
+        with self._lock:
+            self._health[provider].record_failure()
+        metrics.increment("mindguard_provider_failures_total", provider=provider, error=type(error).__name__)
+        print(f"Provider {provider} failed: {type(error).__name__}: {error}")
+
+
+class PooledChatModel(BaseChatModel):
+    """Chat model that routes every call through a ProviderPool."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    pool: ProviderPool
+    primary: Optional[str] = None
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        response = self.pool.invoke(messages, primary=self.primary, **self._call_kwargs(stop, kwargs))
+        return ChatResult(generations=[ChatGeneration(message=_as_ai_message(response))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        response = await self.pool.ainvoke(messages, primary=self.primary, **self._call_kwargs(stop, kwargs))
+        return ChatResult(generations=[ChatGeneration(message=_as_ai_message(response))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        for message in self.pool.stream(messages, primary=self.primary, **self._call_kwargs(stop, kwargs)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=message.content))
+            if run_manager:
+                run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async for message in self.pool.astream(messages, primary=self.primary, **self._call_kwargs(stop, kwargs)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=message.content))
+            if run_manager:
+                await run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _call_kwargs(stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {**kwargs, "stop": stop} if stop else kwargs
+
+    @property
+    def _llm_type(self) -> str:
+        return "provider_pool"
+
+
+def _as_ai_message(message: BaseMessage) -> AIMessage:
+    if isinstance(message, AIMessage) and not isinstance(message, AIMessageChunk):
+        return message
+    return AIMessage(content=message.content)
+
+
+def create_pool(temperature: float = 0.7, providers: Optional[List[str]] = None) -> ProviderPool:
+    """
+    Create a pool configured from PROVIDER_* environment variables.
+
+    Args:
+        temperature: Temperature for every client in the pool
+        providers: Providers to pool (defaults to every provider with an API key)
+
+    Returns:
+        The configured provider pool
+    """
+    timeout = float(os.environ.get("PROVIDER_TIMEOUT_SECONDS", "30"))
+    return ProviderPool(
+        providers=providers if providers is not None else LLMFactory.available_providers(),
+        temperature=temperature,
+        timeout=timeout if timeout > 0 else None,
+        hedge=os.environ.get("PROVIDER_HEDGE") == "true",
+        hedge_min_samples=int(os.environ.get("PROVIDER_HEDGE_MIN_SAMPLES", "20")),
+        failure_threshold=int(os.environ.get("PROVIDER_BREAKER_FAILURES", "3")),
+        reset_timeout=float(os.environ.get("PROVIDER_BREAKER_RESET_SECONDS", "30"))
+    )
+
+
+def _collect_metrics():
+    """Export per-provider health scores and circuit states of every live pool."""
+    for index, pool in enumerate(list(_pools)):
+        for provider, health in pool.stats().items():
+            labels = {"pool": str(index), "provider": provider}
+            yield "mindguard_provider_health_score", "gauge", labels, health["health_score"]
+            yield "mindguard_provider_circuit_state", "gauge", labels, _CIRCUIT_STATE_VALUES[health["circuit_state"]]
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("mindguard_provider_health_score", "Exponentially weighted success rate of each pooled provider")
+metrics.describe("mindguard_provider_circuit_state", "Circuit breaker state per provider (0 closed, 1 half open, 2 open)")
+metrics.describe("mindguard_provider_failures_total", "Failed calls to pooled chat providers")
+metrics.describe("mindguard_provider_hedged_requests_total", "Requests hedged to a secondary provider")
@@ -0,0 +1,415 @@
+"""
+Per-provider rate limiting with priority lanes.
+
+Each provider with a configured quota gets a ProviderRateLimiter holding a
+requests-per-minute and/or tokens-per-minute token bucket. Callers queue
+for capacity in one of three lanes and are served strictly by lane, then in
+arrival order:
+
+- high: escalated or crisis-adjacent conversations
+- normal: regular chat traffic (the default)
+- low: background jobs such as conversation summarization
+
+The lane is taken from a context variable set with priority_lane(), so it
+follows a request through run_blocking() and into tasks it creates.
+Sync callers block their thread while queued; async callers wait without
+blocking the event loop. A caller that cannot be served within the maximum
+wait gets RateLimitTimeout, which the provider pool treats as a failure and
+fails over.
+
+Quotas come from RATE_LIMIT_<PROVIDER>_RPM and RATE_LIMIT_<PROVIDER>_TPM
+(e.g. RATE_LIMIT_OPENAI_TPM); providers without either are not limited.
+"""
+
+from typing import Dict, List, Any, Optional, Callable, Iterator, AsyncIterator, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from agent.metrics import metrics
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+LANES = (HIGH, NORMAL, LOW)
+
+_LANE_ORDER = {lane: order for order, lane in enumerate(LANES)}
+
+_current_lane: ContextVar[str] = ContextVar("rate_limit_lane", default=NORMAL)
+
+
+@contextmanager
+def priority_lane(lane: str):
+    """
+    Run the enclosed provider calls in a rate limiter lane.
+
+    Args:
+        lane: "high", "normal" or "low"
+    """
+    if lane not in _LANE_ORDER:
+        raise ValueError(f"Unknown rate limit lane: {lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    """Get the lane of the current context."""
+    return _current_lane.get()
+
+
+async def astream_in_lane(stream: AsyncIterator[Any], lane: str) -> AsyncIterator[Any]:
+    """
+    Start an async stream in a lane, then relay its items.
+
+    Rate limit capacity is acquired when the stream produces its first item,
+    so the lane only needs to be set for that step. Holding it across the
+    yields of an async generator would reset it in whatever context
+    finalizes the generator, which fails if that is another one.
+
+    Args:
+        stream: Async iterator that has not been started
+        lane: "high", "normal" or "low"
+
+    Yields:
+        The stream's items
+    """
+    with priority_lane(lane):
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            return
+    yield first
+    async for item in stream:
+        yield item
+
+
+class RateLimitTimeout(TimeoutError):
+    """Raised when a caller waited longer than the limiter's maximum wait."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Initialize a full bucket.
+
+        Args:
+            per_minute: Tokens added per minute
+            capacity: Maximum burst (default: one minute of tokens)
+        """
+        if per_minute <= 0:
+            raise ValueError("per_minute must be positive")
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount tokens are available (0 if they are now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the bucket is admitted once it is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    """A queued caller and the callable that wakes it up."""
+
+    def __init__(self, lane: str, tokens: int, wake: Callable[[], None]):
+        self.lane = lane
+        self.tokens = tokens
+        self.wake = wake
+
+
+class ProviderRateLimiter:
+    """Request and token quotas of one provider, shared by all its clients."""
+
+    def __init__(self,
+                 provider: str,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_wait: float = 30.0):
+        """
+        Initialize the limiter.
+
+        Args:
+            provider: Provider name used as the metric label
+            requests_per_minute: Request quota, or None for no request limit
+            tokens_per_minute: Token quota, or None for no token limit
+            max_wait: Longest a caller may queue before RateLimitTimeout
+        """
+        self.provider = provider
+        self.max_wait = max_wait
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+
+    def acquire(self, tokens: int = 0, lane: Optional[str] = None) -> float:
+        """
+        Wait for capacity for one request, blocking the calling thread.
+
+        Args:
+            tokens: Tokens the request is expected to use
+            lane: Priority lane (default: the lane of the current context)
+
+        Returns:
+            Seconds spent waiting
+        """
+        event = threading.Event()
+        waiter = self._enqueue(tokens, lane, event.set)
+        start = time.monotonic()
+        try:
+            while True:
+                event.clear()
+                delay = self._try_acquire(waiter)
+                if delay == 0.0:
+                    return self._granted(waiter, start)
+                event.wait(self._next_wait(waiter, start, delay))
+        except BaseException:
+            self._remove(waiter)
+            raise
+
+    async def aacquire(self, tokens: int = 0, lane: Optional[str] = None) -> float:
+        """
+        Wait for capacity for one request without blocking the event loop.
+
+        Args:
+            tokens: Tokens the request is expected to use
+            lane: Priority lane (default: the lane of the current context)
+
+        Returns:
+            Seconds spent waiting
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop is closed; it is gone
+                pass
+
+        waiter = self._enqueue(tokens, lane, wake)
+        start = time.monotonic()
+        try:
+            while True:
+                event.clear()
+                delay = self._try_acquire(waiter)
+                if delay == 0.0:
+                    return self._granted(waiter, start)
+                # Outside the try: RateLimitTimeout is itself a TimeoutError
+                timeout = self._next_wait(waiter, start, delay)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._remove(waiter)
+            raise
+
+    def queue_depths(self) -> Dict[str, int]:
+        """
+        Get the number of queued callers per lane.
+
+        Returns:
+            Dictionary mapping lane to queue depth
+        """
+        depths = {lane: 0 for lane in LANES}
+        with self._lock:
+            for _, _, waiter in self._queue:
+                depths[waiter.lane] += 1
+        return depths
+
+    def _enqueue(self, tokens: int, lane: Optional[str], wake: Callable[[], None]) -> _Waiter:
+        lane = lane or current_lane()
+        waiter = _Waiter(lane, tokens, wake)
+        with self._lock:
+            heapq.heappush(self._queue, (_LANE_ORDER[lane], next(self._sequence), waiter))
+        return waiter
+
+    def _try_acquire(self, waiter: _Waiter) -> Optional[float]:
+        """
+        Take capacity for the waiter if it is first in line.
+
+        Returns:
+            0.0 when granted, the seconds until capacity is available when
+            first in line, or None when another caller is ahead
+        """
+        with self._lock:
+            if self._queue[0][2] is not waiter:
+                return None
+            now = time.monotonic()
+            delay = 0.0
+            if self.request_bucket:
+                delay = max(delay, self.request_bucket.wait_time(1, now))
+            if self.token_bucket:
+                delay = max(delay, self.token_bucket.wait_time(waiter.tokens, now))
+            if delay > 0.0:
+                return delay
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket:
+                self.token_bucket.consume(waiter.tokens)
+            heapq.heappop(self._queue)
+            head = self._queue[0][2] if self._queue else None
+        if head is not None:
+            head.wake()
+        return 0.0
+
+    def _next_wait(self, waiter: _Waiter, start: float, delay: Optional[float]) -> float:
+        """Time to sleep before checking again, or RateLimitTimeout once max_wait is spent."""
+        remaining = start + self.max_wait - time.monotonic()
+        if remaining <= 0:
+            metrics.increment("mindguard_rate_limit_timeouts_total", provider=self.provider, lane=waiter.lane)
+            raise RateLimitTimeout(f"Waited over {self.max_wait}s for {self.provider} rate limit capacity")
+        return remaining if delay is None else min(delay, remaining)
+
+    def _remove(self, waiter: _Waiter):
+        """Drop a caller that gave up, and let the next one in if it was first."""
+        with self._lock:
+            was_head = bool(self._queue) and self._queue[0][2] is waiter
+            remaining = [entry for entry in self._queue if entry[2] is not waiter]
+            if len(remaining) == len(self._queue):
+                return
+            heapq.heapify(remaining)
+            self._queue = remaining
+            head = self._queue[0][2] if self._queue else None
+        if was_head and head is not None:
+            head.wake()
+
+    def _granted(self, waiter: _Waiter, start: float) -> float:
+        waited = time.monotonic() - start
+        metrics.observe("mindguard_rate_limit_wait_seconds", waited, provider=self.provider, lane=waiter.lane)
+        return waited
+
+
+_limiters_lock = threading.Lock()
+_limiters: Dict[str, Optional[ProviderRateLimiter]] = {}
+
+
+def get_rate_limiter(provider: str) -> Optional[ProviderRateLimiter]:
+    """
+    Get the shared rate limiter of a provider.
+
+    Args:
+        provider: Provider name (e.g. "openai", "groq", "gemini")
+
+    Returns:
+        The limiter, or None if no quota is configured for the provider
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            prefix = f"RATE_LIMIT_{provider.upper()}"
+            rpm = float(os.environ.get(f"{prefix}_RPM", "0"))
+            tpm = float(os.environ.get(f"{prefix}_TPM", "0"))
+            _limiters[provider] = ProviderRateLimiter(
+                provider,
+                requests_per_minute=rpm or None,
+                tokens_per_minute=tpm or None,
+                max_wait=float(os.environ.get("RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+            ) if rpm or tpm else None
+        return _limiters[provider]
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model wrapper that waits for rate limiter capacity before each call."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    llm: BaseChatModel
+    limiter: ProviderRateLimiter
+    # Tokens reserved for the completion on top of the estimated prompt size
+    completion_tokens: int = 256
+
+    def _cost(self, messages: List[BaseMessage]) -> int:
+        # Imported here because memory imports llm_factory, which imports this module
+        from agent.memory import estimate_tokens
+        return estimate_tokens(messages) + self.completion_tokens
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        self.limiter.acquire(self._cost(messages))
+        return self.llm._generate(messages, stop=stop, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        await self.limiter.aacquire(self._cost(messages))
+        return await self.llm._agenerate(messages, stop=stop, **kwargs)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        self.limiter.acquire(self._cost(messages))
+        for chunk in self.llm._stream(messages, stop=stop, **kwargs):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await self.limiter.aacquire(self._cost(messages))
+        async for chunk in self.llm._astream(messages, stop=stop, **kwargs):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate_limited_{self.llm._llm_type}"
+
+
+def _collect_metrics():
+    """Export the queue depth of every configured limiter per lane."""
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+    for limiter in limiters:
+        for lane, depth in limiter.queue_depths().items():
+            yield "mindguard_rate_limit_queue_depth", "gauge", {"provider": limiter.provider, "lane": lane}, depth
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("mindguard_rate_limit_queue_depth", "Callers queued for provider rate limit capacity per lane")
+metrics.describe("mindguard_rate_limit_wait_seconds", "Time spent queued for provider rate limit capacity")
+metrics.describe("mindguard_rate_limit_timeouts_total", "Calls that gave up waiting for rate limit capacity")
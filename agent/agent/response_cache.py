@@ -0,0 +1,270 @@
+"""
+Semantic response cache for clinical chat responses.
+
+Many conversations open with near-identical messages ("I feel anxious
+today", "hi, I'm stressed"). The cache stores generated responses keyed on
+the normalized input, the detected emotion and a hash of the context
+rendered into the prompt. The cache is shared by every user, so callers
+bypass it for prompts that carry a user's own conversation. A lookup first
+tries an exact match on the normalized input, then an embedding-similarity
+match among entries with the same emotion and context hash. Entries expire
+after a TTL and are evicted LRU beyond a size bound.
+"""
+
+from typing import Dict, List, Any, Optional, Tuple, Callable
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from agent.metrics import metrics
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text, drop punctuation and collapse whitespace."""
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def context_hash(*parts: Any) -> str:
+    """
+    Hash prompt context into a short, stable key.
+
+    Args:
+        *parts: JSON-serializable context parts
+
+    Returns:
+        Hex digest identifying the context
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class CacheKey:
+    """Lookup key for one request; the input embedding is computed at most once."""
+
+    def __init__(self, text: str, emotion: str, context: str):
+        self.text = normalize_text(text)
+        self.emotion = emotion
+        self.context = context
+        self.vector: Optional[np.ndarray] = None
+
+    @property
+    def exact(self) -> Tuple[str, str, str]:
+        return (self.text, self.emotion, self.context)
+
+    @property
+    def bucket(self) -> Tuple[str, str]:
+        return (self.emotion, self.context)
+
+
+class _CacheEntry:
+    def __init__(self, key: CacheKey, response: str, latency: float, created: float):
+        self.key = key
+        self.response = response
+        self.latency = latency
+        self.created = created
+
+
+class SemanticResponseCache:
+    """
+    TTL- and LRU-bounded response cache with an embedding-similarity lookup.
+
+    Features:
+    - Exact match on normalized input, emotion and context hash
+    - Cosine-similarity match above a threshold within the same emotion and context
+    - TTL expiry and LRU eviction
+    - Hit rate and generation latency saved by hits
+    """
+
+    def __init__(self,
+                 embeddings: Optional[Embeddings] = None,
+                 max_size: int = 512,
+                 ttl_seconds: Optional[float] = 3600,
+                 similarity_threshold: float = 0.92,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the response cache.
+
+        Args:
+            embeddings: Embeddings used for similarity lookups (None for exact matches only)
+            max_size: Maximum number of cached responses
+            ttl_seconds: Age after which a cached response expires (None disables)
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+            clock: Monotonic time source, overridable for testing
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Exact key -> entry, ordered from least to most recently used
+        self._entries: "OrderedDict[Tuple[str, str, str], _CacheEntry]" = OrderedDict()
+        self._counters = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+        self._latency_saved = 0.0
+
+    def key(self, text: str, emotion: str, context: str) -> CacheKey:
+        """
+        Build the lookup key for a request.
+
+        Args:
+            text: Raw user input
+            emotion: Detected emotion label
+            context: Hash of the prompt context from context_hash()
+
+        Returns:
+            Key to pass to get() and put()
+        """
+        return CacheKey(text, emotion, context)
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        May call the embeddings provider, so async callers should offload it.
+
+        Args:
+            key: Key from key()
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        with self._lock:
+            self._expire(self._clock())
+            entry = self._entries.get(key.exact)
+            if entry is not None:
+                return self._hit(entry, "exact")
+            candidates = [e for e in self._entries.values() if e.key.bucket == key.bucket and e.key.vector is not None]
+
+        entry = self._most_similar(key, candidates) if candidates else None
+
+        with self._lock:
+            if entry is not None and entry.key.exact in self._entries:
+                return self._hit(entry, "semantic")
+            self._counters["misses"] += 1
+        metrics.increment("mindguard_response_cache_lookups_total", result="miss")
+        return None
+
+    def put(self, key: CacheKey, response: str, latency: float = 0.0):
+        """
+        Cache a generated response.
+
+        Args:
+            key: Key the response was looked up with
+            response: Generated response text
+            latency: Seconds it took to generate the response
+        """
+        if key.vector is None:
+            self._embed(key)
+        with self._lock:
+            self._entries[key.exact] = _CacheEntry(key, response, latency, self._clock())
+            self._entries.move_to_end(key.exact)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        """Drop every cached response."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with size, hit/miss counters, hit rate and latency saved
+        """
+        with self._lock:
+            hits = self._counters["exact_hits"] + self._counters["semantic_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "similarity_threshold": self.similarity_threshold,
+                **self._counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "latency_saved_seconds": self._latency_saved
+            }
+
+    def _hit(self, entry: _CacheEntry, kind: str) -> str:
+        """Record a hit on entry. Caller holds the lock."""
+        self._entries.move_to_end(entry.key.exact)
+        self._counters[f"{kind}_hits"] += 1
+        self._latency_saved += entry.latency
+        metrics.increment("mindguard_response_cache_lookups_total", result=f"{kind}_hit")
+        metrics.increment("mindguard_response_cache_latency_saved_seconds_total", entry.latency)
+        return entry.response
+
+    def _expire(self, now: float):
+        """Drop entries older than the TTL. Caller holds the lock."""
+        if self.ttl_seconds is None:
+            return
+        expired = [k for k, entry in self._entries.items() if now - entry.created >= self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+        self._counters["expirations"] += len(expired)
+
+    def _embed(self, key: CacheKey):
+        if self.embeddings is None or not key.text:
+            return
+        try:
+            vector = np.asarray(self.embeddings.embed_query(key.text), dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding response cache key: {e}")
+            return
+        norm = np.linalg.norm(vector)
+        key.vector = vector / norm if norm else vector
+
+    def _most_similar(self, key: CacheKey, candidates: List[_CacheEntry]) -> Optional[_CacheEntry]:
+        if key.vector is None:
+            self._embed(key)
+        if key.vector is None:
+            return None
+        matrix = np.stack([entry.key.vector for entry in candidates])
+        scores = matrix @ key.vector
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= self.similarity_threshold else None
+
+
+def response_cache_enabled() -> bool:
+    """The response cache is opt-in through RESPONSE_CACHE_ENABLED."""
+    return os.environ.get("RESPONSE_CACHE_ENABLED") == "true"
+
+
+def create_response_cache(embeddings: Optional[Embeddings] = None) -> SemanticResponseCache:
+    """Create a cache configured from RESPONSE_CACHE_* environment variables."""
+    ttl = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    return SemanticResponseCache(
+        embeddings=embeddings,
+        max_size=int(os.environ.get("RESPONSE_CACHE_MAX_SIZE", "512")),
+        ttl_seconds=ttl if ttl > 0 else None,
+        similarity_threshold=float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.92"))
+    )
+
+
+metrics.describe("mindguard_response_cache_lookups_total", "Response cache lookups by result")
+metrics.describe("mindguard_response_cache_latency_saved_seconds_total", "Generation latency avoided by response cache hits")
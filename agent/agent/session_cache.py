@@ -0,0 +1,298 @@
+"""
+Bounded session cache for per-user chat instances.
+
+Keeps the most recently used sessions in memory, bounded both by count (LRU)
+and by idle time (TTL). Evicted sessions are handed to an eviction callback
+so their state can be flushed to disk before they are dropped; the next
+request for an evicted user simply builds a fresh session, which rehydrates
+from the persisted state.
+
+Requests hold a lease on their session for as long as they use it. Leased
+sessions are never evicted, and sessions for one key are built under a
+per-key lock, so a key never has two live sessions writing its state.
+The eviction callback can run on an executor so flushing never holds up a
+request; a new session for the key is not built until that flush is done.
+"""
+
+from typing import Dict, Any, Callable, Optional, Generic, TypeVar, List, Tuple
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+import threading
+import time
+
+T = TypeVar("T")
+
+
+class SessionCache(Generic[T]):
+    """
+    Size- and idle-time-bounded LRU cache of sessions keyed by user id.
+
+    Features:
+    - LRU eviction once max_size sessions are held
+    - Idle-time (TTL) expiry, swept on every access
+    - Eviction callback for flushing session state, optionally on an executor
+    - Leases that pin in-use sessions against eviction
+    - Per-key creation locks, so concurrent misses build one session
+    - Hit/miss/eviction/expiration counters
+    """
+
+    def __init__(self,
+                 max_size: int = 1000,
+                 ttl_seconds: Optional[float] = 3600,
+                 on_evict: Optional[Callable[[str, T], None]] = None,
+                 evict_executor: Optional[Executor] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the session cache.
+
+        Args:
+            max_size: Maximum number of sessions kept in memory
+            ttl_seconds: Idle time after which a session expires (None disables)
+            on_evict: Optional callback invoked with (key, session) on eviction
+            evict_executor: Executor to run on_evict on; None runs it on the evicting caller
+            clock: Monotonic time source, overridable for testing
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self.evict_executor = evict_executor
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (session, last access time), ordered from least to most recently used
+        self._sessions: "OrderedDict[str, Tuple[T, float]]" = OrderedDict()
+        # key -> number of outstanding leases
+        self._leases: Dict[str, int] = {}
+        # key -> [creation lock, number of callers using it]
+        self._creating: Dict[str, List[Any]] = {}
+        # key -> completion of the eviction callback for its last evicted session
+        self._disposing: Dict[str, Future] = {}
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def get_or_create(self, key: str, factory: Callable[[], T]) -> T:
+        """
+        Get the session for key, creating it with factory on a miss.
+
+        The session is not leased, so it may be evicted while the caller
+        still uses it; request handlers should use acquire() and release().
+
+        Args:
+            key: Session key (user id)
+            factory: Zero-argument callable that builds a new session
+
+        Returns:
+            The cached or newly created session
+        """
+        session = self.acquire(key, factory)
+        self.release(key)
+        return session
+
+    def acquire(self, key: str, factory: Callable[[], T]) -> T:
+        """
+        Lease the session for key, creating it with factory on a miss.
+
+        The session is not evicted until every lease on it is released.
+        Every call must be balanced by a call to release().
+
+        Args:
+            key: Session key (user id)
+            factory: Zero-argument callable that builds a new session
+
+        Returns:
+            The cached or newly created session
+        """
+        now = self._clock()
+        evicted: List[Tuple[str, T]] = []
+
+        with self._lock:
+            evicted.extend(self._expire_idle(now))
+            session = self._lease(key, now)
+            if session is None:
+                creating = self._creating.setdefault(key, [threading.Lock(), 0])
+                creating[1] += 1
+
+        if session is None:
+            try:
+                # Build outside the cache lock, since construction may be slow,
+                # but under the key's lock so concurrent misses build only once
+                with creating[0]:
+                    with self._lock:
+                        session = self._lease(key, self._clock())
+                        disposing = self._disposing.get(key)
+                    if session is None:
+                        if disposing is not None:
+                            # The evicted session may still be flushing state the new one loads
+                            disposing.result()
+                        session = factory()
+                        with self._lock:
+                            self._counters["misses"] += 1
+                            self._sessions[key] = (session, now)
+                            self._leases[key] = self._leases.get(key, 0) + 1
+                            evicted.extend(self._evict_overflow())
+            finally:
+                with self._lock:
+                    creating[1] -= 1
+                    if creating[1] == 0:
+                        del self._creating[key]
+
+        self._dispose(evicted)
+        return session
+
+    def release(self, key: str):
+        """
+        Release a lease taken with acquire().
+
+        Evictions deferred while the session was leased happen now.
+
+        Args:
+            key: Session key
+        """
+        with self._lock:
+            leases = self._leases.get(key, 0) - 1
+            if leases > 0:
+                self._leases[key] = leases
+                return
+            self._leases.pop(key, None)
+            cached = self._sessions.get(key)
+            if cached is not None:
+                # The request just finished, so the session was used now
+                self._sessions[key] = (cached[0], self._clock())
+                self._sessions.move_to_end(key)
+            evicted = self._evict_overflow()
+        self._dispose(evicted)
+
+    def pop(self, key: str) -> Optional[T]:
+        """
+        Remove a session without invoking the eviction callback.
+
+        Args:
+            key: Session key
+
+        Returns:
+            The removed session, or None if it was not cached
+        """
+        with self._lock:
+            cached = self._sessions.pop(key, None)
+        return cached[0] if cached is not None else None
+
+    def clear(self):
+        """
+        Evict every session, leased or not, invoking the eviction callback for each.
+
+        Callbacks run on the calling thread, and callbacks still running on the
+        evict executor are waited for, so all state is flushed on return.
+        """
+        with self._lock:
+            evicted = [self._evict(key) for key in list(self._sessions)]
+            self._leases.clear()
+            pending = list(self._disposing.values())
+        self._dispose(evicted, inline=True)
+        for future in pending:
+            future.result()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with size, limits and hit/miss/eviction counters
+        """
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "size": len(self._sessions),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "leased": len(self._leases),
+                **self._counters,
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0
+            }
+
+    def _lease(self, key: str, now: float) -> Optional[T]:
+        """Lease and touch the cached session for key, counting a hit, if any. Caller holds the lock."""
+        cached = self._sessions.get(key)
+        if cached is None:
+            return None
+        self._counters["hits"] += 1
+        self._sessions[key] = (cached[0], now)
+        self._sessions.move_to_end(key)
+        self._leases[key] = self._leases.get(key, 0) + 1
+        return cached[0]
+
+    def _expire_idle(self, now: float) -> List[Tuple[str, T]]:
+        """Pop unleased sessions idle for longer than the TTL. Caller holds the lock."""
+        expired = []
+        if self.ttl_seconds is None:
+            return expired
+
+        # Sessions are ordered by last access, so expired ones sit at the head
+        for key, (_, last_access) in list(self._sessions.items()):
+            if now - last_access < self.ttl_seconds:
+                break
+            if key in self._leases:
+                continue
+            self._counters["expirations"] += 1
+            expired.append(self._evict(key))
+        return expired
+
+    def _evict_overflow(self) -> List[Tuple[str, T]]:
+        """
+        Pop least recently used unleased sessions above max_size. Caller holds the lock.
+
+        Leased sessions may hold the cache above max_size until they are released.
+        """
+        evicted = []
+        overflow = len(self._sessions) - self.max_size
+        if overflow <= 0:
+            return evicted
+        for key in list(self._sessions):
+            if overflow <= 0:
+                break
+            if key in self._leases:
+                continue
+            self._counters["evictions"] += 1
+            evicted.append(self._evict(key))
+            overflow -= 1
+        return evicted
+
+    def _evict(self, key: str) -> Tuple[str, T]:
+        """Pop a session and mark its eviction callback pending. Caller holds the lock."""
+        session, _ = self._sessions.pop(key)
+        self._disposing[key] = Future()
+        return key, session
+
+    def _dispose(self, evicted: List[Tuple[str, T]], inline: bool = False):
+        """Run the eviction callbacks outside the lock, on the evict executor unless inline."""
+        for key, session in evicted:
+            if self.evict_executor is None or inline:
+                self._run_on_evict(key, session)
+            else:
+                self.evict_executor.submit(self._run_on_evict, key, session)
+
+    def _run_on_evict(self, key: str, session: T):
+        with self._lock:
+            done = self._disposing[key]
+        try:
+            if self.on_evict:
+                self.on_evict(key, session)
+        except Exception as e:
+            print(f"Error evicting session {key}: {e}")
+        finally:
+            with self._lock:
+                del self._disposing[key]
+            done.set_result(None)
@@ -0,0 +1,392 @@
+"""
+Shared approximate nearest-neighbour index over every user's conversation turns.
+
+One FAISS index holds the turn vectors of all users instead of one small
+index per user. Each vector's id packs the owner's slot and the turn
+number as (slot << 32) | turn, so a user's turns form one contiguous id
+range. Searches are scoped to a user with an id range selector, and hits
+map straight back to turn indexes.
+
+The index starts as an exact flat index. Once it holds SHARED_INDEX_TRAIN_MIN
+vectors it is retrained as an IVF index on a maintenance thread of its
+own, off the request executor. It is retrained
+again whenever it has grown fourfold or a quarter of its vectors have been
+removed, which also rebalances the inverted lists. Adds and removals made
+during a rebuild are replayed onto the new index before it is swapped in.
+Vectors of another dimension mean the embedding model changed: the index
+is reset, and each user's turns are re-embedded as they are next used.
+Snapshots are written in the background at most every
+SHARED_INDEX_SNAPSHOT_SECONDS, and on shutdown.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from agent.metrics import metrics, record_store_io
+
+# Bits of a vector id holding the turn number
+TURN_BITS = 32
+
+# IVF needs about this many training vectors per inverted list
+_TRAINING_PER_LIST = 39
+
+
+def _user_range(slot: int, count: int) -> Tuple[int, int]:
+    """Id range [start, stop) of a user's first count turns."""
+    start = slot << TURN_BITS
+    return start, start + count
+
+
+class SharedVectorIndex:
+    """Multi-tenant FAISS index of conversation turns, scoped per user at query time."""
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 train_min: int = 10000,
+                 nprobe: int = 16,
+                 snapshot_seconds: float = 300.0):
+        """
+        Load the snapshot at path, or start empty.
+
+        Args:
+            path: Snapshot directory; without one the index lives in memory only
+            train_min: Vectors needed before switching from exact search to IVF
+            nprobe: Inverted lists probed per IVF search
+            snapshot_seconds: Minimum time between background snapshots
+        """
+        self.path = path
+        self.train_min = train_min
+        self.nprobe = nprobe
+        self.snapshot_seconds = snapshot_seconds
+
+        self.index: Optional[faiss.Index] = None
+        self.dim: Optional[int] = None
+        self.slots: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self._trained_size = 0
+        self._removed = 0
+        # Bumped on reset, so a rebuild of the old vectors is not swapped in
+        self._generation = 0
+        self._lock = threading.RLock()
+        # One snapshot at a time, so the background and shutdown snapshots cannot interleave
+        self._snapshot_lock = threading.Lock()
+
+        # Changes made while a rebuild runs, replayed onto the new index
+        self._replay: Optional[List[Tuple[str, tuple]]] = None
+        self._unsaved = 0
+        self._last_snapshot = time.monotonic()
+        
+        # Rebuilds and snapshots run on one thread, started with the first change
+        self._maintenance: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+        if path:
+            self._load()
+
+    def indexed_turns(self, user_id: str) -> int:
+        """Number of the user's turns held, always turns 0..n-1."""
+        with self._lock:
+            return self.counts.get(user_id, 0)
+
+    def add(self, user_id: str, start: int, vectors: Sequence[Sequence[float]]) -> bool:
+        """
+        Append the vectors of a user's turns start, start + 1, ...
+
+        Args:
+            user_id: Owner of the turns
+            start: Turn number of the first vector
+            vectors: One embedding per turn
+
+        Returns:
+            False if the user's turns before start are not all indexed, or
+            these turns already are; nothing is added then
+        """
+        data = np.asarray(vectors, dtype="float32")
+        if not len(data):
+            return True
+        with self._lock:
+            if self.index is None:
+                self.dim = data.shape[1]
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+            if data.shape[1] != self.dim:
+                self._reset(data.shape[1])
+            if self.counts.get(user_id, 0) != start:
+                return False
+            slot = self.slots.setdefault(user_id, len(self.slots))
+            first = _user_range(slot, start)[1]
+            ids = np.arange(first, first + len(data), dtype="int64")
+            self.index.add_with_ids(data, ids)
+            if self._replay is not None:
+                self._replay.append(("add", (data, ids)))
+            self.counts[user_id] = start + len(data)
+            self._unsaved += len(data)
+            self._schedule_background()
+        return True
+
+    def search(self, user_id: str, vector: Sequence[float], k: int) -> List[int]:
+        """
+        Find a user's turns nearest to a query vector.
+
+        Args:
+            user_id: User whose turns are searched
+            vector: Query embedding
+            k: Number of results
+
+        Returns:
+            Turn indexes, nearest first; empty if the index was just reset
+            for a query of another dimension
+        """
+        query = np.asarray([vector], dtype="float32")
+        with self._lock:
+            count = self.counts.get(user_id, 0)
+            if not count or k <= 0:
+                return []
+            if query.shape[1] != self.dim:
+                self._reset(query.shape[1])
+                return []
+            k = min(k, count)
+            selector = faiss.IDSelectorRange(*_user_range(self.slots[user_id], count))
+            if isinstance(self.index, faiss.IndexIVF):
+                nprobe = min(self.nprobe, self.index.nlist)
+                _, ids = self.index.search(query, k, params=faiss.SearchParametersIVF(sel=selector, nprobe=nprobe))
+                if (ids[0] < 0).any() and nprobe < self.index.nlist:
+                    # The user's turns sit in few lists; probe more of them once
+                    nprobe = min(nprobe * 8, self.index.nlist)
+                    _, ids = self.index.search(query, k, params=faiss.SearchParametersIVF(sel=selector, nprobe=nprobe))
+            else:
+                _, ids = self.index.search(query, k, params=faiss.SearchParameters(sel=selector))
+        mask = (1 << TURN_BITS) - 1
+        return [int(i) & mask for i in ids[0] if i >= 0]
+
+    def remove_user(self, user_id: str):
+        """Drop every vector of a user, e.g. before re-embedding their turns."""
+        with self._lock:
+            count = self.counts.pop(user_id, 0)
+            if not count:
+                return
+            bounds = _user_range(self.slots[user_id], count)
+            self.index.remove_ids(faiss.IDSelectorRange(*bounds))
+            if self._replay is not None:
+                self._replay.append(("remove", bounds))
+            self._removed += count
+            self._unsaved += count
+            self._schedule_background()
+
+    def _reset(self, dim: int):
+        """Drop every vector for an embedding model of another dimension. Caller holds the lock."""
+        print(f"Embedding dimension changed from {self.dim} to {dim}, resetting the shared vector index")
+        self.dim = dim
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        self.counts = {}
+        self._trained_size = 0
+        self._removed = 0
+        self._generation += 1
+        self._unsaved += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.index.ntotal if self.index is not None else 0
+
+    def _needs_rebuild(self) -> bool:
+        """Whether the index should be (re)trained. Caller holds the lock."""
+        total = self.index.ntotal
+        if not self._trained_size:
+            return total >= self.train_min
+        return total >= 4 * self._trained_size or self._removed * 4 >= max(total, 1)
+
+    def _snapshot_due(self) -> bool:
+        """Whether a background snapshot should be written. Caller holds the lock."""
+        return bool(self.path) and self._unsaved > 0 and time.monotonic() - self._last_snapshot >= self.snapshot_seconds
+
+    def _schedule_background(self):
+        """Wake the maintenance thread, starting it on first use. Caller holds the lock."""
+        if self._maintenance is None:
+            self._maintenance = threading.Thread(target=self._maintain, name="shared-index-maintenance", daemon=True)
+            self._maintenance.start()
+        if self._needs_rebuild() or self._snapshot_due():
+            self._wake.set()
+
+    def _maintain(self):
+        """Maintenance thread: rebuild and snapshot when due, checking at least every snapshot interval."""
+        while True:
+            self._wake.wait(timeout=max(self.snapshot_seconds, 1.0))
+            self._wake.clear()
+            with self._lock:
+                rebuild = self.index is not None and self._needs_rebuild()
+            if rebuild:
+                self._rebuild()
+            with self._lock:
+                due = self._snapshot_due()
+            if due:
+                self.snapshot()
+
+    def _rebuild(self):
+        """Train a fresh IVF index on the current vectors, then swap it in."""
+        try:
+            with metrics.timer("mindguard_shared_index_rebuild_seconds"):
+                with self._lock:
+                    ids, vectors = self._extract()
+                    self._replay = []
+                    removed = self._removed
+                    generation = self._generation
+                    dim = self.dim
+
+                nlist = max(1, min(int(4 * math.sqrt(len(ids))), len(ids) // _TRAINING_PER_LIST))
+                index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+                sample = min(len(ids), nlist * 256)
+                rng = np.random.default_rng()
+                index.train(vectors[rng.choice(len(ids), sample, replace=False)] if sample < len(ids) else vectors)
+                index.add_with_ids(vectors, ids)
+
+                with self._lock:
+                    if self._generation != generation:
+                        return
+                    for op, args in self._replay:
+                        if op == "add":
+                            index.add_with_ids(*args)
+                        else:
+                            index.remove_ids(faiss.IDSelectorRange(*args))
+                    self.index = index
+                    self._trained_size = len(ids)
+                    self._removed -= removed
+                    self._unsaved += 1
+        except Exception as e:
+            print(f"Error rebuilding shared vector index: {e}")
+        finally:
+            with self._lock:
+                self._replay = None
+
+    def _extract(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copy out every (id, vector) held. Caller holds the lock."""
+        if not isinstance(self.index, faiss.IndexIVF):
+            ids = faiss.vector_to_array(self.index.id_map).astype("int64")
+            return ids, self.index.index.reconstruct_n(0, self.index.ntotal)
+
+        lists = self.index.invlists
+        id_parts, vector_parts = [], []
+        for number in range(self.index.nlist):
+            size = lists.list_size(number)
+            if not size:
+                continue
+            id_parts.append(faiss.rev_swig_ptr(lists.get_ids(number), size).copy())
+            codes = faiss.rev_swig_ptr(lists.get_codes(number), size * lists.code_size).copy()
+            vector_parts.append(codes.view("float32").reshape(size, self.dim))
+        if not id_parts:
+            return np.empty(0, dtype="int64"), np.empty((0, self.dim), dtype="float32")
+        return np.concatenate(id_parts), np.concatenate(vector_parts)
+
+    def snapshot(self):
+        """
+        Write the index and its user table if anything changed.
+
+        Both go into one file, staged under a name of its own and renamed
+        into place, so a reader never sees an index from one snapshot with
+        the user table of another.
+        """
+        with self._snapshot_lock:
+            with self._lock:
+                if not self.path or self.index is None or not self._unsaved:
+                    return
+                # A copy is fast; serializing it happens outside the lock
+                index = faiss.clone_index(self.index)
+                meta = {
+                    "dim": self.dim,
+                    "slots": dict(self.slots),
+                    "counts": dict(self.counts),
+                    "trained_size": self._trained_size,
+                    "removed": self._removed
+                }
+                unsaved = self._unsaved
+                self._unsaved = 0
+                self._last_snapshot = time.monotonic()
+
+            staging = None
+            try:
+                data = faiss.serialize_index(index)
+                del index
+                os.makedirs(self.path, exist_ok=True)
+                handle, staging = tempfile.mkstemp(prefix="snapshot.", suffix=".tmp", dir=self.path)
+                with os.fdopen(handle, "wb") as f:
+                    np.savez(f, index=data, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8))
+                os.replace(staging, os.path.join(self.path, "snapshot.npz"))
+                record_store_io("shared_vector_index", "write")
+            except Exception as e:
+                print(f"Error saving shared vector index: {e}")
+                if staging and os.path.exists(staging):
+                    os.remove(staging)
+                with self._lock:
+                    self._unsaved += unsaved
+
+    def _load(self):
+        """Load the snapshot, or start empty if it is missing or inconsistent."""
+        path = os.path.join(self.path, "snapshot.npz")
+        if not os.path.exists(path):
+            return
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                index = faiss.deserialize_index(saved["index"])
+                meta = json.loads(saved["meta"].tobytes().decode("utf-8"))
+            record_store_io("shared_vector_index", "read")
+        except Exception as e:
+            print(f"Error loading shared vector index, starting empty: {e}")
+            return
+        if index.ntotal != sum(meta["counts"].values()) or index.d != meta["dim"]:
+            # Users' turns are re-embedded as they are next searched
+            print("Shared vector index does not match its user table, starting empty")
+            return
+        self.index = index
+        self.dim = meta["dim"]
+        self.slots = meta["slots"]
+        self.counts = meta["counts"]
+        self._trained_size = meta["trained_size"]
+        self._removed = meta["removed"]
+
+
+_shared_lock = threading.Lock()
+_shared: Optional[SharedVectorIndex] = None
+
+
+def get_shared_index() -> Optional[SharedVectorIndex]:
+    """
+    Get the process-wide shared index.
+
+    Returns:
+        The index, or None unless SHARED_VECTOR_INDEX is "true"
+    """
+    global _shared
+    if os.environ.get("SHARED_VECTOR_INDEX", "false") != "true":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedVectorIndex(
+                path=os.environ.get("SHARED_VECTOR_INDEX_DIR", "./user_data/shared_index"),
+                train_min=int(os.environ.get("SHARED_INDEX_TRAIN_MIN", "10000")),
+                nprobe=int(os.environ.get("SHARED_INDEX_NPROBE", "16")),
+                snapshot_seconds=float(os.environ.get("SHARED_INDEX_SNAPSHOT_SECONDS", "300"))
+            )
+        return _shared
+
+
+def _collect_metrics():
+    """Export the size of the shared index."""
+    with _shared_lock:
+        shared = _shared
+    if shared is not None:
+        with shared._lock:
+            users = sum(1 for count in shared.counts.values() if count)
+        yield "mindguard_shared_index_vectors", "gauge", {}, len(shared)
+        yield "mindguard_shared_index_users", "gauge", {}, users
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("mindguard_shared_index_vectors", "Conversation turn vectors in the shared index")
+metrics.describe("mindguard_shared_index_users", "Users with turns in the shared index")
+metrics.describe("mindguard_shared_index_rebuild_seconds", "Time to retrain and rebuild the shared index in the background")
@@ -0,0 +1,323 @@
+"""
+Single-flight coalescing of identical in-flight provider calls.
+
+When a client retries or the frontend double-submits, the same prompt can
+reach a provider twice while the first call is still running. A
+SingleFlight group lets the first caller (the leader) make the upstream
+call while identical concurrent callers wait for and share its result, or
+its exception. Nothing is cached: once the call finishes the key is
+forgotten, so the next identical request goes upstream again.
+
+SingleFlightChatModel and SingleFlightEmbeddings wrap the clients built by
+LLMFactory. Chat calls are keyed on (provider, model, temperature, full
+message payload, call arguments) and embedding calls on (provider, model,
+texts). Streaming calls are passed through uncoalesced.
+"""
+
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Iterator, AsyncIterator, Hashable, TypeVar
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from agent.metrics import metrics
+
+T = TypeVar("T")
+
+
+class _Call:
+    """A synchronous in-flight call shared by its leader and followers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncCall:
+    """An asynchronous in-flight call and the number of callers awaiting it."""
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Group of in-flight calls keyed by request identity.
+
+    Synchronous and asynchronous calls are tracked separately; async calls
+    are only shared between callers on the same event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, _AsyncCall] = {}
+        self._leaders = 0
+        self._duplicates = 0
+
+    def do(self, key: Hashable, func: Callable[[], T], **labels: Any) -> T:
+        """
+        Run func, or wait for an identical call that is already running.
+
+        Args:
+            key: Identity of the request
+            func: Callable making the upstream call
+            **labels: Metric labels (e.g. operation, provider)
+
+        Returns:
+            The result of the shared call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(leader, labels)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[T]], **labels: Any) -> T:
+        """
+        Await func, or an identical call already running on this event loop.
+
+        The upstream call runs as its own task, so a cancelled caller does
+        not cancel it for the others; it is cancelled only once every caller
+        has gone.
+
+        Args:
+            key: Identity of the request
+            func: Coroutine function making the upstream call
+            **labels: Metric labels (e.g. operation, provider)
+
+        Returns:
+            The result of the shared call
+        """
+        flight_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            call = self._async_calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._async_calls[flight_key] = _AsyncCall(asyncio.ensure_future(func()))
+                call.task.add_done_callback(lambda _: self._forget(flight_key, call))
+            call.waiters += 1
+            self._count(leader, labels)
+
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get coalescing statistics.
+
+        Returns:
+            Dictionary with upstream calls made, duplicates avoided and calls in flight
+        """
+        with self._lock:
+            return {
+                "upstream_calls": self._leaders,
+                "duplicates_avoided": self._duplicates,
+                "in_flight": len(self._calls) + len(self._async_calls)
+            }
+
+    def _count(self, leader: bool, labels: Dict[str, Any]):
+        """Count a call. Caller holds the lock."""
+        if leader:
+            self._leaders += 1
+        else:
+            self._duplicates += 1
+            metrics.increment("mindguard_single_flight_duplicates_total", **labels)
+
+    def _forget(self, flight_key: Hashable, call: _AsyncCall):
+        with self._lock:
+            if self._async_calls.get(flight_key) is call:
+                del self._async_calls[flight_key]
+
+
+# Process-wide group shared by every wrapped client
+_group = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide single-flight group."""
+    return _group
+
+
+def single_flight_enabled() -> bool:
+    """Coalescing is on unless SINGLE_FLIGHT_ENABLED is set to something other than "true"."""
+    return os.environ.get("SINGLE_FLIGHT_ENABLED", "true") == "true"
+
+
+def _digest(payload: Any) -> str:
+    """Stable digest of a JSON-like payload."""
+    data = json.dumps(payload, sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def message_payload_key(messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+    """
+    Digest of everything sent upstream for a chat call.
+
+    Message ids are excluded: they identify a message object, not its content.
+    """
+    payload = [
+        [message.type, message.content, getattr(message, "name", None), message.additional_kwargs]
+        for message in messages
+    ]
+    return _digest({"messages": payload, "stop": stop, "kwargs": kwargs})
+
+
+class SingleFlightChatModel(BaseChatModel):
+    """Chat model wrapper that coalesces identical concurrent generate calls."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    llm: BaseChatModel
+    provider: str
+    model: str = "default"
+    temperature: Optional[float] = None
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> tuple:
+        return ("chat", self.provider, self.model, self.temperature, message_payload_key(messages, stop, kwargs))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        result = _group.do(
+            self._key(messages, stop, kwargs),
+            lambda: self.llm._generate(messages, stop=stop, **kwargs),
+            operation="chat",
+            provider=self.provider
+        )
+        # Followers get their own copy so no caller can mutate another's messages
+        return result.model_copy(deep=True)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> ChatResult:
+        result = await _group.ado(
+            self._key(messages, stop, kwargs),
+            lambda: self.llm._agenerate(messages, stop=stop, **kwargs),
+            operation="chat",
+            provider=self.provider
+        )
+        return result.model_copy(deep=True)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        for chunk in self.llm._stream(messages, stop=stop, **kwargs):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.llm._astream(messages, stop=stop, **kwargs):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    @property
+    def _llm_type(self) -> str:
+        return f"single_flight_{self.llm._llm_type}"
+
+
+class SingleFlightEmbeddings(Embeddings):
+    """Embeddings wrapper that coalesces identical concurrent embedding calls."""
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str = "default"):
+        """
+        Wrap an embeddings client.
+
+        Args:
+            embeddings: The embeddings client
+            provider: Provider name, part of the request key and metric label
+            model: Embedding model name, part of the request key
+        """
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+
+    def _key(self, operation: str, texts: Any) -> tuple:
+        return (operation, self.provider, self.model, _digest(texts))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _group.do(
+            self._key("embed_documents", texts),
+            lambda: self.embeddings.embed_documents(texts),
+            operation="embed_documents",
+            provider=self.provider
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return _group.do(
+            self._key("embed_query", text),
+            lambda: self.embeddings.embed_query(text),
+            operation="embed_query",
+            provider=self.provider
+        )
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await _group.ado(
+            self._key("embed_documents", texts),
+            lambda: self.embeddings.aembed_documents(texts),
+            operation="embed_documents",
+            provider=self.provider
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await _group.ado(
+            self._key("embed_query", text),
+            lambda: self.embeddings.aembed_query(text),
+            operation="embed_query",
+            provider=self.provider
+        )
+
+
+metrics.describe("mindguard_single_flight_duplicates_total", "Duplicate in-flight provider calls served by an identical running call")
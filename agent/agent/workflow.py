@@ -1,22 +1,36 @@
-from typing import TypedDict, List, Optional, Dict, Any
+from typing import TypedDict, List, Optional, Dict, Any, Callable, Hashable, AsyncIterator, Annotated
+import operator
+import os
+import time
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langgraph.graph import StateGraph, END
-from transformers import pipeline  # For emotional analysis
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
 
-from agent.memory import MemoryManager
-from agent.llm_factory import LLMFactory
-from agent.emotion_analysis import EmotionAnalyzer
+from agent.memory import MemoryManager, estimate_tokens
+from agent.llm_factory import SimpleFallbackLLM
 from agent.mood_tracking import MoodTracker
-from agent.therapeutic_modalities import TherapeuticModalities
 from agent.engagement.gamification import GamificationSystem
+from agent import model_registry
+from agent.concurrency import run_blocking, run_io
+from agent.provider_pool import PooledChatModel
+from agent.rate_limiter import HIGH, NORMAL, astream_in_lane, priority_lane
+from agent.response_cache import CacheKey, context_hash, response_cache_enabled
+from agent.metrics import metrics, record_fallback
+
+# Recent turns checked for an escalation when choosing the rate limit lane
+CRISIS_LOOKBACK_TURNS = 5
 
 
 class AgentState(TypedDict):
     user_input: str
+    # The user's message without prompt instructions appended by the caller
+    user_message: Optional[str]
     history: List[Dict[str, Any]]
     response: str
-    needs_escalation: bool
+    # Several nodes raise the escalation flag concurrently; any one of them wins
+    needs_escalation: Annotated[bool, operator.or_]
     emotional_state: Dict[str, Any]
+    similar_conversations: Optional[List[Dict[str, Any]]]
     therapeutic_recommendations: Optional[Dict[str, Any]]
     mood_insights: Optional[Dict[str, Any]]
     gamification_update: Optional[Dict[str, Any]]
@@ -33,41 +47,108 @@ class MentalHealthAgent:
         """
         self.provider = provider
         self.user_id = user_id
-        self.llm = LLMFactory.create_llm(provider=provider, temperature=0.5)
-        self.memory = MemoryManager(provider=provider)
-        
-        # Initialize enhanced components
-        self.emotion_analyzer = EmotionAnalyzer(
-            offline_mode=False,  # Try online first, fallback to offline
-            cache_dir="./cached_models"
-        )
-        
-        self.mood_tracker = MoodTracker(user_id=user_id)
-        self.therapeutic_modalities = TherapeuticModalities()
-        self.gamification = GamificationSystem(user_id=user_id)
+        self._registry_keys: List[Hashable] = []
+
+        try:
+            # Stateless components are shared process-wide through the registry
+            self.llm = self._create_llm(provider)
+            # Batches emotion classification across concurrent requests
+            self.emotion_analyzer = self._acquire(*model_registry.emotion_scheduler_spec())
+            self.therapeutic_modalities = self._acquire(*model_registry.therapeutic_modalities_spec())
+            # Opt-in cache of responses to near-identical prompts
+            self.response_cache = (
+                self._acquire(*model_registry.response_cache_spec(provider))
+                if response_cache_enabled() else None
+            )
+            try:
+                embeddings = self._acquire(*model_registry.embeddings_spec(provider))
+            except Exception as e:
+                print(f"Warning: Could not initialize shared embeddings: {e}")
+                embeddings = None
+
+            # Per-user state
+            self.memory = MemoryManager(
+                provider=provider,
+                embeddings=embeddings,
+                user_id=user_id,
+                # The offline LLM cannot summarize; memory then condenses turns itself
+                summarizer=None if isinstance(self.llm, SimpleFallbackLLM) else self.llm
+            )
+            self.mood_tracker = MoodTracker(user_id=user_id)
+            self.gamification = GamificationSystem(user_id=user_id)
+        except Exception:
+            self.close()
+            raise
         
         self.workflow = self._build_enhanced_workflow()
+        self.assessment_workflow = self._build_assessment_workflow()
+
+    def _create_llm(self, provider: Optional[str]):
+        """
+        Create the chat model for this agent.
+
+        With a named provider, calls go through the shared provider pool so a
+        failing provider is skipped in favour of the next healthy one.
+        """
+        if provider and os.environ.get("OFFLINE_MODE") != "true":
+            pool = self._acquire(*model_registry.provider_pool_spec(temperature=0.5))
+            if provider in pool.providers:
+                return PooledChatModel(pool=pool, primary=provider)
+        return self._acquire(*model_registry.llm_spec(provider, temperature=0.5))
+
+    def switch_provider(self, provider: str):
+        """
+        Make a different provider the primary for this agent's LLM calls.
+
+        Only the chat client changes; memory, trackers and the compiled
+        workflows are kept.
+
+        Args:
+            provider: Provider to prefer ('openai', 'groq' or 'gemini')
+        """
+        if isinstance(self.llm, PooledChatModel) and provider in self.llm.pool.providers:
+            self.llm = PooledChatModel(pool=self.llm.pool, primary=provider)
+        else:
+            self.llm = self._acquire(*model_registry.llm_spec(provider, temperature=0.5))
+        self.provider = provider
+
+    def _acquire(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Acquire a shared component and remember its key for close()."""
+        component = model_registry.registry.acquire(key, factory)
+        self._registry_keys.append(key)
+        return component
+
+    def flush(self):
+        """Persist per-user memory, mood and gamification state."""
+        self.memory.flush()
+        self.mood_tracker.flush()
+        self.gamification.flush()
+
+    def close(self):
+        """Release this agent's references to shared components and unload those left idle."""
+        while self._registry_keys:
+            model_registry.registry.release(self._registry_keys.pop())
+        model_registry.registry.unload_unused()
 
     def _build_enhanced_workflow(self):
         workflow = StateGraph(AgentState)
+        last_assessment_node = self._add_assessment_nodes(workflow)
 
-        # Enhanced node sequence
-        workflow.add_node("safety_check", self.safety_check)
-        workflow.add_node("emotional_assessment", self.emotional_assessment)
-        workflow.add_node("mood_tracking", self.track_mood)
-        workflow.add_node("therapy_recommendations", self.generate_recommendations)
-        workflow.add_node("clinical_response", self.generate_clinical_response)
-        workflow.add_node("update_gamification_node", self.update_gamification)
-        workflow.add_node("escalate", self.escalate_with_resources)
-
-        # Define the enhanced workflow path
-        workflow.set_entry_point("safety_check")
-        workflow.add_edge("safety_check", "emotional_assessment")
-        workflow.add_edge("emotional_assessment", "mood_tracking")
-        workflow.add_edge("mood_tracking", "therapy_recommendations")
+        # Response nodes
+        workflow.add_node("clinical_response", self._node(
+            "clinical_response",
+            self.generate_clinical_response,
+            afunc=self.agenerate_clinical_response
+        ))
+        workflow.add_node("update_gamification_node", self._node(
+            "update_gamification_node",
+            self.update_gamification,
+            offload=True
+        ))
+        workflow.add_node("escalate", self._node("escalate", self.escalate_with_resources, offload=True))
         
         workflow.add_conditional_edges(
-            "therapy_recommendations",
+            last_assessment_node,
             self.determine_intervention_path,
             {"continue": "clinical_response", "escalate": "escalate"}
         )
@@ -78,6 +159,99 @@ class MentalHealthAgent:
 
         return workflow.compile()
 
+    def _build_assessment_workflow(self):
+        """Build the workflow that stops before response generation, used for streaming"""
+        workflow = StateGraph(AgentState)
+        last_assessment_node = self._add_assessment_nodes(workflow)
+        workflow.add_edge(last_assessment_node, END)
+        return workflow.compile()
+
+    def _add_assessment_nodes(self, workflow: StateGraph) -> str:
+        """
+        Add the nodes that assess the user's state before a response is generated.
+
+        Independent nodes fan out and run concurrently, so latency follows the
+        critical path rather than the sum of all nodes:
+
+            safety_check ──────────────────────────────┐
+            emotional_assessment ─┬─ mood_tracking ────┼─ assessment_complete
+                                  └─ therapy_recs ─────┤
+            retrieve_context ──────────────────────────┘
+
+        Each node has a sync implementation for workflow.invoke() and an async
+        one for workflow.ainvoke(); blocking nodes are offloaded to the shared
+        executor on the async path.
+
+        Args:
+            workflow: Graph to add the nodes to
+
+        Returns:
+            Name of the join node that completes the assessment
+        """
+        workflow.add_node("safety_check", self._node("safety_check", self.safety_check))
+        workflow.add_node("emotional_assessment", self._node(
+            "emotional_assessment",
+            self.emotional_assessment,
+            afunc=self.aemotional_assessment
+        ))
+        workflow.add_node("retrieve_context", self._node(
+            "retrieve_context", self.retrieve_context, offload=True, io=True
+        ))
+        workflow.add_node("mood_tracking", self._node("mood_tracking", self.track_mood, offload=True))
+        workflow.add_node("therapy_recommendations", self._node(
+            "therapy_recommendations",
+            self.generate_recommendations
+        ))
+        workflow.add_node("assessment_complete", self._node("assessment_complete", self.complete_assessment))
+
+        # Fan out: these only depend on the user's input
+        workflow.add_edge(START, "safety_check")
+        workflow.add_edge(START, "emotional_assessment")
+        workflow.add_edge(START, "retrieve_context")
+
+        # These only depend on the detected emotion
+        workflow.add_edge("emotional_assessment", "mood_tracking")
+        workflow.add_edge("emotional_assessment", "therapy_recommendations")
+
+        # Join before deciding how to respond
+        workflow.add_edge(
+            ["safety_check", "retrieve_context", "mood_tracking", "therapy_recommendations"],
+            "assessment_complete"
+        )
+
+        return "assessment_complete"
+
+    @staticmethod
+    def _node(name: str, func: Callable, afunc: Optional[Callable] = None, offload: bool = False,
+              io: bool = False) -> RunnableLambda:
+        """
+        Wrap a node function so the graph supports both invoke and ainvoke.
+
+        Both paths are timed into the per-node latency metric.
+
+        Args:
+            name: Node name, used as the metric label
+            func: Synchronous node implementation
+            afunc: Optional native async implementation
+            offload: Run func on the shared executor when invoked asynchronously
+            io: With offload, func mostly waits on the network; run it on the I/O executor
+
+        Returns:
+            A runnable usable as a StateGraph node
+        """
+        if afunc is None:
+            if offload:
+                run = run_io if io else run_blocking
+
+                async def afunc(state):
+                    return await run(func, state)
+            else:
+                async def afunc(state):
+                    return func(state)
+
+        timed = metrics.timed("mindguard_node_latency_seconds", node=name)
+        return RunnableLambda(timed(func), afunc=timed(afunc), name=name)
+
     def safety_check(self, state: AgentState):
         """Enhanced safety check with PII filtering and crisis keyword check"""
         text = state["user_input"].lower()
@@ -91,36 +265,68 @@ class MentalHealthAgent:
             "user_input": text
         }
 
+    def retrieve_context(self, state: AgentState):
+        """Retrieve related previous conversations for the response context"""
+        try:
+            return {
+                "similar_conversations": self.memory.find_similar_conversations(state["user_input"], k=1)
+            }
+        except Exception as e:
+            print(f"Error retrieving similar conversations: {e}")
+            record_fallback("context_retrieval", e)
+            return {"similar_conversations": []}
+
+    def complete_assessment(self, state: AgentState):
+        """Join point for the concurrent assessment nodes"""
+        return {}
+
     def emotional_assessment(self, state: AgentState):
         """Enhanced emotional state analysis with robust fallback"""
         try:
             # Use the enhanced emotion analyzer
             result = self.emotion_analyzer.analyze(state["user_input"])
-            
-            # Determine if this is a crisis state based on emotional content
-            crisis_emotions = ["hopelessness", "crisis"]
-            is_crisis = (
-                result["emotion"] in crisis_emotions and result["confidence"] > 0.7 or
-                result["is_crisis"] or 
-                state.get("needs_escalation", False)
-            )
-            
-            return {
-                "emotional_state": result,
-                "needs_escalation": is_crisis
-            }
+            return self._assess_emotion(state, result)
         except Exception as e:
             print(f"Error in emotional assessment: {e}")
-            return {
-                "emotional_state": {
-                    "emotion": "unknown",
-                    "confidence": 0.5,
-                    "valence": 0.0,
-                    "is_crisis": False,
-                    "intensity": 0.1
-                },
-                "needs_escalation": state.get("needs_escalation", False)
-            }
+            record_fallback("emotional_assessment", e)
+            return self._unknown_emotion(state)
+
+    async def aemotional_assessment(self, state: AgentState):
+        """Async emotional assessment; waits on the batch scheduler without holding a worker thread"""
+        try:
+            result = await self.emotion_analyzer.aanalyze(state["user_input"])
+            return self._assess_emotion(state, result)
+        except Exception as e:
+            print(f"Error in emotional assessment: {e}")
+            record_fallback("emotional_assessment", e)
+            return self._unknown_emotion(state)
+
+    def _assess_emotion(self, state: AgentState, result: Dict[str, Any]):
+        # Determine if this is a crisis state based on emotional content.
+        # Runs concurrently with safety_check; the state reducer ORs both flags.
+        crisis_emotions = ["hopelessness", "crisis"]
+        is_crisis = (
+            result["emotion"] in crisis_emotions and result["confidence"] > 0.7 or
+            result["is_crisis"] or 
+            state.get("needs_escalation", False)
+        )
+        
+        return {
+            "emotional_state": result,
+            "needs_escalation": is_crisis
+        }
+
+    def _unknown_emotion(self, state: AgentState):
+        return {
+            "emotional_state": {
+                "emotion": "unknown",
+                "confidence": 0.5,
+                "valence": 0.0,
+                "is_crisis": False,
+                "intensity": 0.1
+            },
+            "needs_escalation": state.get("needs_escalation", False)
+        }
     
     def track_mood(self, state: AgentState):
         """Track mood over time and generate insights"""
@@ -160,8 +366,8 @@ class MentalHealthAgent:
             "needs_escalation": state.get("needs_escalation", False)
         }
 
-    def generate_clinical_response(self, state: AgentState):
-        """Enhanced therapeutic response generation with emotion-aware prompting"""
+    def _prepare_clinical_response(self, state: AgentState):
+        """Build the response chain and its inputs (blocking: runs the similarity search)"""
         emotional_state = state["emotional_state"]["emotion"]
         mood_insights = state.get("mood_insights", {})
         therapeutic_recommendations = state.get("therapeutic_recommendations", {})
@@ -201,77 +407,259 @@ class MentalHealthAgent:
         ])
 
         chain = prompt | self.llm
-        
+        inputs = {
+            "user_input": state["user_input"],
+            "emotional_state": emotional_state,
+            "context": context,
+            "therapeutic_recommendations": self._format_recommendations(therapeutic_recommendations),
+            "mood_insights": self._format_insights(mood_insights),
+            "conversation_history": self.memory.get_history()
+        }
+        metrics.observe(
+            "mindguard_prompt_tokens",
+            estimate_tokens(prompt.format_messages(**inputs)),
+            memory_mode=self.memory.memory_mode
+        )
+        return chain, inputs
+
+    def _provider_timer(self, operation: str):
+        """Time an LLM provider call into the per-provider latency metric"""
+        return metrics.timer(
+            "mindguard_provider_latency_seconds",
+            provider=self.provider or "auto",
+            operation=operation
+        )
+
+    def _save_clinical_response(self, state: AgentState, response_text: str):
+        """Store interaction with emotional metadata"""
+        therapeutic_recommendations = state.get("therapeutic_recommendations", {})
+        # Store what the user said, without the caller's prompt instructions
+        self.memory.save_conversation(
+            state.get("user_message") or state["user_input"],
+            response_text,
+            metadata={
+                "emotion": state["emotional_state"]["emotion"],
+                "valence": state["emotional_state"]["valence"],
+                "recommendations": therapeutic_recommendations.get("primary_recommendation", {}).get("title", "")
+            }
+        )
+
+    def _response_cache_key(self, state: AgentState) -> Optional[CacheKey]:
+        """
+        Build the response cache key for a request, or None when the cache
+        must be bypassed (disabled, escalation, crisis, or a prompt that
+        carries the user's own conversation).
+
+        The cache is shared by every user, so only prompts without history
+        or retrieved conversations are cached, keyed on the rendered context
+        and recommendations that go into the prompt. This is deliberate: a
+        response written from one user's conversation must never be served
+        to another, so in practice only a user's opening turn (before any
+        history exists) can hit the cache.
+        """
+        if self.response_cache is None:
+            return None
+        emotional_state = state["emotional_state"]
+        if state.get("needs_escalation") or emotional_state.get("is_crisis"):
+            return None
+        # None means retrieval has not run, so the prompt would fetch it itself
+        similar_conversations = state.get("similar_conversations")
+        if similar_conversations is None or similar_conversations or self.memory.get_history():
+            return None
+
+        context = context_hash(
+            self._build_response_context(state),
+            self._format_recommendations(state.get("therapeutic_recommendations") or {})
+        )
+        text = state.get("user_message") or state["user_input"]
+        return self.response_cache.key(text, emotional_state["emotion"], context)
+
+    def _priority_lane(self, state: AgentState) -> str:
+        """
+        Rate limit lane of a request: high for escalated or crisis-adjacent
+        conversations (strongly negative, intense emotion or an escalation in
+        the recent turns), normal otherwise.
+        """
+        emotional_state = state.get("emotional_state") or {}
+        if state.get("needs_escalation") or emotional_state.get("is_crisis"):
+            return HIGH
+        if emotional_state.get("valence", 0.0) <= -0.5 and emotional_state.get("intensity", 0.0) >= 0.7:
+            return HIGH
+        recent = self.memory.conversations[-CRISIS_LOOKBACK_TURNS:]
+        if any(turn.get("metadata", {}).get("escalation") for turn in recent):
+            return HIGH
+        return NORMAL
+
+    def generate_clinical_response(self, state: AgentState):
+        """Enhanced therapeutic response generation with emotion-aware prompting"""
         try:
-            response = chain.invoke({
-                "user_input": state["user_input"],
-                "emotional_state": emotional_state,
-                "context": context,
-                "therapeutic_recommendations": self._format_recommendations(therapeutic_recommendations),
-                "mood_insights": self._format_insights(mood_insights),
-                "conversation_history": self.memory.get_history()
-            })
-
-            # Store interaction with emotional metadata
-            self.memory.save_conversation(
-                state["user_input"],
-                response.content,
-                metadata={
-                    "emotion": emotional_state,
-                    "valence": state["emotional_state"]["valence"],
-                    "recommendations": therapeutic_recommendations.get("primary_recommendation", {}).get("title", "")
-                }
-            )
+            cache_key = self._response_cache_key(state)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                self._save_clinical_response(state, cached)
+                return {"response": cached}
+
+            chain, inputs = self._prepare_clinical_response(state)
+            start = time.perf_counter()
+            with priority_lane(self._priority_lane(state)), self._provider_timer("chat"):
+                response = chain.invoke(inputs)
+            if cache_key:
+                self.response_cache.put(cache_key, response.content, time.perf_counter() - start)
+            self._save_clinical_response(state, response.content)
 
             return {"response": response.content}
         except Exception as e:
             print(f"Error generating response: {e}")
+            record_fallback("llm_response", e)
             # Fallback response
             return {"response": "I'm here to listen and support you. Could you tell me more about what you're experiencing?"}
 
+    async def agenerate_clinical_response(self, state: AgentState):
+        """Async variant of generate_clinical_response that awaits the LLM instead of blocking"""
+        try:
+            cache_key = await run_blocking(self._response_cache_key, state)
+            cached = await run_io(self.response_cache.get, cache_key) if cache_key else None
+            if cached is not None:
+                await run_blocking(self._save_clinical_response, state, cached)
+                return {"response": cached}
+
+            chain, inputs = await run_blocking(self._prepare_clinical_response, state)
+            start = time.perf_counter()
+            with priority_lane(self._priority_lane(state)), self._provider_timer("chat"):
+                response = await chain.ainvoke(inputs)
+            if cache_key:
+                await run_io(self.response_cache.put, cache_key, response.content, time.perf_counter() - start)
+            await run_blocking(self._save_clinical_response, state, response.content)
+
+            return {"response": response.content}
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            record_fallback("llm_response", e)
+            # Fallback response
+            return {"response": "I'm here to listen and support you. Could you tell me more about what you're experiencing?"}
+
+    async def astream_response(self, state: AgentState) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the workflow and stream the response as it is generated.
+
+        Yields the emotional state and escalation decision as soon as the
+        assessment nodes finish, then the LLM tokens as they arrive, then the
+        gamification message.
+
+        Args:
+            state: Initial workflow state
+
+        Yields:
+            Events of the form {"event": name, "data": payload}
+        """
+        state = {**state, **await self.assessment_workflow.ainvoke(state)}
+        needs_escalation = self.determine_intervention_path(state) == "escalate"
+
+        yield {"event": "emotional_state", "data": state["emotional_state"]}
+        yield {"event": "escalation", "data": {"needs_escalation": needs_escalation}}
+
+        if needs_escalation:
+            result = await run_blocking(self.escalate_with_resources, state)
+            yield {"event": "token", "data": {"text": result["response"]}}
+            yield {"event": "done", "data": {"response": result["response"]}}
+            return
+
+        response_parts = []
+        try:
+            chain, inputs = await run_blocking(self._prepare_clinical_response, state)
+            start = time.perf_counter()
+            with self._provider_timer("chat_stream"):
+                async for chunk in astream_in_lane(chain.astream(inputs), self._priority_lane(state)):
+                    if chunk.content:
+                        if not response_parts:
+                            metrics.observe(
+                                "mindguard_provider_latency_seconds",
+                                time.perf_counter() - start,
+                                provider=self.provider or "auto",
+                                operation="chat_first_token"
+                            )
+                        response_parts.append(chunk.content)
+                        yield {"event": "token", "data": {"text": chunk.content}}
+            response_text = "".join(response_parts)
+            await run_blocking(self._save_clinical_response, state, response_text)
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            record_fallback("llm_stream", e)
+            if response_parts:
+                response_text = "".join(response_parts)
+            else:
+                # Fallback response
+                response_text = "I'm here to listen and support you. Could you tell me more about what you're experiencing?"
+                yield {"event": "token", "data": {"text": response_text}}
+
+        try:
+            gamification_update = await run_blocking(self._record_conversation_activity, state)
+            gamification_message = self._format_gamification_message(gamification_update)
+        except Exception as e:
+            print(f"Error updating gamification: {e}")
+            record_fallback("gamification", e)
+            gamification_message = ""
+
+        if gamification_message:
+            response_text += gamification_message
+            yield {"event": "token", "data": {"text": gamification_message}}
+
+        yield {"event": "done", "data": {"response": response_text}}
+
     def update_gamification(self, state: AgentState):
         """Update gamification system based on user interaction"""
         try:
-            # Record interaction in gamification system
-            activity_type = "conversation"
+            gamification_update = self._record_conversation_activity(state)
+            gamification_message = self._format_gamification_message(gamification_update)
             
-            # Add context based on emotional state
-            context = {
-                "emotion": state["emotional_state"]["emotion"],
-                "valence": state["emotional_state"]["valence"],
-                "intensity": state["emotional_state"]["intensity"]
+            result = {
+                "gamification_update": gamification_update
             }
             
-            # Record the activity
-            gamification_update = self.gamification.record_activity(activity_type, context)
-            
-            # Generate gamification message
-            gamification_message = ""
-            
-            if gamification_update.get("new_achievements"):
-                achievements = gamification_update["new_achievements"]
-                achievement_names = [a["name"] for a in achievements]
-                gamification_message += f"\n\n🏆 Achievement{'s' if len(achievements) > 1 else ''} Unlocked: {', '.join(achievement_names)}!"
-            
-            if gamification_update.get("streak_updated"):
-                streak = gamification_update.get("current_streak", 0)
-                gamification_message += f"\n\n🔥 You're on a {streak}-day streak!"
-            
-            if gamification_update.get("level_up"):
-                new_level = gamification_update.get("current_level", 1)
-                gamification_message += f"\n\n⭐ Level Up! You're now at level {new_level}!"
-            
             # Append gamification message to response if there are updates
             if gamification_message and "response" in state:
-                state["response"] += gamification_message
+                result["response"] = state["response"] + gamification_message
             
-            return {
-                "gamification_update": gamification_update
-            }
+            return result
         except Exception as e:
             print(f"Error updating gamification: {e}")
+            record_fallback("gamification", e)
             return {}
 
+    def _record_conversation_activity(self, state: AgentState) -> Dict[str, Any]:
+        """Record a conversation in the gamification system"""
+        # Record interaction in gamification system
+        activity_type = "conversation"
+        
+        # Add context based on emotional state
+        context = {
+            "emotion": state["emotional_state"]["emotion"],
+            "valence": state["emotional_state"]["valence"],
+            "intensity": state["emotional_state"]["intensity"]
+        }
+        
+        # Record the activity
+        return self.gamification.record_activity(activity_type, context)
+
+    def _format_gamification_message(self, gamification_update: Dict[str, Any]) -> str:
+        """Generate the gamification message appended to responses"""
+        gamification_message = ""
+        
+        if gamification_update.get("new_achievements"):
+            achievements = gamification_update["new_achievements"]
+            achievement_names = [a["name"] for a in achievements]
+            gamification_message += f"\n\n🏆 Achievement{'s' if len(achievements) > 1 else ''} Unlocked: {', '.join(achievement_names)}!"
+        
+        if gamification_update.get("streak_updated"):
+            streak = gamification_update.get("current_streak", 0)
+            gamification_message += f"\n\n🔥 You're on a {streak}-day streak!"
+        
+        if gamification_update.get("level_up"):
+            new_level = gamification_update.get("current_level", 1)
+            gamification_message += f"\n\n⭐ Level Up! You're now at level {new_level}!"
+        
+        return gamification_message
+
     def escalate_with_resources(self, state: AgentState):
         """Enhanced escalation protocol with personalized resources"""
         resources = [
@@ -298,8 +686,9 @@ class MentalHealthAgent:
         
         full_message = f"{intro_message}\n\n{emotion_message}\n\n{action_message}\n\n" + "\n".join(resources)
         
+        # Store what the user said, without the caller's prompt instructions
         self.memory.save_conversation(
-            state["user_input"], 
+            state.get("user_message") or state["user_input"],
             "Crisis resources provided",
             metadata={"escalation": True, "emotion": emotion}
         )
@@ -327,8 +716,10 @@ class MentalHealthAgent:
                 context_parts.append(f"Insight: {insight['description']}")
                 context_parts.append(f"Recommendation: {insight['recommendation']}")
         
-        # Add conversation history summary
-        similar_convos = self.memory.find_similar_conversations(state["user_input"], k=1)
+        # Add conversation history summary, retrieved concurrently by retrieve_context
+        similar_convos = state.get("similar_conversations")
+        if similar_convos is None:
+            similar_convos = self.memory.find_similar_conversations(state["user_input"], k=1)
         if similar_convos:
             context_parts.append("Related previous conversation:")
             for convo in similar_convos:
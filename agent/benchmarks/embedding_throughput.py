@@ -0,0 +1,113 @@
+"""
+Embedding throughput benchmark for GeminiEmbeddings against a local stub.
+
+Starts a stub of Gemini's batchEmbedContents REST endpoint with a simulated
+round-trip latency, points GeminiEmbeddings at it through
+GEMINI_API_ENDPOINT and reports texts/second for one request per text
+(the old behaviour) and for batched, concurrent requests.
+
+Usage (from the agent directory):
+    python -m benchmarks.embedding_throughput --texts 500 --latency-ms 50
+"""
+
+from typing import Dict, List, Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_stub_server(latency: float, dimension: int) -> ThreadingHTTPServer:
+    """
+    Serve Gemini's embedContent and batchEmbedContents REST methods locally.
+
+    Args:
+        latency: Seconds each request takes
+        dimension: Length of the returned vectors
+
+    Returns:
+        The running server
+    """
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            vector = {"values": [0.1] * dimension}
+            if "requests" in body:
+                payload = {"embeddings": [vector for _ in body["requests"]]}
+            else:
+                payload = {"embedding": vector}
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(texts: List[str], batch_size: int, concurrency: int, use_async: bool) -> Dict[str, Any]:
+    from agent.gemini_embeddings import GeminiEmbeddings
+
+    embeddings = GeminiEmbeddings(batch_size=batch_size, max_concurrency=concurrency)
+    start = time.perf_counter()
+    if use_async:
+        vectors = asyncio.run(embeddings.aembed_documents(texts))
+    else:
+        vectors = embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts)
+    return {
+        "batch_size": embeddings.batch_size,
+        "concurrency": embeddings.max_concurrency,
+        "async": use_async,
+        "elapsed_seconds": elapsed,
+        "texts_per_second": len(texts) / elapsed if elapsed else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GeminiEmbeddings throughput against a local stub")
+    parser.add_argument("--texts", type=int, default=500, help="Number of texts to embed")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated round-trip latency per request")
+    parser.add_argument("--dimension", type=int, default=768, help="Vector length returned by the stub")
+    parser.add_argument("--batch-size", type=int, default=100, help="Texts per request for the batched runs")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight for the batched runs")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000.0, args.dimension)
+    os.environ.setdefault("GOOGLE_API_KEY", "stub-key")
+    os.environ["GEMINI_API_ENDPOINT"] = f"http://127.0.0.1:{server.server_port}"
+    sys.path.insert(0, AGENT_DIR)
+
+    texts = [f"conversation turn {i}" for i in range(args.texts)]
+    runs = [
+        # One request per text is slow, so the baseline embeds a tenth of the texts
+        measure(texts[:max(1, args.texts // 10)], 1, 1, False),
+        measure(texts, args.batch_size, 1, False),
+        measure(texts, args.batch_size, args.concurrency, False),
+        measure(texts, args.batch_size, args.concurrency, True)
+    ]
+    server.shutdown()
+
+    print(json.dumps({
+        "texts": args.texts,
+        "latency_ms": args.latency_ms,
+        "runs": runs
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Load-testing harness for the /chat API.
+
+Boots the FastAPI app in-process with offline components (SimpleFallbackLLM
+or a fake chat model with configurable latency, and SimpleOfflineEmbeddings)
+and drives /chat with N concurrent simulated users over M turns each. No
+provider API is called, so runs are free and comparable across commits.
+
+Reports requests/second, p50/p99 latency, resident memory per user and the
+number of reads and writes of the per-user stores. Results are written as
+JSON tagged with the git commit, and can be compared against a previous run.
+
+Usage (from the agent directory):
+    python -m benchmarks.load_test --users 20 --turns 5
+    python -m benchmarks.load_test --llm fake --llm-latency-ms 300 --output run.json
+    python -m benchmarks.load_test --compare baseline.json
+"""
+
+from typing import Dict, List, Any, Optional
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Deterministic conversation openers and follow-ups, cycled per user and turn
+MESSAGES = [
+    "I feel anxious today",
+    "hi, I'm stressed about work",
+    "I haven't been sleeping well lately",
+    "I'm feeling a bit better than yesterday",
+    "Everything feels overwhelming right now",
+    "I had a good day with my friends",
+    "I keep worrying about my exams",
+    "I feel lonely in the evenings"
+]
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS is the best portable approximation (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=AGENT_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _install_fake_llm(latency_ms: float, jitter_ms: float):
+    """Serve every chat model from a fake with configurable latency."""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.outputs import ChatResult
+
+    from agent.llm_factory import LLMFactory, SimpleFallbackLLM
+
+    class LatencyChatModel(BaseChatModel):
+        """SimpleFallbackLLM responses after a simulated provider round trip."""
+
+        latency: float = 0.0
+        jitter: float = 0.0
+
+        def _delay(self) -> float:
+            return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            time.sleep(self._delay())
+            return SimpleFallbackLLM()._generate(messages)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            await asyncio.sleep(self._delay())
+            return SimpleFallbackLLM()._generate(messages)
+
+        @property
+        def _llm_type(self) -> str:
+            return "latency_fake"
+
+    def create_llm(provider=None, temperature=0.7, **kwargs):
+        return LatencyChatModel(latency=latency_ms / 1000.0, jitter=jitter_ms / 1000.0)
+
+    LLMFactory.create_llm = staticmethod(create_llm)
+
+
+def _store_io(snapshot: Dict[str, Any]) -> Dict[str, float]:
+    return dict(snapshot["counters"].get("mindguard_store_io_total", {}))
+
+
+async def _run_user(client, user_id: str, user_index: int, turns: int, latencies: List[float], errors: List[str]):
+    for turn in range(turns):
+        message = MESSAGES[(user_index + turn) % len(MESSAGES)]
+        start = time.perf_counter()
+        try:
+            response = await client.post("/chat", json={"message": message, "user_id": user_id})
+            response.raise_for_status()
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_benchmark(users: int, turns: int) -> Dict[str, Any]:
+    """
+    Drive /chat with concurrent users and measure the app.
+
+    Args:
+        users: Number of concurrent simulated users
+        turns: Messages sent by each user, sequentially
+
+    Returns:
+        Dictionary of results
+    """
+    import httpx
+
+    import main
+    from agent.metrics import metrics
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Warm up shared components so model loading is not measured
+        await client.post("/chat", json={"message": "hello", "user_id": "warmup"})
+
+        io_before = _store_io(metrics.snapshot())
+        rss_before = _rss_bytes()
+        latencies: List[float] = []
+        errors: List[str] = []
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _run_user(client, f"bench-user-{i}", i, turns, latencies, errors)
+            for i in range(users)
+        ))
+        elapsed = time.perf_counter() - start
+
+        rss_after = _rss_bytes()
+        io_after = _store_io(metrics.snapshot())
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": _percentile(ordered, 0.5),
+            "p99": _percentile(ordered, 0.99),
+            "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+            "max": ordered[-1] if ordered else 0.0
+        },
+        "rss_bytes": {
+            "before": rss_before,
+            "after": rss_after,
+            "per_user": (rss_after - rss_before) / users if users else 0
+        },
+        "store_io": {
+            key: value - io_before.get(key, 0.0)
+            for key, value in io_after.items()
+            if value - io_before.get(key, 0.0)
+        }
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Format the headline deltas between two result files."""
+    def delta(path: List[str]) -> str:
+        a, b = baseline["results"], current["results"]
+        for key in path:
+            a, b = a[key], b[key]
+        change = (b - a) / a * 100 if a else 0.0
+        return f"{'.'.join(path)}: {a:.4g} -> {b:.4g} ({change:+.1f}%)"
+
+    lines = [f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):"]
+    for path in (["requests_per_second"], ["latency_seconds", "p50"], ["latency_seconds", "p99"], ["rss_bytes", "per_user"]):
+        lines.append("  " + delta(path))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /chat API with offline components")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="Messages per user")
+    parser.add_argument(
+        "--llm",
+        choices=["fallback", "fake"],
+        default="fallback",
+        help="SimpleFallbackLLM, or a fake chat model with simulated latency"
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Mean fake LLM latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="Standard deviation of fake LLM latency")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for latency jitter")
+    parser.add_argument("--data-dir", type=str, default=None, help="Working directory for user data (default: a temp dir)")
+    parser.add_argument("--output", type=str, default=None, help="Write results JSON to this file")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    os.environ["OFFLINE_MODE"] = "true"
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    # User stores, cached models and the user id file are written relative to
+    # the working directory; keep them out of the source tree
+    sys.path.insert(0, AGENT_DIR)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="mindguard-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+    os.chdir(data_dir)
+
+    if args.llm == "fake":
+        _install_fake_llm(args.llm_latency_ms, args.llm_jitter_ms)
+
+    results = asyncio.run(run_benchmark(args.users, args.turns))
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "config": {
+            "users": args.users,
+            "turns": args.turns,
+            "llm": args.llm,
+            "llm_latency_ms": args.llm_latency_ms if args.llm == "fake" else None,
+            "llm_jitter_ms": args.llm_jitter_ms if args.llm == "fake" else None,
+            "seed": args.seed,
+            "python": sys.version.split()[0]
+        },
+        "results": results
+    }
+
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            print("\n".join(compare(report, json.load(f))))
+
+
+if __name__ == "__main__":
+    main()
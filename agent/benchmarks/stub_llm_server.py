@@ -0,0 +1,277 @@
+"""
+Local OpenAI-compatible stub server for offline testing and benchmarking.
+
+Implements the parts of the OpenAI API the agent uses:
+- POST /v1/chat/completions, including server-sent-event streaming
+- POST /v1/embeddings, with deterministic feature-hashing vectors
+- GET /v1/models
+
+Latency, error rate and token rate are configurable, so provider failover,
+timeouts, hedging and streaming can be exercised without live keys. Point
+the agent at it with OPENAI_BASE_URL (or GROQ_BASE_URL) and any API key:
+
+    python -m benchmarks.stub_llm_server --port 8089 --latency-ms 300 --error-rate 0.05
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python main.py
+"""
+
+from typing import Dict, List, Any, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubConfig:
+    """Behaviour of the stub: latency distribution, failures and token rate."""
+
+    def __init__(self,
+                 latency_ms: float = 200.0,
+                 jitter_ms: float = 50.0,
+                 distribution: str = "normal",
+                 error_rate: float = 0.0,
+                 error_status: int = 500,
+                 hang_rate: float = 0.0,
+                 tokens_per_second: float = 50.0,
+                 embedding_dimension: int = 256,
+                 seed: Optional[int] = None):
+        """
+        Initialize the stub configuration.
+
+        Args:
+            latency_ms: Mean time to the first token
+            jitter_ms: Spread of the latency (standard deviation for normal)
+            distribution: "fixed", "normal", "lognormal" or "exponential"
+            error_rate: Fraction of requests answered with error_status
+            error_status: HTTP status of injected errors (e.g. 429, 500, 503)
+            hang_rate: Fraction of requests that never answer (for timeout tests)
+            tokens_per_second: Generation speed after the first token (0 disables pacing)
+            embedding_dimension: Length of returned embedding vectors
+            seed: Optional random seed for reproducible runs
+        """
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.tokens_per_second = tokens_per_second
+        self.embedding_dimension = embedding_dimension
+        self.random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """Draw a time-to-first-token in seconds."""
+        if self.distribution == "fixed" or self.latency <= 0:
+            return max(0.0, self.latency)
+        if self.distribution == "exponential":
+            return self.random.expovariate(1.0 / self.latency)
+        if self.distribution == "lognormal":
+            # Parameterized so the mean is latency and the spread roughly jitter
+            sigma = max(1e-6, (self.jitter / self.latency) if self.jitter else 0.5)
+            mu = math.log(self.latency) - sigma ** 2 / 2
+            return self.random.lognormvariate(mu, sigma)
+        return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+
+def _reply_for(bank, messages: List[Dict[str, Any]]) -> str:
+    """Pick a reply for the last user message from the offline response bank."""
+    user_messages = [m for m in messages if m.get("role") == "user"]
+    text = str(user_messages[-1].get("content", "")) if user_messages else ""
+    return bank.best_response(text)
+
+
+def _tokens(text: str) -> List[str]:
+    """Split text into word-sized stream tokens that keep their whitespace."""
+    words = text.split(" ")
+    return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+
+def _usage(messages: List[Dict[str, Any]], completion: str) -> Dict[str, int]:
+    prompt_tokens = sum((len(str(m.get("content", ""))) + 3) // 4 + 4 for m in messages)
+    completion_tokens = len(_tokens(completion))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    """
+    Build the stub API application.
+
+    Args:
+        config: Stub behaviour
+
+    Returns:
+        FastAPI application
+    """
+    from agent.llm_factory import SimpleOfflineEmbeddings
+    from agent.offline_responder import get_response_bank
+
+    app = FastAPI(title="MindGuard OpenAI-compatible stub")
+    embedder = SimpleOfflineEmbeddings(dimension=config.embedding_dimension)
+    bank = get_response_bank()
+    counters = {"requests": 0, "errors": 0, "hangs": 0}
+
+    async def inject_failure() -> Optional[JSONResponse]:
+        counters["requests"] += 1
+        roll = config.random.random()
+        if roll < config.hang_rate:
+            counters["hangs"] += 1
+            await asyncio.sleep(3600)
+        if roll < config.hang_rate + config.error_rate:
+            counters["errors"] += 1
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "Injected stub error", "type": "server_error", "code": config.error_status}}
+            )
+        return None
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        failure = await inject_failure()
+        if failure is not None:
+            return failure
+
+        messages = body.get("messages", [])
+        model = body.get("model", "stub-model")
+        reply = _reply_for(bank, messages)
+        tokens = _tokens(reply)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        token_delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        await asyncio.sleep(config.sample_latency())
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * max(0, len(tokens) - 1))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": _usage(messages, reply)
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        async def stream():
+            yield event({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(token_delay)
+                yield event({"content": token})
+            yield event({}, finish_reason="stop")
+            if include_usage:
+                usage_chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": _usage(messages, reply)
+                }
+                yield f"data: {json.dumps(usage_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        failure = await inject_failure()
+        if failure is not None:
+            return failure
+
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Token-id inputs cannot be decoded without a tokenizer; embed their text form
+        texts = [item if isinstance(item, str) else " ".join(map(str, item)) for item in inputs]
+
+        await asyncio.sleep(config.sample_latency())
+        vectors = embedder.embed_documents(texts)
+        tokens = sum((len(text) + 3) // 4 for text in texts)
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)],
+            "model": body.get("model", "stub-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Latency spread")
+    parser.add_argument(
+        "--distribution",
+        choices=["fixed", "normal", "lognormal", "exponential"],
+        default="normal",
+        help="Latency distribution"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that never answer")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Generation speed after the first token")
+    parser.add_argument("--embedding-dimension", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    sys.path.insert(0, AGENT_DIR)
+    import uvicorn
+
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        distribution=args.distribution,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+        tokens_per_second=args.tokens_per_second,
+        embedding_dimension=args.embedding_dimension,
+        seed=args.seed
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import os
 import uuid
+import json
 import logging
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, AsyncIterator
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 import time
 
 # Configure logging
@@ -14,9 +16,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("mindguard_api")
 
+from agent.session_cache import SessionCache
+from agent.concurrency import run_blocking, get_background_executor
+from agent.metrics import metrics, record_fallback
+
 # Try to import agent workflow with error handling
 try:
     from agent.workflow import MentalHealthAgent
+    from agent.shared_index import get_shared_index
+    from agent.embedding_cache import flush_embedding_caches
+    from agent.http_clients import aclose_http_clients
+    from agent.model_registry import registry as model_registry
     AGENT_AVAILABLE = True
 except ImportError as e:
     logger.error(f"Failed to import MentalHealthAgent: {e}")
@@ -40,8 +50,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store chat instances for different users
-chat_instances: Dict[str, 'MentalHealthChat'] = {}
+def _evict_chat_instance(user_id: str, chat_instance: 'MentalHealthChat'):
+    """Flush an evicted chat's state to disk and release its shared components."""
+    logger.info(f"Evicting chat instance for user: {user_id}")
+    chat_instance.close()
+
+# Store chat instances for different users, bounded by count and idle time.
+# Evicted users are rehydrated from disk on their next request.
+chat_instances: SessionCache['MentalHealthChat'] = SessionCache(
+    max_size=int(os.environ.get("CHAT_SESSION_MAX_SIZE", "1000")),
+    ttl_seconds=float(os.environ.get("CHAT_SESSION_TTL_SECONDS", "1800")),
+    on_evict=_evict_chat_instance,
+    # Flushing an evicted chat embeds its pending turns; no request should wait on that
+    evict_executor=get_background_executor()
+)
 
 RESPONSE_GUIDELINES = {
     "max_words": 50,
@@ -50,6 +72,15 @@ RESPONSE_GUIDELINES = {
     "tone": "positive and encouraging"
 }
 
+def _collect_session_metrics():
+    """Export chat session cache counters."""
+    stats = chat_instances.stats()
+    yield "mindguard_chat_sessions", "gauge", {}, stats["size"]
+    for counter in ("hits", "misses", "evictions", "expirations"):
+        yield f"mindguard_chat_session_{counter}_total", "counter", {}, stats[counter]
+
+metrics.register_collector(_collect_session_metrics)
+
 class ChatRequest(BaseModel):
     message: str
     user_id: Optional[str] = None
@@ -139,6 +170,14 @@ class MentalHealthChat:
                     self.agent = None
                     self.provider_name = "Emergency Fallback"
                 
+    def close(self):
+        """Flush per-user state and release the shared components held by this chat's agent."""
+        if self.agent is not None:
+            try:
+                self.agent.flush()
+            finally:
+                self.agent.close()
+
     def _get_or_create_user_id(self):
         """Get existing user ID or create a new one for persistent personalization."""
         # Check if user ID is stored in a file
@@ -192,6 +231,27 @@ class MentalHealthChat:
             backups.append("gemini")
         return backups
 
+    def _build_workflow_input(self, message: str) -> Dict:
+        """Format a user message as the initial agent workflow state."""
+        return {
+            "user_message": message,
+            "user_input": f"{message} and give me answer in a short paragraph, If this prompt is not related to mental health, so please don't give me answer to the asked question and give response as Please ask the question related to mental health",
+            "history": [],
+            "response": "",
+            "needs_escalation": False,
+            "emotional_state": {
+                "emotion": "neutral",
+                "confidence": 0.5,
+                "valence": 0.0,
+                "is_crisis": False,
+                "intensity": 0.1
+            },
+            "therapeutic_recommendations": None,
+            "mood_insights": None,
+            "gamification_update": None,
+            "response_guidelines": RESPONSE_GUIDELINES
+        }
+
     async def get_response(self, message: str) -> Dict:
         """
         Get a response from the mental health agent with robust error handling.
@@ -205,6 +265,7 @@ class MentalHealthChat:
         # Check if agent is available (could be None in complete fallback mode)
         if self.agent is None:
             self.logger.warning("Agent not available, using hardcoded fallback response")
+            record_fallback("agent_unavailable")
             return {
                 "response": "I'm here to help with mental health concerns. However, I'm currently experiencing technical difficulties. Please try again later or contact support if the issue persists.",
                 "provider": self.provider_name,
@@ -217,24 +278,9 @@ class MentalHealthChat:
             if not message or not isinstance(message, str):
                 raise ValueError("Invalid input: message must be a non-empty string")
                 
-            # Format input for the agent workflow
-            result = self.agent.workflow.invoke({
-                "user_input": f"{message} and give me answer in a short paragraph, If this prompt is not related to mental health, so please don't give me answer to the asked question and give response as Please ask the question related to mental health",
-                "history": [],
-                "response": "",
-                "needs_escalation": False,
-                "emotional_state": {
-                    "emotion": "neutral",
-                    "confidence": 0.5,
-                    "valence": 0.0,
-                    "is_crisis": False,
-                    "intensity": 0.1
-                },
-                "therapeutic_recommendations": None,
-                "mood_insights": None,
-                "gamification_update": None,
-                "response_guidelines": RESPONSE_GUIDELINES
-            })
+            # Run the workflow on the async path so slow model and provider
+            # calls do not block the event loop for other users
+            result = await self.agent.workflow.ainvoke(self._build_workflow_input(message))
 
             # Extract and format the response
             response = result.get("response", "I'm here to listen. Could you tell me more about that?")
@@ -248,21 +294,29 @@ class MentalHealthChat:
             }
         except Exception as e:
             self.logger.error(f"Error generating response with {self.provider_name}: {e}")
+            record_fallback("provider_error", e)
             
-            # Try backup providers if available
+            # Try backup providers if available. Switching only swaps the chat
+            # client; the agent's memory and trackers are kept.
             for backup in self._get_backup_providers():
                 try:
                     self.logger.info(f"Trying backup provider {backup} for response generation")
+                    record_fallback("backup_provider")
+                    self.agent.switch_provider(backup)
                     self.provider = backup
-                    self.agent = MentalHealthAgent(provider=self.provider, user_id=self.user_id)
                     self.provider_name = backup.capitalize()
-                    
-                    # Recursive call with the new provider
-                    return await self.get_response(message)
+
+                    result = await self.agent.workflow.ainvoke(self._build_workflow_input(message))
+                    return {
+                        "response": result.get("response", "I'm here to listen. Could you tell me more about that?"),
+                        "emotional_state": result.get("emotional_state"),
+                        "provider": self.provider_name
+                    }
                 except Exception as e2:
                     self.logger.error(f"Backup provider {backup} also failed: {e2}")
             
             # All providers failed, return a graceful error response
+            record_fallback("error_response")
             return {
                 "response": "I apologize, but I'm having trouble processing your request right now. Could you try again in a moment?",
                 "emotional_state": {
@@ -276,6 +330,44 @@ class MentalHealthChat:
                 "error": str(e)
             }
 
+    async def stream_response(self, message: str) -> AsyncIterator[Dict]:
+        """
+        Stream a response from the mental health agent.
+        
+        Args:
+            message: User message to respond to
+            
+        Yields:
+            Events of the form {"event": name, "data": payload}: the emotional
+            state, the escalation decision, response tokens, and a final
+            "done" event carrying the full response
+        """
+        if self.agent is None:
+            self.logger.warning("Agent not available, using hardcoded fallback response")
+            record_fallback("agent_unavailable")
+            response = "I'm here to help with mental health concerns. However, I'm currently experiencing technical difficulties. Please try again later or contact support if the issue persists."
+            yield {"event": "token", "data": {"text": response}}
+            yield {"event": "done", "data": {"response": response, "provider": self.provider_name, "error": "Agent initialization failed"}}
+            return
+        
+        if not message or not isinstance(message, str):
+            raise ValueError("Invalid input: message must be a non-empty string")
+        
+        try:
+            async for event in self.agent.astream_response(self._build_workflow_input(message)):
+                if event["event"] == "done":
+                    event["data"]["provider"] = self.provider_name
+                yield event
+            self.logger.info(f"Streamed response with provider: {self.provider_name}")
+        except Exception as e:
+            self.logger.error(f"Error streaming response with {self.provider_name}: {e}")
+            record_fallback("stream_error", e)
+            yield {"event": "error", "data": {"error": str(e), "provider": self.provider_name}}
+
+def _format_sse(event: Dict) -> str:
+    """Format an event dictionary as a server-sent event."""
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -299,14 +391,20 @@ async def chat(request: ChatRequest):
             )
         
         # Create or get existing chat instance
-        if user_id not in chat_instances:
+        def create_chat_instance():
             logger.info(f"Creating new chat instance for user: {user_id}")
-            chat_instances[user_id] = MentalHealthChat(user_id=user_id)
+            return MentalHealthChat(user_id=user_id)
         
-        chat_instance = chat_instances[user_id]
+        # Building a session loads its stores from disk, so keep it off the event loop.
+        # The lease keeps the session from being evicted while this request uses it.
+        chat_instance = await run_blocking(chat_instances.acquire, user_id, create_chat_instance)
         
         # Get response from the chat instance
-        result = await chat_instance.get_response(request.message)
+        try:
+            with metrics.timer("mindguard_request_latency_seconds", endpoint="/chat"):
+                result = await chat_instance.get_response(request.message)
+        finally:
+            chat_instances.release(user_id)
         
         # Check if there was an error
         if "error" in result and result["error"]:
@@ -326,6 +424,62 @@ async def chat(request: ChatRequest):
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Process a chat request and stream the response as server-sent events.
+    
+    Emits an "emotional_state" event and an "escalation" event first, then
+    "token" events as the response is generated (the gamification message
+    arrives as the last token), and finally a "done" event with the full
+    response, provider and user_id.
+    
+    Args:
+        request: ChatRequest containing message and optional user_id
+        
+    Returns:
+        StreamingResponse of text/event-stream events
+    """
+    # Use provided or generate user ID
+    user_id = request.user_id or str(uuid.uuid4())
+    
+    # Validate input
+    if not request.message or not isinstance(request.message, str):
+        raise HTTPException(
+            status_code=400, 
+            detail="Invalid message: message must be a non-empty string"
+        )
+    
+    try:
+        def create_chat_instance():
+            logger.info(f"Creating new chat instance for user: {user_id}")
+            return MentalHealthChat(user_id=user_id)
+        
+        chat_instance = await run_blocking(chat_instances.acquire, user_id, create_chat_instance)
+    except Exception as e:
+        logger.error(f"Unhandled exception in chat stream endpoint: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+    
+    async def event_stream():
+        # The lease taken above is held until the stream finishes or is abandoned
+        try:
+            with metrics.timer("mindguard_request_latency_seconds", endpoint="/chat/stream"):
+                async for event in chat_instance.stream_response(request.message):
+                    if event["event"] == "done":
+                        event["data"]["user_id"] = chat_instance.user_id
+                    yield _format_sse(event)
+        finally:
+            chat_instances.release(user_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 def analyze_mental_health(data: Dict, history: Optional[Dict] = None) -> Dict:
     """
     Analyze mental health data and generate insights.
@@ -644,6 +798,7 @@ async def health_check():
                 "provider": provider_status,
                 "database": "not_configured"  # Placeholder
             },
+            "sessions": chat_instances.stats(),
             "version": "1.0.0"
         }
     except Exception as e:
@@ -654,6 +809,33 @@ async def health_check():
             "timestamp": int(time.time())
         }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Expose agent metrics in the Prometheus text format.
+    
+    Includes p50/p95/p99 latency per workflow node, per provider call and per
+    endpoint, error and fallback counters, session cache counters and
+    emotion batch-size histograms.
+    """
+    return PlainTextResponse(
+        metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@app.on_event("shutdown")
+async def flush_chat_instances():
+    """Flush chat sessions, shared components, the shared vector index and embedding caches on shutdown, then close the provider HTTP pools."""
+    chat_instances.clear()
+    if not AGENT_AVAILABLE:
+        return
+    model_registry.unload_unused(idle_seconds=0)
+    shared_index = get_shared_index()
+    if shared_index is not None:
+        shared_index.snapshot()
+    flush_embedding_caches()
+    await aclose_http_clients()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
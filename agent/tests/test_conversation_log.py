@@ -0,0 +1,92 @@
+import json
+import os
+
+from agent.conversation_log import ConversationLog
+
+
+def _turn(i):
+    return {"input": f"q{i}", "output": f"a{i}", "metadata": {}}
+
+
+def _inputs(log):
+    return [turn["input"] for turn in log]
+
+
+def test_truncated_index_with_one_line_log_is_rewritten(tmp_path):
+    log = ConversationLog(str(tmp_path), "u", window=1)
+    log.append(_turn(0))
+    # Crash after the first line was written but before its offset was
+    with open(log.index_path, "wb"):
+        pass
+
+    reopened = ConversationLog(str(tmp_path), "u", window=1)
+    assert len(reopened) == 1
+    assert os.path.getsize(reopened.index_path) == 8
+    reopened.append(_turn(1))
+    reopened.append(_turn(2))
+
+    assert _inputs(reopened) == ["q0", "q1", "q2"]
+    assert _inputs(ConversationLog(str(tmp_path), "u", window=1)) == ["q0", "q1", "q2"]
+
+
+def test_turns_outside_the_window_are_read_from_disk(tmp_path):
+    log = ConversationLog(str(tmp_path), "u", window=2)
+    for i in range(5):
+        log.append(_turn(i))
+
+    assert [turn["input"] for turn in log.tail()] == ["q3", "q4"]
+    assert log[0]["input"] == "q0"
+    assert log[-1]["input"] == "q4"
+    assert [turn["input"] for turn in log[1:4]] == ["q1", "q2", "q3"]
+    assert [turn["input"] for turn in log[::2]] == ["q0", "q2", "q4"]
+
+    reopened = ConversationLog(str(tmp_path), "u", window=2)
+    assert len(reopened) == 5
+    assert _inputs(reopened) == ["q0", "q1", "q2", "q3", "q4"]
+
+
+def test_torn_final_line_is_dropped(tmp_path):
+    log = ConversationLog(str(tmp_path), "u", window=2)
+    log.append(_turn(0))
+    log.append(_turn(1))
+    with open(log.log_path, "ab") as f:
+        f.write(b'{"input": "q2", "out')
+    size = os.path.getsize(log.log_path)
+
+    reopened = ConversationLog(str(tmp_path), "u", window=2)
+    assert _inputs(reopened) == ["q0", "q1"]
+    assert os.path.getsize(reopened.log_path) < size
+    reopened.append(_turn(2))
+    assert _inputs(ConversationLog(str(tmp_path), "u", window=2)) == ["q0", "q1", "q2"]
+
+
+def test_lines_without_offsets_are_reindexed(tmp_path):
+    log = ConversationLog(str(tmp_path), "u", window=1)
+    for i in range(3):
+        log.append(_turn(i))
+    # Crash after the last line was written but before its offset was
+    with open(log.index_path, "r+b") as f:
+        f.truncate(16)
+
+    reopened = ConversationLog(str(tmp_path), "u", window=1)
+    assert _inputs(reopened) == ["q0", "q1", "q2"]
+    assert os.path.getsize(reopened.index_path) == 24
+
+
+def test_legacy_json_store_is_migrated(tmp_path):
+    legacy = tmp_path / "u_conversations.json"
+    legacy.write_text(json.dumps([_turn(0), _turn(1)]))
+
+    log = ConversationLog(str(tmp_path), "u", window=1)
+    assert _inputs(log) == ["q0", "q1"]
+    assert not legacy.exists()
+    assert (tmp_path / "u_conversations.json.migrated").exists()
+    assert _inputs(ConversationLog(str(tmp_path), "u", window=1)) == ["q0", "q1"]
+
+
+def test_log_without_storage_stays_in_memory():
+    log = ConversationLog()
+    for i in range(3):
+        log.append(_turn(i))
+    assert log.log_path is None
+    assert _inputs(log) == ["q0", "q1", "q2"]
@@ -0,0 +1,57 @@
+import json
+
+from agent.embedding_cache import EmbeddingStore, text_digest
+
+
+def _put(store, texts):
+    store.put_many([text_digest(text) for text in texts], [[float(len(text)), 1.0] for text in texts])
+
+
+def test_full_store_overwrites_oldest_rows(tmp_path):
+    store = EmbeddingStore(str(tmp_path), capacity=3)
+    _put(store, ["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert len(store) == 3
+    assert store.get(text_digest("a")) is None
+    assert store.get(text_digest("bb")) is None
+    assert store.get(text_digest("eeeee")) == [5.0, 1.0]
+
+    store.flush()
+    reopened = EmbeddingStore(str(tmp_path), capacity=3)
+    assert len(reopened) == 3
+    assert reopened.get(text_digest("ccc")) == [3.0, 1.0]
+    # The ring continues where it stopped: "ccc" is the oldest row left
+    _put(reopened, ["ffffff"])
+    assert reopened.get(text_digest("ccc")) is None
+    assert reopened.get(text_digest("dddd")) == [4.0, 1.0]
+
+
+def test_query_and_document_vectors_are_kept_apart(tmp_path):
+    store = EmbeddingStore(str(tmp_path), capacity=4)
+    store.put_many([text_digest("hi", "query")], [[1.0, 0.0]])
+
+    assert store.get(text_digest("hi", "document")) is None
+    assert store.get(text_digest("hi", "query")) == [1.0, 0.0]
+
+
+def test_meta_is_written_on_flush_not_on_put(tmp_path):
+    store = EmbeddingStore(str(tmp_path), capacity=3)
+    _put(store, ["a"])
+    meta = tmp_path / "meta.json"
+    assert json.loads(meta.read_text())["next"] == 0
+
+    store.flush()
+    assert json.loads(meta.read_text()) == {"dimension": 2, "capacity": 3, "next": 1}
+    assert not (tmp_path / "meta.json.tmp").exists()
+
+
+def test_unreadable_meta_starts_empty(tmp_path):
+    store = EmbeddingStore(str(tmp_path), capacity=3)
+    _put(store, ["a"])
+    store.flush()
+    (tmp_path / "meta.json").write_text('{"dimension": 2, "capa')
+
+    reopened = EmbeddingStore(str(tmp_path), capacity=3)
+    assert len(reopened) == 0
+    _put(reopened, ["b"])
+    assert reopened.get(text_digest("b")) == [1.0, 1.0]
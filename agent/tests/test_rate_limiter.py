@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agent.rate_limiter import HIGH, LOW, NORMAL, ProviderRateLimiter, RateLimitTimeout, TokenBucket, current_lane, priority_lane
+
+
+def _drained_limiter(per_minute=240, max_wait=10.0):
+    limiter = ProviderRateLimiter("test", max_wait=max_wait)
+    limiter.request_bucket = TokenBucket(per_minute, capacity=1)
+    limiter.acquire()
+    return limiter
+
+
+def _wait_for_depth(limiter, depth):
+    deadline = time.monotonic() + 5
+    while sum(limiter.queue_depths().values()) < depth and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_waiters_are_served_by_lane_then_arrival():
+    limiter = _drained_limiter()
+    granted = []
+
+    def wait(name, lane):
+        limiter.acquire(lane=lane)
+        granted.append(name)
+
+    threads = []
+    for name, lane in [("low", LOW), ("normal-1", NORMAL), ("high", HIGH), ("normal-2", NORMAL)]:
+        thread = threading.Thread(target=wait, args=(name, lane))
+        thread.start()
+        threads.append(thread)
+        _wait_for_depth(limiter, len(threads))
+    for thread in threads:
+        thread.join()
+
+    assert granted == ["high", "normal-1", "normal-2", "low"]
+
+
+def test_lane_defaults_to_the_context_lane():
+    assert current_lane() == NORMAL
+    with priority_lane(HIGH):
+        assert current_lane() == HIGH
+    assert current_lane() == NORMAL
+
+
+def test_waiting_past_max_wait_times_out_and_leaves_the_queue():
+    limiter = _drained_limiter(per_minute=1, max_wait=0.05)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire()
+    assert sum(limiter.queue_depths().values()) == 0
+
+
+def test_async_waiters_follow_the_same_order():
+    limiter = _drained_limiter()
+    granted = []
+
+    async def wait(name, lane):
+        await limiter.aacquire(lane=lane)
+        granted.append(name)
+
+    async def main():
+        tasks = []
+        for name, lane in [("low", LOW), ("normal", NORMAL), ("high", HIGH)]:
+            tasks.append(asyncio.create_task(wait(name, lane)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert granted == ["high", "normal", "low"]
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agent.session_cache import SessionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _recording_cache(**kwargs):
+    evicted = []
+    cache = SessionCache(on_evict=lambda key, session: evicted.append(key), **kwargs)
+    return cache, evicted
+
+
+def test_least_recently_used_session_is_evicted():
+    cache, evicted = _recording_cache(max_size=2)
+    cache.get_or_create("a", object)
+    cache.get_or_create("b", object)
+    cache.get_or_create("a", object)
+    cache.get_or_create("c", object)
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    cache, evicted = _recording_cache(max_size=10, ttl_seconds=60, clock=clock)
+    cache.get_or_create("a", object)
+    clock.now = 30
+    cache.get_or_create("b", object)
+    clock.now = 70
+    cache.get_or_create("b", object)
+
+    assert evicted == ["a"]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_leased_session_is_not_evicted_until_released():
+    clock = FakeClock()
+    cache, evicted = _recording_cache(max_size=1, ttl_seconds=60, clock=clock)
+    session = cache.acquire("a", object)
+    cache.get_or_create("b", object)
+    clock.now = 100
+    cache.get_or_create("c", object)
+
+    # "b" expired and "c" was the only unleased session above max_size
+    assert evicted == ["b", "c"]
+    assert "a" in cache
+
+    cache.release("a")
+    assert cache.get_or_create("a", object) is session
+    cache.get_or_create("d", object)
+    assert evicted == ["b", "c", "a"]
+
+
+def test_concurrent_misses_build_one_session():
+    cache, _ = _recording_cache(max_size=10)
+    built = []
+
+    def factory():
+        time.sleep(0.05)
+        session = object()
+        built.append(session)
+        return session
+
+    with ThreadPoolExecutor(8) as pool:
+        sessions = list(pool.map(lambda _: cache.acquire("a", factory), range(8)))
+
+    assert len(built) == 1
+    assert all(session is built[0] for session in sessions)
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 7
+
+
+def test_failed_factory_does_not_cache():
+    cache, _ = _recording_cache(max_size=10)
+
+    def factory():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.acquire("a", factory)
+    assert "a" not in cache
+    assert cache.get_or_create("a", object) is not None
+
+
+def test_new_session_waits_for_the_evicted_one_to_flush():
+    events = []
+    flushing = threading.Event()
+
+    def on_evict(key, session):
+        flushing.set()
+        time.sleep(0.1)
+        events.append(("flushed", key))
+
+    with ThreadPoolExecutor(1) as executor:
+        cache = SessionCache(max_size=1, on_evict=on_evict, evict_executor=executor)
+        cache.get_or_create("a", object)
+        start = time.monotonic()
+        cache.get_or_create("b", object)
+        # Eviction only schedules the flush
+        assert time.monotonic() - start < 0.1
+
+        flushing.wait()
+        cache.get_or_create("a", lambda: events.append(("built", "a")) or object())
+        assert events[:2] == [("flushed", "a"), ("built", "a")]
+
+
+def test_clear_flushes_every_session():
+    cache, evicted = _recording_cache(max_size=10)
+    cache.acquire("a", object)
+    cache.get_or_create("b", object)
+    cache.clear()
+
+    assert sorted(evicted) == ["a", "b"]
+    assert len(cache) == 0
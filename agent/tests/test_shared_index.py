@@ -0,0 +1,72 @@
+import time
+
+import faiss
+import numpy as np
+
+from agent.shared_index import SharedVectorIndex
+
+
+def _vectors(count, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype("float32")
+
+
+def test_searches_are_scoped_to_the_user():
+    index = SharedVectorIndex(train_min=10000)
+    alice, bob = _vectors(20, seed=1), _vectors(20, seed=2)
+    assert index.add("alice", 0, alice)
+    assert index.add("bob", 0, bob)
+
+    assert index.search("alice", alice[7], 1) == [7]
+    assert all(turn < 20 for turn in index.search("bob", alice[7], 3))
+    assert index.search("carol", alice[7], 3) == []
+
+
+def test_out_of_order_turns_are_rejected():
+    index = SharedVectorIndex(train_min=10000)
+    vectors = _vectors(4)
+    assert not index.add("alice", 2, vectors[2:])
+    assert index.add("alice", 0, vectors[:2])
+    assert not index.add("alice", 0, vectors[:2])
+    assert index.add("alice", 2, vectors[2:])
+    assert index.indexed_turns("alice") == 4
+
+
+def test_flat_index_is_promoted_to_ivf_in_the_background():
+    index = SharedVectorIndex(train_min=400, nprobe=4)
+    alice, bob = _vectors(300, seed=1), _vectors(300, seed=2)
+    index.add("alice", 0, alice)
+    assert not isinstance(index.index, faiss.IndexIVF)
+    index.add("bob", 0, bob)
+
+    deadline = time.monotonic() + 30
+    while not isinstance(index.index, faiss.IndexIVF) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert isinstance(index.index, faiss.IndexIVF)
+    assert len(index) == 600
+
+    # Exact neighbours are still found, per user, after promotion
+    assert index.search("alice", alice[42], 1) == [42]
+    assert index.search("bob", bob[42], 1) == [42]
+    assert index.add("alice", 300, _vectors(1, seed=3))
+    assert index.search("alice", _vectors(1, seed=3)[0], 1) == [300]
+
+
+def test_new_dimension_resets_the_index():
+    index = SharedVectorIndex(train_min=10000)
+    index.add("alice", 0, _vectors(5, dim=8))
+
+    assert index.search("alice", _vectors(1, dim=4)[0], 1) == []
+    assert index.indexed_turns("alice") == 0
+    assert index.add("alice", 0, _vectors(5, dim=4))
+    assert index.dim == 4
+
+
+def test_snapshot_round_trip(tmp_path):
+    index = SharedVectorIndex(path=str(tmp_path), train_min=10000)
+    vectors = _vectors(10)
+    index.add("alice", 0, vectors)
+    index.snapshot()
+
+    reloaded = SharedVectorIndex(path=str(tmp_path), train_min=10000)
+    assert reloaded.indexed_turns("alice") == 10
+    assert reloaded.search("alice", vectors[3], 1) == [3]